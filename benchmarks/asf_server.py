@@ -0,0 +1,325 @@
+# asf_server.py
+"""Stand-in ASF server.
+
+A local HTTP server standing in for the ASF search and download
+endpoints, serving synthetic products, so the download path can be
+benchmarked without network access or an Earthdata account.
+
+Endpoints:
+
+- `/search?start=...&end=...` returns the products acquired in the
+  interval as a geojson feature collection, `&output=count` returns the
+  number of products
+- `/download/<fileName>` serves the synthetic data of a product, with
+  support for Range requests. With `auth_redirects`, requests without
+  an authentication cookie are first redirected through `/auth`, like
+  the Earthdata login redirect chain
+
+"""
+
+import datetime
+import hashlib
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+import json
+import random
+import re
+import threading
+import time
+from urllib.parse import parse_qs
+from urllib.parse import urlencode
+from urllib.parse import urlparse
+
+# Size of the block the synthetic data is made of
+BLOCK_SIZE = 1024**2
+
+# Rotation of the block between consecutive blocks, so no two blocks of a
+# product are the same and data written at the wrong offset is detected
+BLOCK_ROTATION = 7919
+
+# Name of the cookie set by the stand-in authentication endpoint
+AUTH_COOKIE = "stand-in-auth"
+
+# Size of the chunks data is sent in
+SEND_CHUNK_SIZE = 256 * 1024
+
+
+class StandInASF:
+    """Stand-in ASF server serving synthetic products.
+
+    All products have the same synthetic data, so the md5 checksum is
+    computed once: a pseudo random block, rotated differently for every
+    block up to the product size.
+
+    Parameters
+    ----------
+    product_count: int
+        Number of products
+    product_size: int
+        Size of every product in bytes
+    latency: float
+        Seconds every request waits before the response is sent
+    bandwidth: float
+        Maximum rate of every download connection in bytes per second.
+        None for no limit
+    start: datetime.datetime
+        Acquisition time of the first product
+    spacing: datetime.timedelta
+        Time between the acquisitions of consecutive products
+    auth_redirects: bool
+        Redirect downloads without authentication cookie through `/auth`
+    ranges: bool
+        Honour Range requests, when False the whole product is sent
+    """
+
+    def __init__(
+        self,
+        product_count=8,
+        product_size=64 * 1024**2,
+        latency=0.0,
+        bandwidth=None,
+        start=datetime.datetime(2023, 1, 1, 5, 30),
+        spacing=datetime.timedelta(days=6),
+        auth_redirects=False,
+        ranges=True,
+    ):
+        self.product_size = product_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.auth_redirects = auth_redirects
+        self.ranges = ranges
+        block = random.Random(product_size).randbytes(BLOCK_SIZE)
+        # Twice, so a rotated block is a slice
+        self.block = block + block
+
+        checksum = hashlib.md5()
+        for offset in range(0, product_size, BLOCK_SIZE):
+            checksum.update(self.data(offset, min(BLOCK_SIZE, product_size - offset)))
+        self.md5sum = checksum.hexdigest()
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.stand_in = self
+        self._thread = None
+
+        self.acquisitions = [start + i * spacing for i in range(product_count)]
+        self.products = [self._feature(moment) for moment in self.acquisitions]
+
+    @property
+    def url(self):
+        """Base url of the server."""
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Start serving in a background thread."""
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="stand-in-asf", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        """Start serving."""
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        """Stop serving."""
+        self.stop()
+
+    def _feature(self, moment):
+        """Compose the geojson feature of a synthetic product."""
+        stamp = moment.strftime("%Y%m%dT%H%M%S")
+        end_stamp = (moment + datetime.timedelta(seconds=27)).strftime("%Y%m%dT%H%M%S")
+        scene_name = f"S1A_IW_SLC__1SDV_{stamp}_{end_stamp}_047000_05A000_ABCD"
+        file_name = f"{scene_name}.zip"
+        return {
+            "type": "Feature",
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [
+                    [[4.0, 51.5], [6.0, 51.5], [6.0, 53.0], [4.0, 53.0], [4.0, 51.5]]
+                ],
+            },
+            "properties": {
+                "fileName": file_name,
+                "sceneName": scene_name,
+                "fileID": f"{scene_name}-SLC",
+                "url": f"{self.url}/download/{file_name}",
+                "bytes": self.product_size,
+                "md5sum": self.md5sum,
+                "pathNumber": 88,
+                "flightDirection": "ASCENDING",
+                "polarization": "VV+VH",
+                "processingLevel": "SLC",
+                "startTime": moment.isoformat() + "Z",
+            },
+        }
+
+    def search(self, start, end):
+        """Return the products acquired in an interval.
+
+        Parameters
+        ----------
+        start: datetime.datetime
+            Start of the interval
+        end: datetime.datetime
+            End of the interval, inclusive
+
+        Returns
+        -------
+        list
+            The geojson features of the products
+        """
+        return [
+            product
+            for moment, product in zip(self.acquisitions, self.products)
+            if start <= moment <= end
+        ]
+
+    def data(self, position, size):
+        """Return synthetic data within one block.
+
+        Parameters
+        ----------
+        position: int
+            Offset of the first byte
+        size: int
+            Number of bytes, not beyond the end of the block of position
+
+        Returns
+        -------
+        bytes
+            The data
+        """
+        rotation = (position // BLOCK_SIZE * BLOCK_ROTATION) % BLOCK_SIZE
+        start = rotation + position % BLOCK_SIZE
+        return self.block[start : start + size]
+
+    def send(self, wfile, start, end):
+        """Write the synthetic data from start up to end (exclusive).
+
+        Parameters
+        ----------
+        wfile:
+            The file (or socket file) to write to
+        start: int
+            Offset of the first byte
+        end: int
+            Offset after the last byte
+        """
+        position = start
+        started = time.monotonic()
+        while position < end:
+            offset = position % BLOCK_SIZE
+            size = min(SEND_CHUNK_SIZE, BLOCK_SIZE - offset, end - position)
+            wfile.write(self.data(position, size))
+            position += size
+            if self.bandwidth:
+                # Sleep until the connection is back under its rate
+                ahead = (position - start) / self.bandwidth - (
+                    time.monotonic() - started
+                )
+                if ahead > 0:
+                    time.sleep(ahead)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Request handler of the stand-in ASF server."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        """Do not log requests."""
+
+    def do_GET(self):
+        """Handle a search or download request."""
+        stand_in = self.server.stand_in
+        if stand_in.latency:
+            time.sleep(stand_in.latency)
+
+        url = urlparse(self.path)
+        if url.path == "/search":
+            self._search(stand_in, parse_qs(url.query))
+        elif url.path == "/auth":
+            self._auth(parse_qs(url.query))
+        elif (
+            url.path.startswith("/download/")
+            and stand_in.auth_redirects
+            and AUTH_COOKIE not in self.headers.get("Cookie", "")
+        ):
+            self._redirect(f"/auth?{urlencode({'redirect': url.path})}")
+        elif url.path.startswith("/download/"):
+            self._download(stand_in, url.path[len("/download/") :])
+        else:
+            self.send_error(404)
+
+    def _redirect(self, location, cookie=None):
+        self.send_response(302)
+        self.send_header("Location", location)
+        if cookie:
+            self.send_header("Set-Cookie", f"{cookie}; Path=/")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _auth(self, query):
+        # Stands in for the login host, which sets a cookie and redirects
+        # back to the download
+        self._redirect(query["redirect"][0], cookie=f"{AUTH_COOKIE}=ok")
+
+    def _search(self, stand_in, query):
+        start = datetime.datetime.fromisoformat(query["start"][0])
+        end = datetime.datetime.fromisoformat(query["end"][0])
+        features = stand_in.search(start, end)
+        if query.get("output") == ["count"]:
+            body = json.dumps(len(features)).encode()
+        else:
+            body = json.dumps(
+                {"type": "FeatureCollection", "features": features}
+            ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _download(self, stand_in, file_name):
+        if not any(p["properties"]["fileName"] == file_name for p in stand_in.products):
+            self.send_error(404)
+            return
+
+        size = stand_in.product_size
+        start, end = 0, size
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match and stand_in.ranges:
+            start = int(match.group(1))
+            end = int(match.group(2)) + 1 if match.group(2) else size
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            end = min(end, size)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{size}")
+        else:
+            self.send_response(200)
+
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Length", str(end - start))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        try:
+            stand_in.send(self.wfile, start, end)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+# Eof
@@ -0,0 +1,170 @@
+# import_time.py
+"""Measure import time.
+
+Measures how long importing the caroline_download modules takes with
+`python -X importtime`, and how long `caroline-download --help` takes,
+each in a fresh interpreter. Fails when the command line interface
+imports a heavy dependency it should import lazily, or when an import
+takes longer than a budget, so startup time does not regress unnoticed.
+
+Usage::
+
+    python benchmarks/import_time.py --output import-time.json --max-ms 250
+
+"""
+
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import sys
+import time
+
+# Modules to measure
+MODULES = (
+    "caroline_download.cli",
+    "caroline_download.config",
+    "caroline_download.catalog",
+    "caroline_download.download",
+)
+
+# Heavy dependencies that importing the command line interface must not
+# import, they are imported when a command needs them
+LAZY_DEPENDENCIES = ("asf_search", "dateparser", "requests", "shapely")
+
+
+def import_time(module):
+    """Import a module in a fresh interpreter and collect the import times.
+
+    Parameters
+    ----------
+    module: str
+        The module to import
+
+    Returns
+    -------
+    dict
+        The self and cumulative import time in microseconds per module
+        imported
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = {
+            "self_us": int(self_time),
+            "cumulative_us": int(cumulative),
+        }
+    return times
+
+
+def help_time():
+    """Return the wall time of the command line help in seconds."""
+    started = time.perf_counter()
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys; from caroline_download.cli import main; "
+            "sys.argv = ['caroline-download', '--help']; main()",
+        ],
+        capture_output=True,
+        check=True,
+    )
+    return time.perf_counter() - started
+
+
+def main():
+    """Measure the import times and write the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--output", default="import-time.json", help="json file to write"
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="number of measurements, the fastest is reported",
+    )
+    parser.add_argument(
+        "--max-ms",
+        type=float,
+        default=None,
+        help="fail if importing caroline_download.cli takes longer",
+    )
+    parser.add_argument(
+        "--top", type=int, default=10, help="number of slowest imports to report"
+    )
+    args = parser.parse_args()
+
+    results = {}
+    failures = []
+    for module in MODULES:
+        runs = [import_time(module) for _ in range(args.repeat)]
+        times = min(runs, key=lambda run: run[module]["cumulative_us"])
+        slowest = sorted(times.items(), key=lambda item: -item[1]["self_us"])
+        results[module] = {
+            "cumulative_ms": times[module]["cumulative_us"] / 1000,
+            "modules_imported": len(times),
+            "slowest": [
+                {"module": name, "self_ms": value["self_us"] / 1000}
+                for name, value in slowest[: args.top]
+            ],
+            "lazy_dependencies_imported": [
+                name for name in LAZY_DEPENDENCIES if name in times
+            ],
+        }
+        print(
+            f"{module}: {results[module]['cumulative_ms']:.1f} ms, "
+            f"{len(times)} modules",
+            file=sys.stderr,
+        )
+
+    cli = results["caroline_download.cli"]
+    if cli["lazy_dependencies_imported"]:
+        failures.append(
+            "caroline_download.cli imports "
+            + ", ".join(cli["lazy_dependencies_imported"])
+        )
+    if args.max_ms and cli["cumulative_ms"] > args.max_ms:
+        failures.append(
+            f"importing caroline_download.cli takes {cli['cumulative_ms']:.1f} ms, "
+            f"more than {args.max_ms} ms"
+        )
+
+    help_seconds = min(help_time() for _ in range(args.repeat))
+    print(f"caroline-download --help: {help_seconds * 1000:.0f} ms", file=sys.stderr)
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "help_ms": help_seconds * 1000,
+                "imports": results,
+                "failures": failures,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+    for failure in failures:
+        print(f"FAILED: {failure}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
+
+# Eof
@@ -0,0 +1,384 @@
+# run.py
+"""Run the benchmarks.
+
+Drives the download path end to end against a local stand-in ASF server,
+see asf_server.py, and writes the results as json, so changes in
+concurrency, hashing or caching can be compared over time.
+
+Every benchmark runs in a fresh process, so its CPU time and peak memory
+are measured in isolation.
+
+Usage::
+
+    python benchmarks/run.py --output results.json
+
+"""
+
+import argparse
+from contextlib import contextmanager
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import pathlib
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+import requests
+
+from asf_server import StandInASF
+from caroline_download import download as download_module
+from caroline_download.config import Download
+from caroline_download.config import GeoSearch
+from caroline_download.product import Product
+from caroline_download.throttle import parse_bandwidth
+
+BENCHMARKS = (
+    "download",
+    "download_products",
+    "verify_checksum",
+    "split_into_monthly_intervals",
+)
+
+# Region of interest of the geo search benchmark
+ROI_WKT = "POLYGON((4.5 52.0, 5.5 52.0, 5.5 52.5, 4.5 52.5, 4.5 52.0))"
+
+
+def local_search(server_url):
+    """Create search functions querying the stand-in server.
+
+    Returns replacements for `search_interval` and `count_interval` in
+    caroline_download.download, the seam between caroline-download and
+    the ASF search api.
+    """
+
+    def query(interval, **params):
+        response = requests.get(
+            f"{server_url}/search?"
+            + urlencode(
+                {
+                    "start": interval[0].isoformat(),
+                    "end": interval[1].isoformat(),
+                    **params,
+                }
+            )
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def search_interval(geo_search, wkt_str, interval, session=None):
+        return [Product(feature) for feature in query(interval)["features"]]
+
+    def count_interval(geo_search, wkt_str, interval, session=None):
+        return query(interval, output="count")
+
+    return search_interval, count_interval
+
+
+@contextmanager
+def timed_downloads(latencies):
+    """Record the latency of every download_product call."""
+    download_product = download_module.download_product
+
+    def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return download_product(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    download_module.download_product = timed
+    try:
+        yield
+    finally:
+        download_module.download_product = download_product
+
+
+def latency_stats(latencies):
+    """Summarize latencies in seconds."""
+    if not latencies:
+        return None
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "min": latencies[0],
+        "median": statistics.median(latencies),
+        "p95": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+        "max": latencies[-1],
+    }
+
+
+def bench_download(params, work_directory):
+    """Geo search and download, through download()."""
+    search_interval, count_interval = local_search(params["server_url"])
+    download_module.search_interval = search_interval
+    download_module.count_interval = count_interval
+
+    roi_wkt_file = work_directory.joinpath("roi.wkt")
+    roi_wkt_file.write_text(ROI_WKT)
+    geo_search = GeoSearch(
+        dataset="SENTINEL-1",
+        start=datetime.datetime(2023, 1, 1),
+        end=datetime.datetime(2023, 12, 31, 23, 59, 59),
+        roi_wkt_file=roi_wkt_file,
+        relative_orbits=[88],
+        product_type="SLC",
+    )
+    download_config = Download(
+        base_directory=work_directory.joinpath("archive"),
+        max_workers=params["workers"],
+        max_search_workers=params["search_workers"],
+        transfer_segments=params["segments"],
+        min_segment_size=params["min_segment_size"],
+    )
+
+    latencies = []
+    with timed_downloads(latencies):
+        summary = download_module.download(download_config, geo_search=geo_search)
+    return {
+        "bytes": len(summary.downloaded) * params["product_size"],
+        "outcome": str(summary),
+        "latency": latency_stats(latencies),
+        "http_requests": summary.report.http_requests,
+        "http_redirects": summary.report.http_redirects,
+    }
+
+
+def bench_download_products(params, work_directory):
+    """Download a search result, through download_products()."""
+    response = requests.get(
+        f"{params['server_url']}/search?"
+        + urlencode({"start": "1900-01-01T00:00:00", "end": "2100-01-01T00:00:00"})
+    )
+    result = [Product(feature) for feature in response.json()["features"]]
+    download_config = Download(
+        base_directory=work_directory.joinpath("archive"),
+        max_workers=params["workers"],
+        transfer_segments=params["segments"],
+        min_segment_size=params["min_segment_size"],
+        catalog=False,
+    )
+
+    latencies = []
+    with timed_downloads(latencies):
+        summary = download_module.download_products(download_config, result)
+    return {
+        "bytes": len(summary.downloaded) * params["product_size"],
+        "outcome": str(summary),
+        "latency": latency_stats(latencies),
+    }
+
+
+def bench_verify_checksum(params, work_directory):
+    """Verify the checksum of a product sized file."""
+    stand_in = StandInASF(product_count=1, product_size=params["product_size"])
+    file = work_directory.joinpath("product.zip")
+    with open(file, "wb") as f:
+        stand_in.send(f, 0, stand_in.product_size)
+
+    started = time.perf_counter()
+    ok = download_module.verify_checksum(file=file, checksum=stand_in.md5sum)
+    return {
+        "bytes": params["product_size"],
+        "outcome": "ok" if ok else "checksum mismatch",
+        "latency": latency_stats([time.perf_counter() - started]),
+    }
+
+
+def bench_split_into_monthly_intervals(params, work_directory):
+    """Split a long search interval into months, repeatedly."""
+    start = datetime.datetime(1990, 1, 1)
+    end = datetime.datetime(2030, 1, 1)
+    latencies = []
+    for _ in range(params["repeat"]):
+        started = time.perf_counter()
+        intervals = download_module.split_into_monthly_intervals(start, end)
+        latencies.append(time.perf_counter() - started)
+    return {
+        "bytes": None,
+        "outcome": f"{len(intervals)} intervals",
+        "latency": latency_stats(latencies),
+    }
+
+
+def run_benchmark(name, params, queue):
+    """Run one benchmark and put its measurements on the queue."""
+    logging.basicConfig(level=logging.WARNING)
+    benchmark = globals()[f"bench_{name}"]
+    with tempfile.TemporaryDirectory(prefix=f"bench-{name}-") as work_directory:
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        result = benchmark(params, pathlib.Path(work_directory))
+        wall_time = time.perf_counter() - started
+        cpu_time = time.process_time() - cpu_started
+
+    queue.put(
+        {
+            "name": name,
+            "params": {
+                key: value for key, value in params.items() if key != "server_url"
+            },
+            "wall_time": wall_time,
+            "cpu_time": cpu_time,
+            # ru_maxrss is in kilobytes on Linux
+            "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "throughput_mb_s": (
+                result["bytes"] / wall_time / 1000**2 if result["bytes"] else None
+            ),
+            **result,
+        }
+    )
+
+
+def measure(name, params):
+    """Run a benchmark in a fresh process and return its measurements."""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=run_benchmark, args=(name, params, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def git_revision():
+    """Return the git revision of the source tree, if available."""
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    """Run the benchmarks and write the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--output", default="benchmark-results.json", help="json file to write"
+    )
+    parser.add_argument(
+        "--only", action="append", choices=BENCHMARKS, help="run only this benchmark"
+    )
+    parser.add_argument("--products", type=int, default=8, help="number of products")
+    parser.add_argument(
+        "--product-size", type=int, default=64, help="product size in MiB"
+    )
+    parser.add_argument(
+        "--workers",
+        default="1,4",
+        help="comma separated numbers of download workers to run with",
+    )
+    parser.add_argument(
+        "--search-workers", type=int, default=4, help="number of search workers"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="server latency in seconds"
+    )
+    parser.add_argument(
+        "--bandwidth",
+        default=None,
+        help="server bandwidth per connection, e.g. 100MB/s",
+    )
+    parser.add_argument(
+        "--auth-redirects",
+        action="store_true",
+        help="redirect downloads through a stand-in login until authenticated",
+    )
+    parser.add_argument(
+        "--segments",
+        type=int,
+        default=1,
+        help="number of byte ranges every product is downloaded in",
+    )
+    parser.add_argument(
+        "--min-segment-size",
+        type=int,
+        default=8,
+        help="minimum size of a byte range in MiB",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1000,
+        help="repetitions of split_into_monthly_intervals",
+    )
+    args = parser.parse_args()
+
+    product_size = args.product_size * 1024**2
+    stand_in = StandInASF(
+        product_count=args.products,
+        product_size=product_size,
+        latency=args.latency,
+        bandwidth=parse_bandwidth(args.bandwidth) if args.bandwidth else None,
+        auth_redirects=args.auth_redirects,
+    )
+
+    results = []
+    with stand_in:
+        for name in args.only or BENCHMARKS:
+            params = {"product_size": product_size}
+            if name in ("download", "download_products"):
+                runs = [
+                    {
+                        **params,
+                        "server_url": stand_in.url,
+                        "products": args.products,
+                        "workers": int(workers),
+                        "search_workers": args.search_workers,
+                        "latency": args.latency,
+                        "bandwidth": args.bandwidth,
+                        "auth_redirects": args.auth_redirects,
+                        "segments": args.segments,
+                        "min_segment_size": args.min_segment_size * 1024**2,
+                    }
+                    for workers in args.workers.split(",")
+                ]
+            elif name == "split_into_monthly_intervals":
+                runs = [{"repeat": args.repeat}]
+            else:
+                runs = [params]
+
+            for run_params in runs:
+                result = measure(name, run_params)
+                throughput = result["throughput_mb_s"]
+                print(
+                    f"{name} {result['params']}: {result['wall_time']:.2f} s, "
+                    + (f"{throughput:.1f} MB/s, " if throughput else "")
+                    + f"cpu {result['cpu_time']:.2f} s, "
+                    + f"peak rss {result['peak_rss_bytes'] / 1024**2:.0f} MiB",
+                    file=sys.stderr,
+                )
+                results.append(result)
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                "revision": git_revision(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
+
+# Eof
@@ -0,0 +1,357 @@
+# catalog.py
+"""Catalog.
+
+Keep track of the products in the archive in a local SQLite database, so
+deciding whether a product has to be downloaded is an indexed lookup in
+stead of a filesystem check, and holdings can be queried without walking
+the archive.
+
+"""
+
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from caroline_download.lock import locked
+
+# Setup logging 'library-style', see download.py
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Name of the catalog database in the state directory
+CATALOG_FILE_NAME = "catalog.sqlite"
+
+# Product statuses
+VERIFIED = "verified"
+FAILED = "failed"
+PENDING = "pending"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    file_name TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER,
+    md5 TEXT,
+    mtime REAL,
+    acquisition_date TEXT,
+    track INTEGER,
+    polarization TEXT,
+    status TEXT NOT NULL,
+    updated TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS products_track_date
+    ON products (track, acquisition_date);
+CREATE INDEX IF NOT EXISTS products_status
+    ON products (status);
+"""
+
+COLUMNS = (
+    "file_name",
+    "path",
+    "size",
+    "md5",
+    "mtime",
+    "acquisition_date",
+    "track",
+    "polarization",
+    "status",
+    "updated",
+)
+
+
+class Catalog:
+    """Local catalog of downloaded products.
+
+    The catalog may be shared between the threads of a run and between
+    processes, possibly on different hosts. Access to the database is
+    serialized with a thread lock and with the lock file of the database,
+    see lock.locked, as the fcntl locks SQLite relies on are not reliable
+    on network filesystems such as NFS and Lustre. Every update is a
+    transaction of its own.
+
+    Parameters
+    ----------
+    catalog_file: pathlib.Path
+        The SQLite database file, created if it does not exist
+    """
+
+    def __init__(self, catalog_file):
+        self.catalog_file = catalog_file
+        self._lock = threading.Lock()
+        os.makedirs(catalog_file.parent, exist_ok=True)
+        # Use the default rollback journal in stead of WAL, WAL needs
+        # shared memory which is not available on network filesystems
+        self._connection = sqlite3.connect(
+            str(catalog_file), timeout=60, check_same_thread=False
+        )
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, locked(catalog_file), self._connection:
+            self._connection.executescript(SCHEMA)
+
+    def close(self):
+        """Close the catalog."""
+        with self._lock:
+            self._connection.close()
+
+    def get(self, file_name):
+        """Get the record of a product.
+
+        Parameters
+        ----------
+        file_name: str
+            The file name of the product
+
+        Returns
+        -------
+        dict or None
+            The record of the product, None if it is not in the catalog
+        """
+        with self._lock, locked(self.catalog_file):
+            row = self._connection.execute(
+                "SELECT * FROM products WHERE file_name = ?", (file_name,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def update(self, file_name, **values):
+        """Insert or update the record of a product.
+
+        Parameters
+        ----------
+        file_name: str
+            The file name of the product
+        **values:
+            Column values to set. Columns that are not given keep their
+            current value
+        """
+        values["updated"] = datetime.datetime.now().isoformat(timespec="seconds")
+        unknown = set(values) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown catalog columns: {', '.join(unknown)}")
+
+        columns = ", ".join(["file_name", *values])
+        placeholders = ", ".join("?" * (len(values) + 1))
+        assignments = ", ".join(f"{column} = excluded.{column}" for column in values)
+
+        with self._lock, locked(self.catalog_file), self._connection:
+            self._connection.execute(
+                f"INSERT INTO products ({columns}) VALUES ({placeholders}) "
+                f"ON CONFLICT (file_name) DO UPDATE SET {assignments}",
+                (file_name, *values.values()),
+            )
+
+    def query(self, status=None, track=None, start=None, end=None):
+        """Query the products in the catalog.
+
+        Parameters
+        ----------
+        status: str
+            Only return products with this status
+        track: int
+            Only return products of this track (relative orbit)
+        start: datetime.date
+            Only return products acquired on or after this date
+        end: datetime.date
+            Only return products acquired on or before this date
+
+        Returns
+        -------
+        list
+            The records of the matching products, ordered by track and
+            acquisition date
+        """
+        conditions = []
+        parameters = []
+        if status is not None:
+            conditions.append("status = ?")
+            parameters.append(status)
+        if track is not None:
+            conditions.append("track = ?")
+            parameters.append(track)
+        if start is not None:
+            conditions.append("acquisition_date >= ?")
+            parameters.append(start.isoformat())
+        if end is not None:
+            conditions.append("acquisition_date <= ?")
+            parameters.append(end.isoformat())
+
+        sql = "SELECT * FROM products"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY track, acquisition_date"
+
+        with self._lock, locked(self.catalog_file):
+            rows = self._connection.execute(sql, parameters).fetchall()
+        return [dict(row) for row in rows]
+
+    def clear(self):
+        """Remove all products from the catalog."""
+        with self._lock, locked(self.catalog_file), self._connection:
+            self._connection.execute("DELETE FROM products")
+
+
+def open_catalog(download_config):
+    """Open the catalog of the archive.
+
+    Parameters
+    ----------
+    download_config:
+        download configuration
+
+    Returns
+    -------
+    Catalog or None
+        The catalog, None if the catalog is disabled, or if it does not
+        exist yet during a dry run
+    """
+    if not download_config.catalog:
+        return None
+
+    catalog_file = download_config.state_directory.joinpath(CATALOG_FILE_NAME)
+    if download_config.dry_run and not catalog_file.exists():
+        return None
+
+    logger.debug("Opening catalog %s.", catalog_file)
+    return Catalog(catalog_file)
+
+
+def product_record(properties):
+    """Compose the catalog columns describing a product.
+
+    Parameters
+    ----------
+    properties: dict
+        The properties of the product as returned by ASF
+
+    Returns
+    -------
+    dict
+        The acquisition_date, track and polarization of the product
+    """
+    return {
+        "acquisition_date": acquisition_date(properties["fileName"]),
+        "track": int(properties["pathNumber"]),
+        "polarization": properties["polarization"],
+    }
+
+
+def acquisition_date(file_name):
+    """Get the acquisition date of a product from its file name.
+
+    Parameters
+    ----------
+    file_name: str
+        The file name of the product
+
+    Returns
+    -------
+    str
+        The acquisition date in ISO format (YYYY-MM-DD)
+    """
+    # Get startdate from filename, like compose_product_download_path
+    return f"{file_name[17:21]}-{file_name[21:23]}-{file_name[23:25]}"
+
+
+def iter_archive(base_directory, exclude=()):
+    """Iterate over the products in an archive tree.
+
+    Parameters
+    ----------
+    base_directory: pathlib.Path
+        The top level directory of the archive
+    exclude: tuple
+        Directories that are not part of the archive, e.g. the state
+        directory
+
+    Yields
+    ------
+    tuple
+        The path of a product zip and the path of its geojson sidecar.
+        Products are found by either file, the other one may not exist
+    """
+    exclude = {os.path.abspath(directory) for directory in exclude}
+    for directory, directories, files in os.walk(base_directory):
+        directories[:] = sorted(
+            d
+            for d in directories
+            if os.path.abspath(os.path.join(directory, d)) not in exclude
+        )
+        products = sorted(
+            {
+                os.path.splitext(file)[0]
+                for file in files
+                if file.endswith((".zip", ".json"))
+            }
+        )
+        for product in products:
+            zip_file = base_directory.joinpath(
+                os.path.relpath(os.path.join(directory, product), base_directory)
+            )
+            yield zip_file.with_suffix(".zip"), zip_file.with_suffix(".json")
+
+
+def rebuild_catalog(download_config):
+    """Repopulate the catalog from an existing archive tree.
+
+    No checksums are computed, so products are recorded as pending, or
+    as failed when their size differs from the size in their geojson
+    sidecar. Run the verify command afterwards to record the products
+    that pass verification as verified.
+
+    Parameters
+    ----------
+    download_config:
+        download configuration
+
+    Returns
+    -------
+    dict
+        The number of products recorded per status
+    """
+    catalog_file = download_config.state_directory.joinpath(CATALOG_FILE_NAME)
+    logger.info(f"Rebuilding catalog {catalog_file}")
+
+    catalog = Catalog(catalog_file)
+    counts = {PENDING: 0, FAILED: 0}
+    try:
+        catalog.clear()
+        for zip_file, geojson_file in iter_archive(
+            download_config.base_directory,
+            exclude=(download_config.state_directory,),
+        ):
+            if not zip_file.exists():
+                continue
+
+            stat = zip_file.stat()
+            values = {
+                "path": str(zip_file),
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "acquisition_date": acquisition_date(zip_file.name),
+                "status": PENDING,
+            }
+
+            if geojson_file.exists():
+                with open(geojson_file, "r") as f:
+                    properties = json.load(f)["properties"]
+                values.update(product_record(properties))
+                values["md5"] = properties.get("md5sum")
+                if (
+                    properties.get("bytes") is not None
+                    and int(properties["bytes"]) != stat.st_size
+                ):
+                    values["status"] = FAILED
+
+            logger.debug("Recording %s as %s.", zip_file.name, values["status"])
+            catalog.update(zip_file.name, **values)
+            counts[values["status"]] += 1
+    finally:
+        catalog.close()
+
+    logger.info(f"Catalog rebuilt: {counts[PENDING]} pending, {counts[FAILED]} failed")
+    return counts
+
+
+# Eof
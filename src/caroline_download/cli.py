@@ -6,13 +6,20 @@ Provides access to basic functionality in the API from the command line.
 """
 
 import argparse
+import atexit
 import importlib.metadata
 import logging
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
 from logging.handlers import TimedRotatingFileHandler
+import queue
 import sys
+import threading
 
 from caroline_download.config import get_config
-from caroline_download.download import download
+
+# The modules implementing the commands are imported when the command
+# runs, so e.g. --help and check do not pay for importing asf_search
 
 PROGRAM_NAME = "caroline-download"
 
@@ -36,6 +43,20 @@ def main():
     # Parse arguments and store result in args variable
     args = parse_args()
 
+    if args.profile:
+        profile(run, args, profile_file=args.profile)
+    else:
+        run(args)
+
+
+def run(args):
+    """Run the command given on the command line.
+
+    Parameters
+    ----------
+    args: argparse.Namespace
+        the parsed arguments
+    """
     # Build configuration
     config = get_config(args=args)
 
@@ -46,15 +67,99 @@ def main():
         f"Starting {PROGRAM_NAME}"
         f" v{importlib.metadata.version('caroline-download')}"
     )
-    logger.debug(f"Configuration: {config}")
+    logger.debug("Configuration: %s", config)
+
+    if args.command == "check":
+        # Configuration is valid, get_config exits otherwise
+        print("Configuration OK")
+        return
+
+    if args.command == "rebuild":
+        from caroline_download.catalog import rebuild_catalog
+
+        rebuild_catalog(download_config=config.download)
+        return
+
+    if args.command == "verify":
+        from caroline_download.verify import verify_archive
+
+        report = verify_archive(
+            download_config=config.download,
+            fast=args.fast,
+            redownload=args.redownload,
+        )
+        if report.corrupt or report.missing:
+            sys.exit(1)
+        return
+
+    if args.watch:
+        from caroline_download.watch import parse_interval
+        from caroline_download.watch import watch
+
+        watch(
+            download_config=config.download,
+            geo_search=config.geo_searches,
+            interval=parse_interval(args.watch),
+        )
+        return
+
+    from caroline_download.download import download
 
     download(
         download_config=config.download,
-        geo_search=config.geo_search,
+        geo_search=config.geo_searches,
         product_search=config.product_search,
+        product_list=config.product_list,
+        plan=config.plan,
     )
 
 
+def profile(function, *args, profile_file):
+    """Call a function with profiling, writing the profile to a file.
+
+    The profile includes the threads started by the function, e.g. the
+    search and download workers. The profile is written even when the
+    function raises an exception or exits.
+
+    Parameters
+    ----------
+    function: callable
+        the function to call
+    *args:
+        arguments of the function
+    profile_file: str
+        the file to write the profile to, in pstats format. Inspect it with
+        e.g. `python -m pstats FILE`
+    """
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    thread_profilers = []
+
+    if sys.version_info < (3, 12):
+        # Before Python 3.12 a profiler only sees the thread that enabled
+        # it, give every new thread a profiler of its own
+        def enable_thread_profiler(*_):
+            thread_profiler = cProfile.Profile()
+            thread_profilers.append(thread_profiler)
+            thread_profiler.enable()
+
+        threading.setprofile(enable_thread_profiler)
+
+    profiler.enable()
+    try:
+        function(*args)
+    finally:
+        profiler.disable()
+        threading.setprofile(None)
+        stats = pstats.Stats(profiler)
+        for thread_profiler in thread_profilers:
+            stats.add(thread_profiler)
+        stats.dump_stats(profile_file)
+        print(f"Profile written to {profile_file}", file=sys.stderr)
+
+
 def parse_args():
     """Parse command line arguments.
 
@@ -71,15 +176,49 @@ def parse_args():
     )
 
     # Add arguments to argument parser
+    parser.add_argument(
+        "command",
+        nargs="?",
+        default="download",
+        choices=["download", "rebuild", "verify", "check"],
+        help="download products (default), rebuild the product catalog "
+        "from the files in the base directory, verify the checksums of "
+        "the files in the base directory or check the configuration "
+        "without accessing the network",
+    )
     parser.add_argument(
         "--config",
         help="configuration file to use",
     )
     parser.add_argument(
         "--geo-search",
-        help="download based on geo search",
+        action="append",
+        help="download based on geo search. Repeat the option, or give a "
+        "directory of search files, to search several areas together",
     )
     parser.add_argument("--product-search", help="download a single product")
+    parser.add_argument(
+        "--product-list",
+        help="download the products named in PRODUCT_LIST, one per line. "
+        "Use - to read from stdin",
+    )
+    parser.add_argument(
+        "--plan-out",
+        metavar="FILE",
+        help="do not download, write what would be done for every product to "
+        "FILE as NDJSON. Use - for stdout",
+    )
+    parser.add_argument(
+        "--from-plan",
+        metavar="FILE",
+        help="download the products in a plan written with --plan-out, "
+        "without searching. Use - to read from stdin",
+    )
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="only download the products that failed in earlier runs",
+    )
     parser.add_argument(
         "--force",
         action="store_true",
@@ -93,6 +232,60 @@ def parse_args():
         action="store_true",
         help="perform dry run. do not actually download anything",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="number of products to download (or verify) concurrently",
+    )
+    parser.add_argument(
+        "--segments",
+        type=int,
+        help="split every product into up to SEGMENTS byte ranges that are "
+        "downloaded in parallel",
+    )
+    parser.add_argument(
+        "--shard",
+        metavar="I/N",
+        help="only download the products of shard I of N, "
+        "to split a download over several workers",
+    )
+    parser.add_argument(
+        "--watch",
+        metavar="INTERVAL",
+        help="keep running and poll the geo search every INTERVAL, "
+        "e.g. 30m or 6h, until stopped with SIGTERM",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only search since the last successful run of the geo search",
+    )
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        help="verify: only compare size and modification time, not checksums",
+    )
+    parser.add_argument(
+        "--redownload",
+        action="store_true",
+        help="verify: download corrupt and missing products again",
+    )
+    parser.add_argument(
+        "--report",
+        metavar="FILE",
+        help="write a json report of the run to FILE",
+    )
+    parser.add_argument(
+        "--prometheus-textfile",
+        metavar="FILE",
+        help="write metrics of the run to FILE, for the node exporter textfile "
+        "collector",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="profile the run and write the profile to FILE in pstats format",
+    )
     parser.add_argument("--log-file", help="log to LOG_FILE")
     parser.add_argument("--log-level", help="set log level")
     parser.add_argument(
@@ -105,13 +298,19 @@ def parse_args():
 def setup_logging(log_config):
     """Set up logging.
 
+    The loggers only put their records on a queue, a single background
+    thread writes them to the console and the log file. A slow log
+    destination, e.g. a log file on NFS, does not stall the threads that
+    log. The queue is flushed when the program exits.
+
     Parameters
     ----------
     log_config: int
         logging configuration object
 
     """
-    console_log = logging.StreamHandler(sys.stdout)
+    # Log to stderr, stdout is kept for output, e.g. a plan written to '-'
+    console_log = logging.StreamHandler(sys.stderr)
     console_log_format = logging.Formatter(log_config.console_log.format)
     console_log.setLevel(log_config.console_log.level.value)
     console_log.setFormatter(console_log_format)
@@ -132,32 +331,34 @@ def setup_logging(log_config):
             )
             sys.exit(1)
 
+    handlers = [console_log] if log_config.console_log.enable else []
+    if log_config.file_log.file:
+        handlers.append(file_log)
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    queue_log = QueueHandler(log_queue)
+
     root_logger = logging.getLogger()
     root_logger.setLevel(log_config.root_logger.level.value)
-    root_logger.addHandler(console_log)
-    if log_config.file_log.file:
-        root_logger.addHandler(file_log)
+    root_logger.addHandler(queue_log)
 
     cli_logger = logging.getLogger(PROGRAM_NAME)
     cli_logger.setLevel(log_config.cli_logger.level.value)
     cli_logger.propagate = False
-    cli_logger.addHandler(console_log)
-    if log_config.file_log.file:
-        cli_logger.addHandler(file_log)
+    cli_logger.addHandler(queue_log)
 
-    download_logger = logging.getLogger("caroline_download.download")
+    # The package logger, so the messages of all its modules are handled
+    download_logger = logging.getLogger("caroline_download")
     download_logger.setLevel(log_config.download_logger.level.value)
     download_logger.propagate = False
-    download_logger.addHandler(console_log)
-    if log_config.file_log.file:
-        download_logger.addHandler(file_log)
+    download_logger.addHandler(queue_log)
 
     asf_logger = logging.getLogger("asf-search")
     asf_logger.setLevel(log_config.asf_logger.level.value)
     asf_logger.propagate = False
-    asf_logger.addHandler(console_log)
-    if log_config.file_log.file:
-        asf_logger.addHandler(file_log)
+    asf_logger.addHandler(queue_log)
 
     return cli_logger
 
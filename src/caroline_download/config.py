@@ -17,9 +17,12 @@ import pathlib
 import sys
 
 import dacite
-import dateparser
 import yaml
 
+from caroline_download.shard import parse_shard
+from caroline_download.space import parse_size
+from caroline_download.throttle import parse_bandwidth
+
 DEFAULT_LOG_LEVEL = "INFO"
 DEFAULT_LOG_FORMAT = (
     "%(asctime)s"
@@ -40,6 +43,26 @@ class GeoSearch:
     roi_wkt_file: pathlib.Path
     relative_orbits: List[int]
     product_type: str
+    # Name of the area of interest in logs and reports, defaults to the
+    # name of the search specification file
+    name: Optional[str] = None
+    # Simplify the region of interest within this tolerance, in degrees
+    simplify_tolerance: Optional[float] = None
+    # Split the region of interest into tiles of at most this size, in
+    # degrees, that are searched separately
+    tile_size: Optional[float] = None
+
+
+@dataclass
+class PostDownloadHook:
+    """Data class for post-download hook configuration."""
+
+    # Python function, 'module:function' or the name of an installed
+    # entry point, see postprocess.load_hook
+    entry_point: Optional[str] = None
+    # Command and arguments, with placeholders, see postprocess.run_command
+    command: Optional[List[str]] = None
+    timeout: Optional[int] = None
 
 
 @dataclass
@@ -50,6 +73,41 @@ class Download:
     force: bool = False
     dry_run: Optional[bool] = False
     verify: bool = True
+    max_workers: int = 1
+    max_search_workers: int = 1
+    adaptive_search: bool = False
+    max_search_results: int = 250
+    incremental: bool = False
+    search_cache_ttl: int = 0
+    publication_delay_days: int = 7
+    catalog: bool = True
+    verify_workers: Optional[int] = None
+    max_bandwidth: Optional[str] = None
+    max_connections: Optional[int] = None
+    retries: int = 3
+    retry_backoff: int = 2
+    retry_max_backoff: int = 300
+    circuit_breaker_threshold: int = 10
+    circuit_breaker_pause: int = 300
+    retry_failed: bool = False
+    shard: Optional[str] = None
+    lock_stale_after: int = 900
+    transfer_segments: int = 1
+    min_segment_size: int = 64 * 1024**2
+    min_free_space: Optional[str] = None
+    preallocate: bool = True
+    post_workers: Optional[int] = None
+    post_download_hooks: Optional[List[PostDownloadHook]] = None
+    report_file: Optional[pathlib.Path] = None
+    plan_file: Optional[pathlib.Path] = None
+    prometheus_file: Optional[pathlib.Path] = None
+    phase_timers: bool = True
+    state_directory: Optional[pathlib.Path] = None
+
+    def __post_init__(self):
+        """Derive defaults that depend on other fields."""
+        if self.state_directory is None:
+            self.state_directory = self.base_directory.joinpath(".caroline-download")
 
 
 class LogLevel(Enum):
@@ -100,6 +158,7 @@ class Logging:
     )
     root_logger: Logger = Logger(level=LogLevel["WARNING"])
     cli_logger: Logger = Logger(level=LogLevel[DEFAULT_LOG_LEVEL])
+    # Logger of all modules of the caroline_download package
     download_logger: Logger = Logger(level=LogLevel[DEFAULT_LOG_LEVEL])
     asf_logger: Logger = Logger(level=LogLevel["WARNING"])
 
@@ -111,20 +170,180 @@ class Config:
     download: Download
     geo_search: Optional[GeoSearch]
     product_search: Optional[str]
+    product_list: Optional[List[str]] = None
+    # Entries of a download plan to execute, see plan.read_plan
+    plan: Optional[List[dict]] = None
+    # All geo searches of the run, planned and downloaded together
+    geo_searches: Optional[List[GeoSearch]] = None
     logging: Logging = Logging()
 
 
-def parse_datetime(datetime):
+def parse_datetime(datetime_str):
     """Parse time(range) specifications.
 
     Allows parsing of human formatted time(range)
     specifications such as 'one month ago' to a datetime
+
+    ISO 8601 dates are parsed directly, dateparser, which is slow to
+    import, is only used for other specifications.
     """
-    return dateparser.parse(datetime).replace(microsecond=0)
+    if isinstance(datetime_str, datetime.datetime):
+        # Already parsed by the yaml loader
+        return datetime_str.replace(microsecond=0)
+    try:
+        return datetime.datetime.fromisoformat(str(datetime_str)).replace(microsecond=0)
+    except ValueError:
+        pass
+
+    import dateparser
+
+    return dateparser.parse(str(datetime_str)).replace(microsecond=0)
+
+
+def read_product_list(product_list_file):
+    """Read a list of product names.
+
+    Parameters
+    ----------
+    product_list_file: str
+        File with one product name per line, or '-' to read from stdin.
+        Empty lines and lines starting with '#' are ignored
+
+    Returns
+    -------
+    list
+        The product names
+    """
+    if product_list_file == "-":
+        lines = sys.stdin.readlines()
+    elif os.path.exists(product_list_file):
+        with open(product_list_file, "r") as f:
+            lines = f.readlines()
+    else:
+        print(f"ERROR: File not found: {product_list_file}", file=sys.stderr)
+        sys.exit(1)
+
+    return [
+        line.strip()
+        for line in lines
+        if line.strip() and not line.strip().startswith("#")
+    ]
+
+
+def find_geo_search_files(paths):
+    """Find geo search specification files.
+
+    Parameters
+    ----------
+    paths: list
+        Files, or directories containing '*.yml' and '*.yaml' files
+
+    Returns
+    -------
+    list
+        The files, those in a directory in sorted order
+    """
+    files = []
+    for path in map(pathlib.Path, paths):
+        if path.is_dir():
+            files.extend(
+                sorted(
+                    file
+                    for pattern in ("*.yml", "*.yaml")
+                    for file in path.glob(pattern)
+                    if file.is_file()
+                )
+            )
+        elif path.exists():
+            files.append(path)
+        else:
+            print(f"ERROR: File not found: {path}", file=sys.stderr)
+            sys.exit(1)
+
+    if not files:
+        print(
+            f"ERROR: No geo search files found in {', '.join(map(str, paths))}",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    return list(dict.fromkeys(files))
+
+
+def read_geo_searches(geo_search_files):
+    """Read geo search specifications.
+
+    Parameters
+    ----------
+    geo_search_files: list
+        The files to read, see find_geo_search_files
+
+    Returns
+    -------
+    list
+        The geo searches, named after their file unless they have a name
+    """
+    geo_searches = []
+    names = set()
+    for geo_search_file in geo_search_files:
+        with open(geo_search_file, "r") as f:
+            geo_search_dict = (yaml.safe_load(f) or {}).get("geo_search")
+        if not geo_search_dict:
+            print(f"ERROR: No geo_search in {geo_search_file}", file=sys.stderr)
+            sys.exit(1)
+
+        geo_search = dacite.from_dict(
+            data_class=GeoSearch,
+            data=geo_search_dict,
+            config=dacite.Config(type_hooks=converters),
+        )
+        if not geo_search.name:
+            # Files with the same name in different directories
+            geo_search.name = (
+                geo_search_file.stem
+                if geo_search_file.stem not in names
+                else str(geo_search_file)
+            )
+        names.add(geo_search.name)
+        geo_searches.append(geo_search)
+
+    return geo_searches
+
+
+def check_geo_search(geo_search):
+    """Check the region of interest and parameters of a geo search.
+
+    Exits with an error message when the search is not valid.
+
+    Parameters
+    ----------
+    geo_search: GeoSearch
+        The geo search to check
+    """
+    from caroline_download.geometry import load_roi
+
+    for parameter in ("simplify_tolerance", "tile_size"):
+        value = getattr(geo_search, parameter)
+        if value is not None and value <= 0:
+            print(
+                f"ERROR: {parameter} of {geo_search.name or geo_search.roi_wkt_file} "
+                "must be positive",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+
+    with open(geo_search.roi_wkt_file, "r") as wkt_file:
+        wkt_str = wkt_file.read().replace("\n", "")
+    try:
+        load_roi(wkt_str)
+    except ValueError as err:
+        print(f"ERROR: {geo_search.roi_wkt_file}: {err}", file=sys.stderr)
+        sys.exit(1)
 
 
 converters = {
     pathlib.Path: pathlib.Path,
+    float: float,
     datetime.datetime: lambda x: parse_datetime(x),
     LogLevel: lambda x: LogLevel[x],
 }
@@ -165,36 +384,83 @@ def get_config(args):
     with open(config_file, "r") as config_file:
         config_dict = yaml.safe_load(config_file)
 
-    if not any((args.geo_search, args.product_search)):
+    if args.command == "download" and not any(
+        (
+            args.geo_search,
+            args.product_search,
+            args.product_list,
+            args.retry_failed,
+            args.from_plan,
+        )
+    ):
         print(
-            "ERROR: You must use either the --geo-search " + "or the --product option.",
+            "ERROR: You must use either the --geo-search, the --product-search, "
+            + "the --product-list, the --from-plan or the --retry-failed option.",
             file=sys.stderr,
         )
         sys.exit(1)
 
-    if args.geo_search:
-        # Read yaml specified in argument and merge in config_dict
-        if os.path.exists(args.geo_search):
-            with open(args.geo_search, "r") as geo_search_file:
-                geo_search_dict = yaml.safe_load(geo_search_file)
-            config_dict.update(geo_search_dict)
-        else:
-            print(f"File not found: {args.geo_search}", file=sys.stderr)
-            sys.exit(1)
+    if args.from_plan and any(
+        (args.geo_search, args.product_search, args.product_list, args.plan_out)
+    ):
+        print(
+            "ERROR: --from-plan cannot be combined with a search or --plan-out.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
 
     config = dacite.from_dict(
         data_class=Config, data=config_dict, config=dacite.Config(type_hooks=converters)
     )
 
+    if args.geo_search:
+        # Searches given as arguments replace those in the config file
+        config.geo_searches = read_geo_searches(find_geo_search_files(args.geo_search))
+        config.geo_search = config.geo_searches[0]
+    elif config.geo_search and not config.geo_searches:
+        config.geo_searches = [config.geo_search]
+
     if args.product_search:
         config.product_search = args.product_search
 
+    if args.product_list:
+        config.product_list = read_product_list(args.product_list)
+
+    if args.from_plan:
+        from caroline_download.plan import read_plan
+
+        if args.from_plan != "-" and not os.path.exists(args.from_plan):
+            print(f"ERROR: File not found: {args.from_plan}", file=sys.stderr)
+            sys.exit(1)
+        try:
+            config.plan = read_plan(args.from_plan)
+        except ValueError as err:
+            print(f"ERROR: {err}", file=sys.stderr)
+            sys.exit(1)
+
+    if args.plan_out:
+        config.download.plan_file = pathlib.Path(args.plan_out)
+
     if args.force:
         config.download.force = True
 
     if args.dry_run:
         config.download.dry_run = True
 
+    if args.workers and args.command == "verify":
+        config.download.verify_workers = args.workers
+    elif args.workers:
+        config.download.max_workers = args.workers
+
+    if args.segments:
+        config.download.transfer_segments = args.segments
+
+    if args.incremental:
+        config.download.incremental = True
+
+    if args.retry_failed:
+        config.download.retry_failed = True
+
     if args.log_file:
         config.logging.file_log.file = args.log_file
 
@@ -207,15 +473,70 @@ def get_config(args):
         config.logging.asf_logger.level = LogLevel[args.log_level.upper()]
 
     if args.quiet:
-        config.logging.console_log.level = LogLevel["NOTSET"]
+        config.logging.console_log.enable = False
+
+    if args.shard:
+        config.download.shard = args.shard
+
+    if args.watch:
+        from caroline_download.watch import parse_interval
+
+        if not config.geo_searches or args.product_search or args.product_list:
+            print(
+                "ERROR: --watch requires a --geo-search, and no product search.",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+        try:
+            parse_interval(args.watch)
+        except ValueError as err:
+            print(f"ERROR: {err}", file=sys.stderr)
+            sys.exit(1)
+
+    if args.report:
+        config.download.report_file = pathlib.Path(args.report)
+
+    if args.prometheus_textfile:
+        config.download.prometheus_file = pathlib.Path(args.prometheus_textfile)
+
+    if config.download.shard:
+        try:
+            parse_shard(config.download.shard)
+        except ValueError as err:
+            print(f"ERROR: {err}", file=sys.stderr)
+            sys.exit(1)
+
+    if config.download.min_free_space:
+        try:
+            parse_size(config.download.min_free_space)
+        except ValueError as err:
+            print(f"ERROR: {err}", file=sys.stderr)
+            sys.exit(1)
+
+    if config.download.max_bandwidth:
+        try:
+            parse_bandwidth(config.download.max_bandwidth)
+        except ValueError as err:
+            print(f"ERROR: {err}", file=sys.stderr)
+            sys.exit(1)
+
+    for hook in config.download.post_download_hooks or []:
+        from caroline_download.postprocess import load_hook
+
+        try:
+            load_hook(hook)
+        except ValueError as err:
+            print(f"ERROR: {err}", file=sys.stderr)
+            sys.exit(1)
 
-    if config.geo_search:
-        if not config.geo_search.roi_wkt_file.exists():
+    for geo_search in config.geo_searches or []:
+        if not geo_search.roi_wkt_file.exists():
             print(
-                f"ERROR: No such file: {config.geo_search.roi_wkt_file}",
+                f"ERROR: No such file: {geo_search.roi_wkt_file}",
                 file=sys.stderr,
             )
             sys.exit(1)
+        check_geo_search(geo_search)
 
     return config
 
@@ -1,15 +1,66 @@
 # download.py
 """Download."""
 
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from concurrent.futures import wait
+from contextlib import contextmanager
+from contextlib import nullcontext
+from dataclasses import dataclass
+from dataclasses import field
+from dataclasses import replace
+from datetime import datetime
 from datetime import timedelta
 from dateutil.relativedelta import relativedelta
 import hashlib
-import json
 import logging
 import os
-import sys
+import threading
+import time
+from typing import List
+from typing import Optional
 
-import asf_search as asf
+# asf_search takes long to import, it is imported in the functions that
+# need it, so e.g. the command line help and catalog queries stay fast
+from caroline_download.catalog import FAILED as CATALOG_FAILED
+from caroline_download.catalog import PENDING
+from caroline_download.catalog import VERIFIED
+from caroline_download.catalog import Catalog
+from caroline_download.catalog import open_catalog
+from caroline_download.catalog import product_record
+from caroline_download.geometry import ROI_CACHE_DIRECTORY_NAME
+from caroline_download.geometry import prepare_roi
+from caroline_download.lock import ProductLock
+from caroline_download.plan import DOWNLOAD as DOWNLOAD_ACTION
+from caroline_download.plan import REPLACE as REPLACE_ACTION
+from caroline_download.plan import SKIP as SKIP_ACTION
+from caroline_download.plan import PlanWriter
+from caroline_download.plan import plan_products
+from caroline_download.postprocess import PostProcessor
+from caroline_download.postprocess import load_hook
+from caroline_download.postprocess import write_sidecar
+from caroline_download.report import RunReport
+from caroline_download.retry import CircuitBreaker
+from caroline_download.retry import FailureJournal
+from caroline_download.retry import retry_call
+from caroline_download.search_state import SearchCache
+from caroline_download.search_state import Watermarks
+from caroline_download.search_state import search_key
+from caroline_download.shard import in_shard
+from caroline_download.shard import parse_shard
+from caroline_download.space import DiskSpace
+from caroline_download.space import InsufficientDiskSpace
+from caroline_download.space import format_size
+from caroline_download.space import parse_size
+from caroline_download.throttle import Throttle
+from caroline_download.throttle import format_rate
+from caroline_download.transfer import TransferInterrupted
+from caroline_download.transfer import part_file_for
+from caroline_download.transfer import segmented_transfer
+from caroline_download.transfer import transfer
+from caroline_download.transfer import update_checksum
 
 # Setup logging 'library-style':
 # Add null handle so we do nothing by default. It's up to whatever
@@ -19,6 +70,181 @@ import asf_search as asf
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
+# Possible outcomes of downloading a single product
+DOWNLOADED = "downloaded"
+SKIPPED = "skipped"
+PLANNED = "planned"
+FAILED = "failed"
+
+# Number of product names searched for in a single ASF request
+PRODUCT_SEARCH_BATCH_SIZE = 100
+
+
+@dataclass
+class DownloadSummary:
+    """Data class summarizing the outcome of downloading products.
+
+    Each attribute holds the file names of the products with that outcome.
+    """
+
+    downloaded: List[str] = field(default_factory=list)
+    skipped: List[str] = field(default_factory=list)
+    planned: List[str] = field(default_factory=list)
+    failed: List[str] = field(default_factory=list)
+    # Names of a product list that were not found at ASF
+    not_found: List[str] = field(default_factory=list)
+    # Measurements of the run, set by download
+    report: Optional[RunReport] = field(default=None, repr=False)
+
+    def add(self, outcome, file_name):
+        """Record the outcome for a product.
+
+        Parameters
+        ----------
+        outcome: str
+            One of DOWNLOADED, SKIPPED, PLANNED or FAILED
+        file_name: str
+            The file name of the product
+        """
+        getattr(self, outcome).append(file_name)
+
+    def merge(self, other):
+        """Merge another summary into this one.
+
+        Parameters
+        ----------
+        other: DownloadSummary
+            The summary to merge
+        """
+        for outcome in (DOWNLOADED, SKIPPED, PLANNED, FAILED):
+            getattr(self, outcome).extend(getattr(other, outcome))
+        self.not_found.extend(other.not_found)
+
+    def __str__(self):
+        """Return a one line representation of the counts."""
+        counts = [
+            f"{len(getattr(self, outcome))} {outcome}"
+            for outcome in (DOWNLOADED, SKIPPED, PLANNED, FAILED)
+        ]
+        if self.not_found:
+            counts.append(f"{len(self.not_found)} not found")
+        return ", ".join(counts)
+
+
+class PhaseTimers:
+    """Wall time spent in the phases of a run.
+
+    Durations are summed over all threads, so with concurrent downloads
+    the total of a phase can exceed the duration of the run. When
+    disabled, timing a phase costs no more than entering an empty context
+    manager.
+
+    Parameters
+    ----------
+    enabled: bool
+        Whether phases are timed
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _timed(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def phase(self, name):
+        """Time a phase.
+
+        Parameters
+        ----------
+        name: str
+            The name of the phase, e.g. 'search' or 'transfer'
+
+        Returns
+        -------
+        contextlib.AbstractContextManager
+            Context manager timing the code it wraps
+        """
+        if not self.enabled:
+            return _NOT_TIMED
+        return self._timed(name)
+
+    def add(self, name, seconds):
+        """Add time spent in a phase.
+
+        Parameters
+        ----------
+        name: str
+            The name of the phase
+        seconds: float
+            The time spent
+        """
+        with self._lock:
+            count, total = self._totals.get(name, (0, 0.0))
+            self._totals[name] = (count + 1, total + seconds)
+
+    def totals(self):
+        """Return the time spent per phase.
+
+        Returns
+        -------
+        dict
+            The number of times and the total seconds spent per phase
+        """
+        with self._lock:
+            return {
+                name: {"count": count, "seconds": seconds}
+                for name, (count, seconds) in self._totals.items()
+            }
+
+    def reset(self):
+        """Forget all time spent."""
+        with self._lock:
+            self._totals.clear()
+
+    def __str__(self):
+        """Return a one line summary of the time spent per phase."""
+        return ", ".join(
+            f"{name} {total['seconds']:.1f} s ({total['count']}x)"
+            for name, total in self.totals().items()
+        )
+
+
+# Reusable context manager doing nothing, for disabled phase timers
+_NOT_TIMED = nullcontext()
+
+# Phase timers of the run, see download
+phase_timers = PhaseTimers()
+
+
+@dataclass
+class DownloadContext:
+    """Data class with the resources shared by the downloads of a run."""
+
+    catalog: Optional[Catalog] = None
+    throttle: Optional[Throttle] = None
+    breaker: Optional[CircuitBreaker] = None
+    journal: Optional[FailureJournal] = None
+    report: Optional[RunReport] = None
+    # Session used for searches and transfers, None for a new session
+    # per request
+    session: Optional[object] = None
+    # Set to stop the run, transfers in progress are interrupted
+    stop: Optional[threading.Event] = None
+    # Free space of the base directory, None for no admission control
+    space: Optional[DiskSpace] = None
+    # Records the action for every product, None for no plan
+    plan: Optional[PlanWriter] = None
+    # Post-processes downloaded products, None to post-process them on
+    # the thread that transferred them
+    post: Optional[PostProcessor] = None
+
 
 def compose_product_download_path(
     base_directory, file_name, relative_orbit, orbit_direction, polarization
@@ -84,143 +310,1464 @@ def compose_product_download_path(
     return path
 
 
-def download(download_config, geo_search=None, product_search=None):
+def download(
+    download_config,
+    geo_search=None,
+    product_search=None,
+    product_list=None,
+    session=None,
+    stop=None,
+    plan=None,
+):
     """Download.
 
+    Calls to ASF are retried on transient errors, see `_call_asf`.
+    Products that fail are recorded in the failure journal in the state
+    directory. When `download_config.retry_failed` is set, only the
+    products in the journal are downloaded and no search is performed.
+
+    When `download_config.plan_file` is set, the action for every product
+    found is written to it as a plan, see caroline_download.plan, in
+    stead of downloading. A plan is executed with the `plan` parameter.
+
     Parameters
     ----------
     download_config:
         download configuration
     geo_search:
-        search configuration
+        search configuration, or a list of search configurations that
+        are searched together. A product found by several searches is
+        downloaded once
     product_search:
         product name
+    product_list:
+        list of product names
+    session: asf_search.ASFSession
+        authenticated session to reuse, e.g. between runs of a watch.
+        None to create one for the run, see create_session. The session
+        is used for all searches and transfers of the run
+    stop: threading.Event
+        when set, the run stops: intervals not searched yet are not
+        searched, products not started yet are not downloaded and
+        transfers in progress are interrupted, keeping their partial file
+        to resume from
+    plan: list
+        entries of a plan to execute, see caroline_download.plan.read_plan.
+        No search is performed, the products to download or replace are
+        downloaded
+
+    Returns
+    -------
+    DownloadSummary
+        Summary of the outcome for every product found, with a report of
+        the measurements of the run
     """
     logger.info("Starting download")
-    logger.debug(f"Download configuration: {download_config}")
-
-    if product_search:
-        logger.info(f"Performing product search for product {product_search}")
-        result = asf.product_search(product_search)
-        product_count = len(result)
-
-        if product_count > 1:
-            logger.error(
-                "Found more than one product while performing "
-                "product search. This should not happen according "
-                "to the ASF api documentation. Aborting."
+    logger.debug("Download configuration: %s", download_config)
+
+    if download_config.plan_file:
+        # Making a plan, nothing is downloaded
+        download_config = replace(download_config, dry_run=True)
+
+    if geo_search is not None and not isinstance(geo_search, (list, tuple)):
+        geo_search = [geo_search]
+
+    phase_timers.enabled = download_config.phase_timers
+    phase_timers.reset()
+
+    own_session = session is None
+    if own_session:
+        session = create_session(download_config)
+    request_counter = RequestCounter()
+    session.hooks["response"].append(request_counter.count)
+
+    summary = DownloadSummary()
+    context = DownloadContext(
+        catalog=open_catalog(download_config),
+        throttle=Throttle(
+            max_bandwidth=download_config.max_bandwidth,
+            max_connections=download_config.max_connections,
+        ),
+        breaker=CircuitBreaker(
+            threshold=download_config.circuit_breaker_threshold,
+            pause=download_config.circuit_breaker_pause,
+        ),
+        journal=FailureJournal(
+            download_config.state_directory, read_only=download_config.dry_run
+        ),
+        report=RunReport(),
+        session=session,
+        stop=stop,
+        space=create_disk_space(download_config),
+        plan=(
+            PlanWriter(download_config.plan_file) if download_config.plan_file else None
+        ),
+        post=None
+        if download_config.dry_run
+        else create_post_processor(download_config),
+    )
+    summary.report = context.report
+
+    try:
+        _download(
+            download_config,
+            geo_search,
+            product_search,
+            product_list,
+            plan,
+            context,
+            summary,
+        )
+    finally:
+        if context.post:
+            context.post.shutdown()
+        if context.plan:
+            context.plan.close()
+        session.hooks["response"].remove(request_counter.count)
+        if own_session:
+            session.close()
+        if context.catalog:
+            context.catalog.close()
+
+    logger.info(
+        f"Transferred {context.throttle.bytes} bytes "
+        f"at {format_rate(context.throttle.rate())}"
+    )
+    logger.info(
+        f"Made {request_counter.requests} HTTP requests, "
+        f"of which {request_counter.redirects} redirects"
+    )
+    logger.info(f"Download done: {summary}")
+    for file_name in summary.failed:
+        logger.error(f"Failed to download {file_name}")
+    if summary.failed and context.journal and context.journal.count():
+        logger.info(
+            f"Failed products are recorded in {context.journal.file}, "
+            "use --retry-failed to retry them"
+        )
+    for name in summary.not_found:
+        logger.warning(f"Product not found: {name}")
+
+    bytes_needed = None
+    if download_config.dry_run:
+        bytes_needed = sum(
+            context.report.products[file_name].bytes or 0
+            for file_name in summary.planned
+            if file_name in context.report.products
+        )
+        logger.info(
+            f"Dry run: downloading {len(summary.planned)} products needs "
+            f"{bytes_needed} bytes ({format_size(bytes_needed)}), "
+            f"{format_size(context.space.free())} is free"
+        )
+
+    if context.plan:
+        logger.info(
+            f"Wrote plan to {download_config.plan_file}: "
+            + ", ".join(
+                f"{count} {action}" for action, count in context.plan.counts.items()
+            )
+        )
+
+    if geo_search and len(geo_search) > 1:
+        for aoi in context.report.aoi_counts():
+            logger.info(
+                f"Geo search {aoi['name']}: found {aoi['found']} products, "
+                f"{aoi['unique']} not found by other searches, "
+                f"{aoi['downloaded']} downloaded, {aoi['skipped']} skipped, "
+                f"{aoi['failed']} failed"
+            )
+
+    if phase_timers.enabled and phase_timers.totals():
+        logger.info(f"Time spent per phase: {phase_timers}")
+
+    context.report.finish(
+        summary,
+        bytes_transferred=context.throttle.bytes,
+        failed_backlog=context.journal.count() if context.journal else None,
+        phases=phase_timers.totals(),
+        http_requests=request_counter.requests,
+        http_redirects=request_counter.redirects,
+        bytes_needed=bytes_needed,
+    )
+    if download_config.report_file:
+        logger.info(f"Writing report to {download_config.report_file}")
+        context.report.write_json(download_config.report_file)
+    if download_config.prometheus_file:
+        logger.info(f"Writing metrics to {download_config.prometheus_file}")
+        context.report.write_prometheus(download_config.prometheus_file)
+
+    return summary
+
+
+def _download(
+    download_config, geo_searches, product_search, product_list, plan, context, summary
+):
+    """Search and download products into a summary, see download.
+
+    Searches and downloads are pipelined: the monthly interval searches
+    run concurrently in a pool of `download_config.max_search_workers`
+    threads, and the products found are handed to the download pool as
+    soon as the search of their interval completes.
+    """
+    watermarks = []
+
+    with _download_executor(download_config) as executor:
+        futures = {}
+        seen = set()
+
+        def submit(result):
+            futures.update(
+                _submit_products(executor, download_config, result, context, seen)
+            )
+
+        if download_config.retry_failed:
+            # Retry the products in the journal only, without searching
+            products = context.journal.products() if context.journal else []
+            logger.info(f"Retrying {len(products)} failed products")
+            submit(products)
+            product_search = product_list = geo_searches = None
+
+        if plan is not None:
+            # Execute the plan, without searching
+            products = plan_products(plan, DOWNLOAD_ACTION)
+            replacements = plan_products(plan, REPLACE_ACTION)
+            logger.info(
+                f"Executing plan: {len(products)} products to download, "
+                f"{len(replacements)} to replace"
+            )
+            submit(products)
+            futures.update(
+                _submit_products(
+                    executor,
+                    replace(download_config, force=True),
+                    replacements,
+                    context,
+                    seen,
+                )
+            )
+            product_search = product_list = geo_searches = None
+
+        if product_search:
+            logger.info(f"Performing product search for product {product_search}")
+            started = time.monotonic()
+            with phase_timers.phase("search"):
+                result = _call_asf(
+                    download_config,
+                    context,
+                    _product_search,
+                    product_search,
+                    context.session,
+                )
+            product_count = len(result)
+            context.report.search(
+                "product",
+                names=1,
+                seconds=time.monotonic() - started,
+                results=product_count,
+            )
+
+            if product_count > 1:
+                logger.warning(
+                    "Found more than one product while performing "
+                    "product search. This should not happen according "
+                    "to the ASF api documentation."
+                )
+
+            logger.info(f"Found {str(product_count)} products")
+            submit(result)
+
+        if product_list:
+            summary.not_found.extend(
+                _product_list_search(download_config, product_list, submit, context)
+            )
+
+        if geo_searches:
+            watermarks = _geo_search(download_config, geo_searches, submit, context)
+
+        summary.merge(_collect(futures, context))
+
+    if watermarks and not summary.failed and not download_config.dry_run:
+        # Everything up to the end of the searches is downloaded, the next
+        # incremental run can start from there
+        watermark_store = Watermarks(download_config.state_directory)
+        for watermark in watermarks:
+            watermark_store.set(*watermark)
+
+
+def _product_list_search(download_config, product_list, submit, context):
+    """Search a list of products, submitting results as they come in.
+
+    The names are searched in batches of PRODUCT_SEARCH_BATCH_SIZE, the
+    batches run concurrently in a pool of
+    `download_config.max_search_workers` threads.
+
+    Parameters
+    ----------
+    download_config:
+        download configuration
+    product_list:
+        list of product names, e.g. scene names, file names or ASF
+        product ids
+    submit:
+        called with the result of every batch searched
+    context: DownloadContext
+        resources shared by the downloads of the run
+
+    Returns
+    -------
+    list
+        The names that were not found
+    """
+    names = list(dict.fromkeys(product_list))
+    batches = [
+        names[index : index + PRODUCT_SEARCH_BATCH_SIZE]
+        for index in range(0, len(names), PRODUCT_SEARCH_BATCH_SIZE)
+    ]
+    logger.info(
+        f"Performing product search for {len(names)} products "
+        f"in {len(batches)} batches"
+    )
+
+    not_found = []
+    with ThreadPoolExecutor(
+        max_workers=max(1, download_config.max_search_workers),
+        thread_name_prefix="search",
+    ) as search_executor:
+        search_futures = {
+            search_executor.submit(
+                _timed,
+                _call_asf,
+                download_config,
+                context,
+                search_products,
+                batch,
+                context.session,
+            ): batch
+            for batch in batches
+        }
+
+        for search_future in as_completed(search_futures):
+            batch = search_futures[search_future]
+            try:
+                result, seconds = search_future.result()
+            except Exception as error:
+                logger.exception(f"Error while searching {len(batch)} products")
+                _report_search(context, "product", names=len(batch), error=repr(error))
+                not_found.extend(batch)
+                continue
+
+            _report_search(
+                context,
+                "product",
+                names=len(batch),
+                seconds=seconds,
+                results=len(result),
+            )
+
+            # A name may refer to a product by any of these properties
+            found = set()
+            for product in result:
+                for name in ("sceneName", "fileID", "fileName"):
+                    if product.properties.get(name):
+                        found.add(product.properties[name])
+            batch_not_found = [
+                name
+                for name in batch
+                if name not in found and name.removesuffix(".zip") not in found
+            ]
+
+            logger.info(
+                f"Found {len(result)} products for a batch of {len(batch)} names"
+            )
+            not_found.extend(batch_not_found)
+            submit(result)
+
+    return not_found
+
+
+def _product_search(product_name, session=None):
+    """Search a single product by name, see asf_search.product_search."""
+    import asf_search as asf
+
+    return asf.product_search(product_name, opts=_session_options(session))
+
+
+def search_products(names, session=None):
+    """Search products by name.
+
+    Parameters
+    ----------
+    names: list
+        Product names. Either ASF product ids, e.g.
+        'S1A_IW_SLC__1SDV_20240101T054123_..._ABCD-SLC', or scene names,
+        with or without a '.zip' extension
+    session: asf_search.ASFSession
+        the session to search with, None for a new session
+
+    Returns
+    -------
+    list
+        The products found
+    """
+    import asf_search as asf
+
+    product_ids = [name for name in names if "-" in name]
+    scene_names = [name.removesuffix(".zip") for name in names if "-" not in name]
+
+    result = []
+    with phase_timers.phase("search"):
+        if product_ids:
+            result.extend(
+                asf.product_search(product_ids, opts=_session_options(session))
+            )
+        if scene_names:
+            # A scene search also returns the metadata products of a scene
+            result.extend(
+                product
+                for product in asf.granule_search(
+                    scene_names, opts=_session_options(session)
+                )
+                if not product.properties.get("processingLevel", "").startswith(
+                    "METADATA"
+                )
             )
-            sys.exit(1)
+    return result
 
-        logger.info(f"Found {str(product_count)} products")
-        download_products(download_config, result)
 
-    if geo_search:
-        logger.info(f"Performing geo search with {geo_search}")
+def _geo_search(download_config, geo_searches, submit, context):
+    """Perform geo searches, submitting results as they come in.
+
+    The intervals of all searches are planned first and then searched
+    together in a pool of `download_config.max_search_workers` threads.
+    Products found by more than one search, e.g. of overlapping areas of
+    interest, are downloaded once, see _submit_products.
+
+    Parameters
+    ----------
+    download_config:
+        download configuration
+    geo_searches: list
+        search configurations
+    submit:
+        called with the result of every interval searched
+    context: DownloadContext
+        resources shared by the downloads of the run
+
+    Returns
+    -------
+    list
+        The search keys and the ends of the searches, to be set as
+        watermarks when all products are downloaded. Searches of which any
+        interval failed are left out, all are when the search is not
+        incremental
+    """
+    search_cache = None
+    if download_config.search_cache_ttl:
+        search_cache = SearchCache(
+            download_config.state_directory, download_config.search_cache_ttl
+        )
+
+    plans = [
+        _GeoSearchPlan(download_config, geo_search, search_cache, context)
+        for geo_search in geo_searches
+    ]
+    for plan in plans:
+        # A search that cannot be planned, e.g. as a count query fails,
+        # does not stop the other searches
+        try:
+            plan.prepare()
+        except TransferInterrupted as error:
+            logger.info(str(error))
+            plan.success = False
+        except Exception as error:
+            logger.exception("Error while planning geo search %s", plan.name)
+            _report_search(
+                context,
+                "geo",
+                interval=(plan.geo_search.start, plan.geo_search.end),
+                aoi=plan.name,
+                error=repr(error),
+            )
+            plan.success = False
+    if len(plans) > 1:
+        logger.info(f"Planned {len(plans)} geo searches together")
+    if context.report:
+        # Report the areas of interest in the order of the searches
+        for plan in plans:
+            context.report.aoi(plan.name, [])
+
+    with ThreadPoolExecutor(
+        max_workers=max(1, download_config.max_search_workers),
+        thread_name_prefix="search",
+    ) as search_executor:
+        search_futures = {
+            search_executor.submit(plan.search, interval): (plan, interval)
+            for plan in plans
+            for interval in plan.intervals
+        }
+
+        for search_future in as_completed(search_futures):
+            plan, interval = search_futures[search_future]
+            try:
+                result = search_future.result()
+            except TransferInterrupted as error:
+                # Stopped, the interval is searched by the next run
+                logger.info(str(error))
+                plan.success = False
+                continue
+            except Exception as error:
+                logger.exception(
+                    f"Error while searching {plan.name} "
+                    f"{interval[0]} - {interval[1]}"
+                )
+                _report_search(
+                    context, "geo", interval=interval, aoi=plan.name, error=repr(error)
+                )
+                plan.success = False
+                continue
+
+            product_count = len(result)
+            logger.info(
+                f"Found {str(product_count)} products for {plan.name} "
+                f"in {interval[0]} - {interval[1]}"
+            )
+            if context.report:
+                context.report.aoi(
+                    plan.name, [product.properties["fileName"] for product in result]
+                )
+            submit(result)
+
+    if not download_config.incremental:
+        return []
+    return [(plan.watermark_key, plan.geo_search.end) for plan in plans if plan.success]
+
+
+class _GeoSearchPlan:
+    """The intervals of a geo search and how to search them.
+
+    The intervals are planned by prepare, until then there are none.
+
+    Parameters
+    ----------
+    download_config:
+        download configuration
+    geo_search:
+        search configuration
+    search_cache: SearchCache
+        cache of closed intervals, None for no cache
+    context: DownloadContext
+        resources shared by the downloads of the run
+    """
+
+    def __init__(self, download_config, geo_search, search_cache, context):
+        self.download_config = download_config
+        self.geo_search = geo_search
+        self.search_cache = search_cache
+        self.context = context
+        self.name = geo_search.name or geo_search.roi_wkt_file.stem
+        # Set when planning or any interval fails
+        self.success = True
+        self.tiles = []
+        self.intervals = []
+
+    def prepare(self):
+        """Prepare the region of interest and plan the intervals.
+
+        The search watermark is read and, for an adaptive search, the
+        results of intervals are counted, see plan_search_intervals.
+        """
+        download_config = self.download_config
+        geo_search = self.geo_search
+
+        logger.info(f"Performing geo search {self.name} with {geo_search}")
 
         # read wkt string from geo_search.roi_wkt_file into var
         with open(geo_search.roi_wkt_file, "r") as wkt_file:
             wkt_str = wkt_file.read().replace("\n", "")
 
-        # validate wkt string using shapely
-        # TODO
-
-        # perform search
-        # TODO split interval into montly intervals
-        for interval in split_into_monthly_intervals(geo_search.start, geo_search.end):
-            result = asf.geo_search(
-                dataset=geo_search.dataset,
-                start=interval[0],
-                end=interval[1],
-                intersectsWith=wkt_str,
-                relativeOrbit=geo_search.relative_orbits,
-                processingLevel=geo_search.product_type,
+        # Validated, simplified and tiled regions to search
+        self.tiles = prepare_roi(
+            wkt_str,
+            simplify_tolerance=geo_search.simplify_tolerance,
+            tile_size=geo_search.tile_size,
+            cache_directory=(
+                None
+                if download_config.dry_run
+                else download_config.state_directory.joinpath(ROI_CACHE_DIRECTORY_NAME)
+            ),
+        )
+
+        # The key depends on the region as specified, not as prepared, so
+        # the watermark is kept when the preparation changes
+        self.key = search_key(geo_search, wkt_str)
+        # A shard only downloads part of the products found, every shard
+        # has its own watermark
+        self.watermark_key = (
+            f"{self.key}#{download_config.shard}" if download_config.shard else self.key
+        )
+        publication_delay = timedelta(days=download_config.publication_delay_days)
+        # Intervals ending before this moment are closed, no more products
+        # will be published for them
+        self.closed_before = datetime.now() - publication_delay
+
+        start = geo_search.start
+        if download_config.incremental:
+            watermark = Watermarks(download_config.state_directory).get(
+                self.watermark_key
             )
+            if watermark and watermark - publication_delay > start:
+                # Products are published some time after acquisition, so
+                # search a bit before the watermark to pick up late arrivals
+                start = watermark - publication_delay
+                logger.info(
+                    f"Incremental search of {self.name} from {start} "
+                    f"(watermark {watermark})"
+                )
 
-            product_count = len(result)
-            logger.info(f"Found {str(product_count)} products")
-            download_products(download_config, result)
+        if download_config.adaptive_search:
+            self.intervals = plan_search_intervals(
+                start,
+                geo_search.end,
+                count=self.count,
+                max_results=download_config.max_search_results,
+            )
+        else:
+            self.intervals = split_into_monthly_intervals(start, geo_search.end)
 
-    logger.info("Download done")
+    def _check_stop(self, interval):
+        # No more queries to ASF once the run is stopped
+        if self.context.stop is not None and self.context.stop.is_set():
+            raise TransferInterrupted(
+                f"Stopped before searching {self.name} {interval[0]} - {interval[1]}"
+            )
+
+    def _cached(self, interval):
+        # The cached result of a closed interval, None if not cached
+        if self.search_cache and interval[1] < self.closed_before:
+            return self.search_cache.get(self.key, interval)
+        return None
+
+    def search(self, interval):
+        """Search an interval, see search_interval."""
+        started = time.monotonic()
+        result = self._cached(interval)
+        if result is not None:
+            logger.debug("Using cached result for %s - %s.", *interval)
+            _report_search(
+                self.context,
+                "geo",
+                interval=interval,
+                aoi=self.name,
+                seconds=time.monotonic() - started,
+                results=len(result),
+                cached=True,
+            )
+            return result
+
+        result = {}
+        for tile in self.tiles:
+            self._check_stop(interval)
+            # Merge the results of the tiles, a product covering several
+            # tiles is found by each of them
+            for product in _call_asf(
+                self.download_config,
+                self.context,
+                search_interval,
+                self.geo_search,
+                tile,
+                interval,
+                self.context.session,
+            ):
+                result.setdefault(product.properties["fileName"], product)
+        result = list(result.values())
+        _report_search(
+            self.context,
+            "geo",
+            interval=interval,
+            aoi=self.name,
+            seconds=time.monotonic() - started,
+            results=len(result),
+        )
+
+        if (
+            self.search_cache
+            and interval[1] < self.closed_before
+            and not self.download_config.dry_run
+        ):
+            self.search_cache.put(self.key, interval, result)
+        return result
+
+    def count(self, interval):
+        """Count the results of an interval, see count_interval.
+
+        The counts of the tiles are added, so products covering several
+        tiles are counted more than once.
+        """
+        result = self._cached(interval)
+        if result is not None:
+            return len(result)
+        result_count = 0
+        for tile in self.tiles:
+            self._check_stop(interval)
+            result_count += _call_asf(
+                self.download_config,
+                self.context,
+                count_interval,
+                self.geo_search,
+                tile,
+                interval,
+                self.context.session,
+            )
+        return result_count
 
 
-def download_products(download_config, result):
+def _timed(function, *args):
+    """Call a function, returning its return value and duration."""
+    started = time.monotonic()
+    result = function(*args)
+    return result, time.monotonic() - started
+
+
+def _report_search(context, kind, **values):
+    """Record a search in the report of the context, if any."""
+    if context and context.report:
+        context.report.search(kind, **values)
+
+
+def _call_asf(download_config, context, function, *args):
+    """Call a function talking to ASF, retrying transient errors.
+
+    Parameters
+    ----------
+    download_config:
+        download configuration, with the retry settings
+    context: DownloadContext
+        resources shared by the downloads of the run, with the circuit
+        breaker shared by all calls to ASF
+    function: callable
+        the function to call
+    *args:
+        arguments of the function
+
+    Returns
+    -------
+    object
+        The return value of the function
+    """
+    return retry_call(
+        function,
+        *args,
+        retries=download_config.retries,
+        backoff=download_config.retry_backoff,
+        max_backoff=download_config.retry_max_backoff,
+        breaker=context.breaker if context else None,
+    )
+
+
+def search_interval(geo_search, wkt_str, interval, session=None):
+    """Perform a geo search for a single interval.
+
+    Parameters
+    ----------
+    geo_search:
+        search configuration
+    wkt_str: str
+        the region of interest as a wkt string
+    interval: tuple
+        start and end of the interval to search
+    session: asf_search.ASFSession
+        the session to search with, None for a new session
+
+    Returns
+    -------
+    asf_search.ASFSearchResults
+        The products found
+    """
+    import asf_search as asf
+
+    with phase_timers.phase("search"):
+        return asf.geo_search(
+            **_search_options(geo_search, wkt_str, interval),
+            opts=_session_options(session),
+        )
+
+
+def count_interval(geo_search, wkt_str, interval, session=None):
+    """Count the products a geo search for a single interval would find.
+
+    Parameters
+    ----------
+    geo_search:
+        search configuration
+    wkt_str: str
+        the region of interest as a wkt string
+    interval: tuple
+        start and end of the interval to count
+    session: asf_search.ASFSession
+        the session to search with, None for a new session
+
+    Returns
+    -------
+    int
+        The number of products
+    """
+    import asf_search as asf
+
+    with phase_timers.phase("search"):
+        return asf.search_count(
+            **_search_options(geo_search, wkt_str, interval),
+            opts=_session_options(session),
+        )
+
+
+def _search_options(geo_search, wkt_str, interval):
+    """Compose the ASF search options for a geo search interval."""
+    return {
+        "dataset": geo_search.dataset,
+        "start": interval[0],
+        "end": interval[1],
+        "intersectsWith": wkt_str,
+        "relativeOrbit": geo_search.relative_orbits,
+        "processingLevel": geo_search.product_type,
+    }
+
+
+def _session_options(session):
+    """Compose ASF search options searching with a session, if any."""
+    if session is None:
+        return None
+
+    import asf_search as asf
+
+    return asf.ASFSearchOptions(session=session)
+
+
+def create_disk_space(download_config):
+    """Create the admission control of the base directory.
+
+    Parameters
+    ----------
+    download_config:
+        download configuration
+
+    Returns
+    -------
+    DiskSpace
+        The free space of the filesystem of the base directory, keeping
+        `download_config.min_free_space` free
+    """
+    return DiskSpace(
+        download_config.base_directory,
+        min_free=(
+            parse_size(download_config.min_free_space)
+            if download_config.min_free_space
+            else 0
+        ),
+    )
+
+
+def create_post_processor(download_config):
+    """Create the post-processing stage of a run.
+
+    Parameters
+    ----------
+    download_config:
+        download configuration
+
+    Returns
+    -------
+    PostProcessor
+        A pool of `download_config.post_workers` threads, as many as
+        there are download workers by default, running the hooks of
+        `download_config.post_download_hooks`
+    """
+    return PostProcessor(
+        # Every transfer may need a full read of the file to verify its
+        # checksum, one thread would make the transfers wait for it
+        workers=download_config.post_workers or download_config.max_workers,
+        hooks=[load_hook(hook) for hook in download_config.post_download_hooks or []],
+    )
+
+
+def create_session(download_config):
+    """Create an authenticated session for the searches and transfers of a run.
+
+    The session authenticates with .netrc. Its connection pool is sized
+    to the number of concurrent byte ranges and searches, so every worker
+    can keep its connection alive instead of connecting, and going
+    through the authentication redirects, for every request.
+
+    Parameters
+    ----------
+    download_config:
+        download configuration
+
+    Returns
+    -------
+    asf_search.ASFSession
+        The session
+    """
+    import asf_search as asf
+    from requests.adapters import HTTPAdapter
+
+    # Every download can use a connection per byte range
+    pool_size = max(1, download_config.max_workers) * max(
+        1, download_config.transfer_segments
+    ) + max(1, download_config.max_search_workers)
+    session = asf.ASFSession()
+    for prefix in ("https://", "http://"):
+        session.mount(
+            prefix, HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        )
+    return session
+
+
+class RequestCounter:
+    """Count the HTTP requests and redirects of a session.
+
+    Add `count` to the response hooks of a session. Redirects are counted
+    separately, every redirect is a round trip that a warm session with
+    valid authentication cookies can avoid.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.redirects = 0
+        self._lock = threading.Lock()
+
+    def count(self, response, *args, **kwargs):
+        """Count a response, called by requests for every response."""
+        with self._lock:
+            self.requests += 1
+            if response.is_redirect:
+                self.redirects += 1
+
+
+def download_products(download_config, result, context=None):
     """Download products from a result.
 
+    Products are downloaded concurrently by a pool of at most
+    `download_config.max_workers` threads. A product that fails to
+    download is logged and recorded as failed, it does not stop the
+    download of the other products.
+
     Parameters
     ----------
     download_config:
         download configuration
     result:
         query result
+    context: DownloadContext
+        resources shared by the downloads of the run
 
+    Returns
+    -------
+    DownloadSummary
+        Summary of the outcome for every product in the result
     """
+    with _download_executor(download_config) as executor:
+        futures = _submit_products(executor, download_config, result, context)
+        return _collect(futures, context)
+
+
+def _download_executor(download_config):
+    """Create the thread pool products are downloaded in."""
+    return ThreadPoolExecutor(
+        max_workers=max(1, download_config.max_workers),
+        thread_name_prefix="download",
+    )
+
+
+def _submit_products(executor, download_config, result, context, seen=None):
+    """Submit the download of products to an executor.
+
+    Parameters
+    ----------
+    executor: concurrent.futures.Executor
+        The executor to submit the downloads to
+    download_config:
+        download configuration
+    result:
+        query result
+    context: DownloadContext
+        resources shared by the downloads of the run
+    seen: set
+        File names of products that were already submitted. Products in
+        this set are not submitted again, submitted products are added
+
+    Products that do not belong to the shard of `download_config.shard`
+    are not submitted.
+
+    Returns
+    -------
+    dict
+        The products by the future of their download
+    """
+    if seen is None:
+        seen = set()
+    shard = parse_shard(download_config.shard) if download_config.shard else None
+
+    futures = {}
     for product in result:
-        download_product(download_config, product)
+        file_name = product.properties["fileName"]
+        if file_name in seen:
+            logger.debug("Product %s found more than once, ignoring.", file_name)
+            continue
+        seen.add(file_name)
+        if shard and not in_shard(file_name, shard):
+            logger.debug("Product %s belongs to another shard, ignoring.", file_name)
+            continue
+        future = executor.submit(download_product, download_config, product, context)
+        futures[future] = product
+
+    return futures
+
+
+def _collect(futures, context=None):
+    """Wait for downloads to finish and summarize their outcome.
+
+    Failed products are recorded in the failure journal of the context,
+    products that are downloaded or skipped are removed from it.
+
+    A transferred product is done when it is post-processed: its download
+    returns the future of its post-processing, which is waited for in
+    turn, see download_product.
+
+    Parameters
+    ----------
+    futures: dict
+        The products by the future of their download
+    context: DownloadContext
+        resources shared by the downloads of the run
+
+    Returns
+    -------
+    DownloadSummary
+        Summary of the outcome for every product
+    """
+    summary = DownloadSummary()
+    product_count = len(futures)
+    done_count = 0
+    pending = dict(futures)
+
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            product = pending.pop(future)
+            outcome = _record_outcome(future, product, context)
+            if isinstance(outcome, Future):
+                # Transferred, the outcome is known after post-processing
+                pending[outcome] = product
+                continue
+
+            file_name = product.properties["fileName"]
+            done_count += 1
+            summary.add(outcome, file_name)
+            logger.info("[%d/%d] %s: %s", done_count, product_count, file_name, outcome)
+
+    return summary
+
 
+def _record_outcome(future, product, context):
+    """Record the outcome of a finished download, see _collect.
 
-def download_product(download_config, product):
+    Returns
+    -------
+    str or concurrent.futures.Future
+        The outcome, or the future of the post-processing of the product
+    """
+    file_name = product.properties["fileName"]
+    reason = "verification failed"
+    interrupted = False
+    try:
+        outcome = future.result()
+        if isinstance(outcome, Future):
+            return outcome
+    except InsufficientDiskSpace as error:
+        # Not a failure of the product, it is retried by a later run
+        logger.error(str(error))
+        outcome = FAILED
+        reason = str(error)
+    except TransferInterrupted as error:
+        # Not a failure of the product, it is downloaded (or resumed)
+        # by the next run
+        logger.info(str(error))
+        outcome = FAILED
+        reason = "interrupted"
+        interrupted = True
+    except Exception as error:
+        logger.exception("Error while downloading %s", file_name)
+        outcome = FAILED
+        reason = repr(error)
+
+    if context and context.report:
+        context.report.product(
+            file_name,
+            outcome=outcome,
+            error=reason if outcome == FAILED else None,
+        )
+
+    if context and context.journal:
+        if outcome == FAILED and not interrupted:
+            context.journal.add(product, reason)
+        elif outcome in (DOWNLOADED, SKIPPED):
+            context.journal.remove(file_name)
+
+    return outcome
+
+
+def download_product(download_config, product, context=None):
     """Download a product.
 
+    This function is safe to call from several threads at once, as long
+    as every call is for a different product. Several processes can
+    download into the same base directory at once: a product is locked
+    with a lock file while it is downloaded, a product locked by another
+    process is skipped.
+
     Parameters
     ----------
     download_config:
         download configuration
     product:
         the product to download
+    context: DownloadContext
+        resources shared by the downloads of the run. Its catalog is used
+        to decide whether the product has to be downloaded and updated
+        with the result
 
+    Returns
+    -------
+    str or concurrent.futures.Future
+        The outcome: DOWNLOADED, SKIPPED, PLANNED or FAILED. When the
+        context has a post-processor, a transferred product is verified
+        and finished by it, and the future of the outcome is returned.
+        The product stays locked until it is finished
     """
-    target_directory = compose_product_download_path(
-        base_directory=download_config.base_directory,
-        file_name=product.properties["fileName"],
-        relative_orbit=str(product.properties["pathNumber"]),
-        orbit_direction=product.properties["flightDirection"],
-        polarization=product.properties["polarization"],
-    )
+    if context is None:
+        context = DownloadContext()
+    catalog = context.catalog
+    file_name = product.properties["fileName"]
 
-    target_file = target_directory.joinpath(product.properties["fileName"])
+    if context.stop is not None and context.stop.is_set():
+        raise TransferInterrupted(f"Stopped before downloading {file_name}")
 
-    logger.debug(f"Target directory: {target_directory}")
-    logger.debug(f"Target file: {target_file}")
-
-    if os.path.isfile(target_file) and not download_config.force:
+    # Consult the catalog first, a verified product can be skipped
+    # without touching the filesystem
+    record = catalog.get(file_name) if catalog else None
+    if record and record["status"] == VERIFIED and not download_config.force:
         logger.debug(
-            f"Target file: {target_file} already exists. "
+            "Product %s is verified in the catalog. "
             "Force option not set. "
-            "Skipping download"
+            "Skipping download",
+            file_name,
+        )
+        if context.plan:
+            context.plan.add(SKIP_ACTION, product, record["path"])
+        return SKIPPED
+
+    with phase_timers.phase("path"):
+        target_directory = compose_product_download_path(
+            base_directory=download_config.base_directory,
+            file_name=file_name,
+            relative_orbit=str(product.properties["pathNumber"]),
+            orbit_direction=product.properties["flightDirection"],
+            polarization=product.properties["polarization"],
         )
-        return
 
-    if os.path.isfile(target_file) and download_config.force:
+    target_file = target_directory.joinpath(file_name)
+
+    logger.debug("Target directory: %s", target_directory)
+    logger.debug("Target file: %s", target_file)
+
+    if download_config.dry_run:
+        return _download_target(download_config, product, context, target_file, record)
+
+    # Several workers may create the same track/date directory at the
+    # same time, exist_ok makes that safe
+    os.makedirs(target_directory, exist_ok=True)
+
+    lock = ProductLock(target_file, stale_after=download_config.lock_stale_after)
+    if not lock.acquire():
+        logger.info(
+            "Product %s is being downloaded by another process. Skipping download",
+            file_name,
+        )
+        return SKIPPED
+
+    try:
+        outcome = _download_target(
+            download_config, product, context, target_file, record
+        )
+    except BaseException:
+        lock.release()
+        raise
+    if isinstance(outcome, Future):
+        # Keep other processes away from the partial file until it is
+        # verified and renamed
+        outcome.add_done_callback(lambda _: lock.release())
+    else:
+        lock.release()
+    return outcome
+
+
+def _download_target(download_config, product, context, target_file, record=None):
+    """Download a product to its target file, see download_product.
+
+    `record` is the catalog record of the product, if any.
+    """
+    catalog = context.catalog
+    file_name = product.properties["fileName"]
+    expected_size = product.properties.get("bytes")
+
+    # A target file of the wrong size, e.g. truncated, or that failed
+    # verification is replaced
+    replace = None
+    if os.path.isfile(target_file):
+        if download_config.force:
+            replace = "Force option set"
+        elif record and record["status"] == CATALOG_FAILED:
+            replace = "It failed verification"
+        elif expected_size is not None and target_file.stat().st_size != int(
+            expected_size
+        ):
+            replace = (
+                f"It has {target_file.stat().st_size} bytes "
+                f"in stead of {expected_size}"
+            )
+
+    if os.path.isfile(target_file) and replace is None:
         logger.debug(
-            f"Target file: {target_file} already exists. "
-            "Force option set. "
-            "Removing file: {target_file}"
+            "Target file: %s already exists. "
+            "Force option not set. "
+            "Skipping download",
+            target_file,
         )
+        if catalog and not download_config.dry_run:
+            # Not (correctly) in the catalog yet, e.g. downloaded before
+            # the catalog existed. Record it so the next run needs no stat.
+            # Only its size is known to match, it is verified by the
+            # verify command
+            stat = target_file.stat()
+            catalog.update(
+                file_name,
+                path=str(target_file),
+                size=stat.st_size,
+                md5=product.properties.get("md5sum"),
+                mtime=stat.st_mtime,
+                status=PENDING,
+                **product_record(product.properties),
+            )
+        if context.plan:
+            context.plan.add(SKIP_ACTION, product, target_file)
+        return SKIPPED
+
+    if replace is not None:
+        if download_config.force:
+            logger.debug(
+                "Target file: %s already exists. %s. Removing file",
+                target_file,
+                replace,
+            )
+        else:
+            logger.warning("Target file: %s. %s. Replacing it", target_file, replace)
         if not download_config.dry_run:
             os.remove(target_file)
 
-    logger.debug("Creating directories")
-    if not download_config.dry_run:
-        os.makedirs(target_directory, exist_ok=True)
+    if download_config.dry_run:
+        logger.info("Dry run, not downloading %s", file_name)
+        if context.plan:
+            context.plan.add(
+                REPLACE_ACTION if os.path.isfile(target_file) else DOWNLOAD_ACTION,
+                product,
+                target_file,
+            )
+        if context.report and product.properties.get("bytes"):
+            # The space the product would take, see download
+            context.report.product(file_name, bytes=int(product.properties["bytes"]))
+        return PLANNED
+
+    # Streamed into a partial file ourselves, or by asf_search directly
+    # into the target file
+    part_file = (
+        part_file_for(target_file) if product.properties.get("url") else target_file
+    )
+    if context.space and product.properties.get("bytes"):
+        # Raises InsufficientDiskSpace, the product is retried later
+        context.space.reserve(part_file, int(product.properties["bytes"]))
+
+    if catalog:
+        catalog.update(
+            file_name,
+            path=str(target_file),
+            status=PENDING,
+            **product_record(product.properties),
+        )
+
+    logger.info("Downloading %s", file_name)
+    started = time.monotonic()
+    try:
+        with phase_timers.phase("transfer"):
+            checksum, size = _transfer_product(
+                download_config, product, context, part_file
+            )
+    finally:
+        if context.space:
+            context.space.release(part_file)
+    if context.report:
+        context.report.product(
+            file_name, bytes=size, transfer_seconds=time.monotonic() - started
+        )
+
+    if context.post:
+        return context.post.submit(
+            _finish_download,
+            download_config,
+            product,
+            context,
+            target_file,
+            part_file,
+            checksum,
+            size,
+        )
+    return _finish_download(
+        download_config, product, context, target_file, part_file, checksum, size
+    )
+
+
+def _finish_download(
+    download_config, product, context, target_file, part_file, checksum, size
+):
+    """Verify a transferred product and give it its final name.
+
+    The geojson sidecar is written, the catalog updated and the hooks of
+    the post-processor of the context are run. See _download_target.
+
+    Returns
+    -------
+    str
+        The outcome: DOWNLOADED or FAILED
+    """
+    catalog = context.catalog
+    file_name = product.properties["fileName"]
+
+    expected_size = product.properties.get("bytes")
+    if expected_size is not None and size != int(expected_size):
+        logger.error(
+            "Size mismatch for %s: expected %s bytes, got %s bytes",
+            file_name,
+            expected_size,
+            size,
+        )
+        os.remove(part_file)
+        if catalog:
+            catalog.update(file_name, path=str(target_file), status=CATALOG_FAILED)
+        return FAILED
+
+    if download_config.verify and checksum is None:
+        logger.info("Verifying checksum of %s", file_name)
+        started = time.monotonic()
+        with phase_timers.phase("verify"):
+            checksum_ok = verify_checksum(
+                file=part_file, checksum=product.properties["md5sum"]
+            )
+        if context.report:
+            context.report.product(file_name, verify_seconds=time.monotonic() - started)
+    else:
+        # The checksum computed during the transfer is free to compare
+        checksum_ok = checksum == product.properties["md5sum"]
+
+    if download_config.verify:
+        if checksum_ok:
+            logger.info("Checksum OK for %s", file_name)
+        else:
+            logger.error("Checksum FAILED for %s", file_name)
+            os.remove(part_file)
+            if catalog:
+                catalog.update(file_name, path=str(target_file), status=CATALOG_FAILED)
+            return FAILED
+
+    with phase_timers.phase("metadata"):
+        write_sidecar(target_file, product.geojson())
+
+    # Only now the download is known to be good it gets its final name, so
+    # any target file that exists can be trusted
+    if part_file != target_file:
+        os.replace(part_file, target_file)
+
+    if catalog:
+        catalog.update(
+            file_name,
+            path=str(target_file),
+            size=size,
+            md5=product.properties["md5sum"],
+            mtime=target_file.stat().st_mtime,
+            status=VERIFIED if checksum_ok else PENDING,
+        )
+
+    if context.post and context.post.hooks:
+        with phase_timers.phase("hooks"):
+            hook_errors = context.post.run_hooks(target_file, product.geojson())
+        if context.report:
+            context.report.product(file_name, hook_errors=hook_errors)
 
-    logger.info(f"Downloading {product.properties['fileName']}")
-    if not download_config.dry_run:
-        product.download(path=target_directory)
+    return DOWNLOADED
 
-        if download_config.verify:
-            logger.info("Verifying checksum")
-            if verify_checksum(file=target_file, checksum=product.properties["md5sum"]):
-                logger.info("Checksum OK")
-            else:
-                logger.error("Checksum FAILED")
-                return
 
-        product_geojson_file = str(target_file)[:-4] + ".json"
-        logger.info("Saving product geojson to " f"{product_geojson_file}")
-        f = open(product_geojson_file, "w")
-        f.write(json.dumps(product.geojson(), indent=2))
-        f.close()
+def _transfer_product(download_config, product, context, part_file):
+    """Transfer a product to its partial file, see _download_target.
+
+    Returns
+    -------
+    tuple
+        The md5 checksum (hexdigest) of the file, None when it has to be
+        computed from the file, and the size of the file in bytes
+    """
+    expected_size = product.properties.get("bytes")
+    if not product.properties.get("url"):
+        # Fall back to the asf_search download, the checksum then has to
+        # be computed from the file on disk
+        product.download(path=part_file.parent, session=context.session)
+        return None, os.path.getsize(part_file)
+
+    # Stream the product into a partial file ourselves, so the checksum
+    # is computed over the data while it is downloaded and an interrupted
+    # download can be resumed by the next run. Retried transfers resume
+    # from the partial file
+    if (
+        download_config.transfer_segments > 1
+        and expected_size
+        and hasattr(os, "pwrite")
+    ):
+        # Several streams in parallel, the checksum is computed from the
+        # file when verifying
+        return _call_asf(
+            download_config,
+            context,
+            segmented_transfer,
+            product.properties["url"],
+            part_file,
+            int(expected_size),
+            download_config.transfer_segments,
+            download_config.min_segment_size,
+            context.session,
+            context.throttle,
+            context.stop,
+            download_config.preallocate,
+        )
+
+    return _call_asf(
+        download_config,
+        context,
+        transfer,
+        product.properties["url"],
+        part_file,
+        context.session,
+        context.throttle,
+        context.stop,
+        int(expected_size) if expected_size and download_config.preallocate else None,
+    )
 
 
 def split_into_monthly_intervals(start_datetime, end_datetime):
@@ -245,10 +1792,11 @@ def split_into_monthly_intervals(start_datetime, end_datetime):
     intervals are returned.
     """
     logger.debug(
-        f"Splitting interval {start_datetime} - {end_datetime} "
-        "into monthly intervals"
+        "Splitting interval %s - %s into monthly intervals",
+        start_datetime,
+        end_datetime,
     )
-    logger.debug(f"Log level: {logger.level}")
+    logger.debug("Log level: %s", logger.level)
     intervals = []
     current_start = start_datetime
 
@@ -262,8 +1810,95 @@ def split_into_monthly_intervals(start_datetime, end_datetime):
         intervals.append((current_start, current_end))
         current_start = next_month_start
 
-    logger.debug(f"Returning {len(intervals)} intervals")
-    logger.debug(f"{intervals}")
+    logger.debug("Returning %d intervals", len(intervals))
+    logger.debug("%s", intervals)
+    return intervals
+
+
+def plan_search_intervals(
+    start_datetime, end_datetime, count, max_results, min_duration=timedelta(hours=1)
+):
+    """Plan search intervals based on the number of results they contain.
+
+    The interval is split so that every search returns at most
+    `max_results` products where possible, using as few searches as
+    possible. Intervals with too many results are bisected, on month
+    boundaries as long as they span more than one month, and consecutive
+    sparse intervals are merged.
+
+    Parameters
+    ----------
+    start_datetime: datetime
+        start of the interval
+    end_datetime: datetime
+        end of the interval
+    count: callable
+        called with an interval (a tuple of start and end), returns the
+        (estimated) number of results in the interval. E.g. a count query
+        or an estimate from earlier results
+    max_results: int
+        maximum number of results per interval
+    min_duration: timedelta
+        intervals shorter than this are not split any further, even if
+        they contain more than `max_results` results
+
+    Returns
+    -------
+    list
+        A list of intervals
+
+    Notes
+    -----
+    Like in split_into_monthly_intervals, the end of an interval lies one
+    second before the start of the next interval.
+    """
+    logger.debug(
+        "Planning intervals for %s - %s with at most %d results per interval",
+        start_datetime,
+        end_datetime,
+        max_results,
+    )
+    # Leaves of the bisection, as (interval, count) tuples
+    leaves = []
+
+    def plan(months):
+        interval = (months[0][0], months[-1][1])
+        result_count = count(interval)
+        duration = interval[1] - interval[0]
+        if result_count <= max_results or (
+            len(months) == 1 and duration <= min_duration
+        ):
+            leaves.append((interval, result_count))
+        elif len(months) > 1:
+            # Bisect on a month boundary
+            middle = len(months) // 2
+            plan(months[:middle])
+            plan(months[middle:])
+        else:
+            # Bisect within the month, on whole seconds
+            middle = interval[0] + timedelta(seconds=duration.total_seconds() // 2)
+            plan([(interval[0], middle - timedelta(seconds=1))])
+            plan([(middle, interval[1])])
+
+    months = split_into_monthly_intervals(start_datetime, end_datetime)
+    if not months:
+        return []
+    plan(months)
+
+    # Merge consecutive intervals while they stay within max_results
+    intervals = []
+    current, current_count = leaves[0]
+    for interval, result_count in leaves[1:]:
+        if current_count + result_count <= max_results:
+            current = (current[0], interval[1])
+            current_count += result_count
+        else:
+            intervals.append(current)
+            current, current_count = interval, result_count
+    intervals.append(current)
+
+    logger.debug("Returning %d intervals", len(intervals))
+    logger.debug("%s", intervals)
     return intervals
 
 
@@ -286,15 +1921,10 @@ def verify_checksum(file, checksum: str):
     logger.debug("file: %s.", file)
     logger.debug("original checksum: %s.", checksum)
 
-    # Open the file
-    with open(file, "rb") as f:
-        # Compute the checksum, chunking the checksum process so as
-        # not to fill up memory
-        computed_checksum = hashlib.md5()
-        chunk = f.read(8192)
-        while chunk:
-            computed_checksum.update(chunk)
-            chunk = f.read(8192)
+    # Compute the checksum, chunking the checksum process so as
+    # not to fill up memory
+    computed_checksum = hashlib.md5()
+    update_checksum(computed_checksum, file)
 
     # Log debugging info
     logger.debug("computed checksum: %s.", computed_checksum.hexdigest())
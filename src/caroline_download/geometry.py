@@ -0,0 +1,234 @@
+# geometry.py
+"""Geometry.
+
+Prepare the region of interest of a geo search before it is sent to ASF:
+validate the WKT, simplify it within a tolerance without losing coverage,
+and optionally split it into tiles that are searched separately.
+
+Regions of interest derived from coastlines can have thousands of
+vertices, which makes search requests large and slow, and ASF may reject
+them.
+
+"""
+
+import hashlib
+import json
+import logging
+import math
+
+from caroline_download.search_state import write_json
+
+# Setup logging 'library-style', see download.py
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Name of the cache directory of prepared regions in the state directory
+ROI_CACHE_DIRECTORY_NAME = "roi-cache"
+
+# Number of times the buffer is increased when a simplified region does
+# not cover the original one
+MAX_BUFFER_ATTEMPTS = 4
+
+
+def load_roi(wkt_str):
+    """Load and validate a region of interest.
+
+    Invalid geometries, e.g. self-intersecting polygons, are repaired.
+
+    Parameters
+    ----------
+    wkt_str: str
+        The region of interest as a wkt string
+
+    Returns
+    -------
+    shapely.Geometry
+        The region of interest
+
+    Raises
+    ------
+    ValueError
+        If the wkt string cannot be parsed, is empty, or has coordinates
+        outside of longitude -180 to 180 and latitude -90 to 90
+    """
+    # Imported here, so importing this module does not pay for it
+    import shapely
+    from shapely.validation import explain_validity
+
+    try:
+        geometry = shapely.from_wkt(wkt_str)
+    except shapely.errors.GEOSException as err:
+        raise ValueError(f"Invalid WKT: {err}") from err
+
+    if geometry is None or geometry.is_empty:
+        raise ValueError("Invalid WKT: the geometry is empty")
+
+    min_x, min_y, max_x, max_y = geometry.bounds
+    if min_x < -180 or max_x > 180 or min_y < -90 or max_y > 90:
+        raise ValueError(
+            f"Invalid WKT: bounds {geometry.bounds} are outside of "
+            "longitude -180 to 180 and latitude -90 to 90"
+        )
+
+    if not geometry.is_valid:
+        logger.warning(
+            f"Repairing invalid region of interest: {explain_validity(geometry)}"
+        )
+        geometry = shapely.make_valid(geometry)
+
+    return geometry
+
+
+def simplify_roi(geometry, tolerance):
+    """Simplify a region of interest without losing coverage.
+
+    The region is buffered by the tolerance before it is simplified, so
+    the simplified region covers the original. Should it not, the buffer
+    is increased.
+
+    Parameters
+    ----------
+    geometry: shapely.Geometry
+        The region of interest
+    tolerance: float
+        Maximum distance between the simplified and the buffered region,
+        in degrees
+
+    Returns
+    -------
+    shapely.Geometry
+        The simplified region, covering the original region
+    """
+    buffer = tolerance
+    for _ in range(MAX_BUFFER_ATTEMPTS):
+        simplified = geometry.buffer(buffer).simplify(tolerance)
+        if simplified.covers(geometry):
+            return simplified
+        buffer *= 2
+
+    logger.warning(
+        f"Cannot simplify the region of interest within {tolerance} degrees "
+        "without losing coverage, using it as is"
+    )
+    return geometry
+
+
+def tile_roi(geometry, tile_size):
+    """Split a region of interest into tiles.
+
+    Multipart regions are split into their parts, and parts larger than
+    the tile size are split along a grid of tiles of that size.
+
+    Parameters
+    ----------
+    geometry: shapely.Geometry
+        The region of interest
+    tile_size: float
+        Maximum width and height of a tile in degrees
+
+    Returns
+    -------
+    list
+        The tiles, together covering the region of interest
+    """
+    import shapely
+
+    tiles = []
+    for part in shapely.get_parts(geometry):
+        min_x, min_y, max_x, max_y = part.bounds
+        if max_x - min_x <= tile_size and max_y - min_y <= tile_size:
+            tiles.append(part)
+            continue
+
+        for column in range(max(1, math.ceil((max_x - min_x) / tile_size))):
+            for row in range(max(1, math.ceil((max_y - min_y) / tile_size))):
+                x = min_x + column * tile_size
+                y = min_y + row * tile_size
+                tile = part.intersection(
+                    shapely.box(
+                        x, y, min(x + tile_size, max_x), min(y + tile_size, max_y)
+                    )
+                )
+                # Drop the lines and points where a polygon touches a tile
+                tiles.extend(
+                    tile_part
+                    for tile_part in shapely.get_parts(tile)
+                    if not tile_part.is_empty and (tile_part.area or not part.area)
+                )
+
+    return tiles
+
+
+def prepare_roi(wkt_str, simplify_tolerance=None, tile_size=None, cache_directory=None):
+    """Prepare a region of interest for searching.
+
+    Parameters
+    ----------
+    wkt_str: str
+        The region of interest as a wkt string
+    simplify_tolerance: float
+        Simplify the region within this tolerance in degrees, see
+        simplify_roi. None to not simplify
+    tile_size: float
+        Split the region into tiles of at most this size in degrees, see
+        tile_roi. None to search the region as a whole
+    cache_directory: pathlib.Path
+        Directory to cache prepared regions in, by the hash of the wkt
+        string and the parameters. None to not cache
+
+    Returns
+    -------
+    list
+        The wkt strings of the regions to search, one per tile
+
+    Raises
+    ------
+    ValueError
+        If the region of interest is not valid, see load_roi
+    """
+    key = hashlib.sha256(
+        json.dumps(
+            {
+                "wkt": hashlib.sha256(wkt_str.encode()).hexdigest(),
+                "simplify_tolerance": simplify_tolerance,
+                "tile_size": tile_size,
+            },
+            sort_keys=True,
+        ).encode()
+    ).hexdigest()
+    cache_file = cache_directory.joinpath(f"{key}.json") if cache_directory else None
+    if cache_file:
+        try:
+            with open(cache_file, "r") as f:
+                return json.load(f)["tiles"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    geometry = load_roi(wkt_str)
+    vertices = _count_vertices(geometry)
+
+    if simplify_tolerance:
+        geometry = simplify_roi(geometry, simplify_tolerance)
+        logger.info(
+            f"Simplified region of interest from {vertices} to "
+            f"{_count_vertices(geometry)} vertices"
+        )
+
+    tiles = tile_roi(geometry, tile_size) if tile_size else [geometry]
+    if len(tiles) > 1:
+        logger.info(f"Split region of interest into {len(tiles)} tiles")
+
+    tile_wkts = [tile.wkt for tile in tiles]
+    if cache_file:
+        write_json(cache_file, {"tiles": tile_wkts})
+    return tile_wkts
+
+
+def _count_vertices(geometry):
+    """Return the number of vertices of a geometry."""
+    import shapely
+
+    return shapely.get_num_coordinates(geometry)
+
+
+# Eof
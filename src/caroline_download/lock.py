@@ -0,0 +1,230 @@
+# lock.py
+"""Lock.
+
+Per-product lock files, so several processes, possibly on different
+hosts, can download into the same base directory without transferring
+the same product twice.
+
+The lock file is created with O_CREAT | O_EXCL, which is atomic on local
+filesystems as well as on NFS (v3 and later) and Lustre, unlike flock and
+fcntl locks. While a lock is held its modification time is refreshed
+regularly, a lock that has not been refreshed for a while was left
+behind by a process that died and is broken. A lock of a process on the
+same host that is not running anymore is broken right away.
+
+The same lock files protect the state files that several processes
+update, such as the failure journal, see locked.
+
+"""
+
+from contextlib import contextmanager
+import logging
+import os
+import socket
+import threading
+import time
+
+# Setup logging 'library-style', see download.py
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Suffix of lock files, next to the file they lock
+LOCK_SUFFIX = ".lock"
+
+# Seconds between attempts to acquire a lock held by another process, see
+# locked
+LOCK_POLL_INTERVAL = 0.05
+
+
+def lock_file_for(target_file):
+    """Return the lock file of a target file.
+
+    Parameters
+    ----------
+    target_file: pathlib.Path
+        The file to lock
+
+    Returns
+    -------
+    pathlib.Path
+        The lock file
+    """
+    return target_file.with_name(target_file.name + LOCK_SUFFIX)
+
+
+class ProductLock:
+    """Lock file of a product.
+
+    Parameters
+    ----------
+    target_file: pathlib.Path
+        The file the product is downloaded to
+    stale_after: float
+        Number of seconds after which a lock that has not been refreshed
+        is considered stale. The lock is refreshed every quarter of this
+        time while it is held
+    """
+
+    def __init__(self, target_file, stale_after=900):
+        self.file = lock_file_for(target_file)
+        self.stale_after = stale_after
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def acquire(self):
+        """Try to acquire the lock, without waiting.
+
+        Returns
+        -------
+        bool
+            True if the lock is acquired, False if another process holds it
+        """
+        owner = f"{socket.gethostname()}:{os.getpid()}\n"
+        for _ in range(2):
+            try:
+                fd = os.open(self.file, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._break_stale():
+                    return False
+                continue
+
+            with os.fdopen(fd, "w") as f:
+                f.write(owner)
+
+            self._stop.clear()
+            self._heartbeat = threading.Thread(
+                target=self._refresh,
+                name=f"lock-{self.file.name}",
+                daemon=True,
+            )
+            self._heartbeat.start()
+            return True
+
+        return False
+
+    def release(self):
+        """Release the lock."""
+        self._stop.set()
+        if self._heartbeat:
+            self._heartbeat.join()
+            self._heartbeat = None
+        try:
+            os.remove(self.file)
+        except FileNotFoundError:
+            logger.warning(f"Lock {self.file} was removed while it was held")
+
+    def _refresh(self):
+        # Touch the lock file so other processes see it is still in use
+        while not self._stop.wait(self.stale_after / 4):
+            try:
+                os.utime(self.file)
+            except OSError as err:
+                logger.warning(f"Cannot refresh lock {self.file}: {err}")
+
+    def _break_stale(self):
+        """Remove the lock file if it is stale.
+
+        Returns
+        -------
+        bool
+            True if the lock file was stale and is removed, or was removed
+            by its owner in the mean time
+        """
+        try:
+            age = time.time() - os.stat(self.file).st_mtime
+        except FileNotFoundError:
+            return True
+        dead_owner = self._dead_owner()
+        if age < self.stale_after and dead_owner is None:
+            return False
+
+        # Rename before removing, so when several processes find the same
+        # stale lock only one of them breaks it, and not a new lock that
+        # another process created in the mean time
+        stale_file = self.file.with_name(
+            f"{self.file.name}.{socket.gethostname()}.{os.getpid()}.stale"
+        )
+        try:
+            os.rename(self.file, stale_file)
+        except FileNotFoundError:
+            return True
+        try:
+            owner = stale_file.read_text().strip()
+        except OSError:
+            owner = "unknown"
+        fresh = time.time() - os.stat(stale_file).st_mtime < self.stale_after
+        if fresh and (dead_owner is None or owner != dead_owner):
+            # Another process broke the lock and took a new one between
+            # the stat and the rename, give it back
+            try:
+                os.link(stale_file, self.file)
+            except FileExistsError:
+                pass
+            os.remove(stale_file)
+            return False
+        if fresh:
+            logger.warning(
+                f"Breaking lock {self.file} of {owner}, the process is not running"
+            )
+        else:
+            logger.warning(
+                f"Breaking stale lock {self.file} of {owner}, "
+                f"not refreshed for {age:.0f} seconds"
+            )
+        os.remove(stale_file)
+        return True
+
+    def _dead_owner(self):
+        """Return the owner of the lock file if it is not running anymore.
+
+        Only the owner of a lock taken on this host can be checked.
+
+        Returns
+        -------
+        str or None
+            The owner, as host:pid, if it is a process on this host that
+            is not running, None otherwise
+        """
+        try:
+            owner = self.file.read_text().strip()
+        except OSError:
+            return None
+        host, _, pid = owner.rpartition(":")
+        if host != socket.gethostname() or not pid.isdigit():
+            return None
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return owner
+        except OSError:
+            # E.g. the process runs as another user
+            pass
+        return None
+
+
+@contextmanager
+def locked(file, stale_after=60):
+    """Hold the lock file of a file, waiting while another process holds it.
+
+    Use it to read, update and write a file that other processes update
+    as well, without losing their changes.
+
+    Parameters
+    ----------
+    file: pathlib.Path
+        The file to lock
+    stale_after: float
+        Number of seconds after which a lock that has not been refreshed
+        is considered stale, see ProductLock
+    """
+    os.makedirs(file.parent, exist_ok=True)
+    lock = ProductLock(file, stale_after=stale_after)
+    while not lock.acquire():
+        time.sleep(LOCK_POLL_INTERVAL)
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+# Eof
@@ -0,0 +1,132 @@
+# plan.py
+"""Plan.
+
+A download plan records what a run decided for every product it found,
+as one json object per line (NDJSON), so the searches can be done once,
+the plan reviewed, and the transfers run later, possibly split over
+several nodes, without searching again.
+
+"""
+
+import json
+import sys
+import threading
+
+from caroline_download.product import Product
+
+# Actions in a plan
+DOWNLOAD = "download"
+SKIP = "skip"
+REPLACE = "replace"
+ACTIONS = (DOWNLOAD, SKIP, REPLACE)
+
+
+class PlanWriter:
+    """Writer of a download plan.
+
+    Every action is written and flushed as soon as it is added, so the
+    plan can be followed while it is made.
+
+    Parameters
+    ----------
+    plan_file: pathlib.Path or str
+        The file to write the plan to, '-' for stdout
+    """
+
+    def __init__(self, plan_file):
+        self.file = plan_file
+        self.counts = dict.fromkeys(ACTIONS, 0)
+        self._stream = sys.stdout if str(plan_file) == "-" else open(plan_file, "w")
+        self._lock = threading.Lock()
+
+    def add(self, action, product, target_file):
+        """Add the action for a product to the plan.
+
+        Parameters
+        ----------
+        action: str
+            One of DOWNLOAD, SKIP or REPLACE
+        product:
+            The product
+        target_file: pathlib.Path
+            The file the product is (or would be) downloaded to
+        """
+        size = product.properties.get("bytes")
+        line = json.dumps(
+            {
+                "action": action,
+                "file_name": product.properties["fileName"],
+                "path": str(target_file),
+                "bytes": int(size) if size is not None else None,
+                "md5sum": product.properties.get("md5sum"),
+                "geojson": product.geojson(),
+            }
+        )
+        with self._lock:
+            self._stream.write(line + "\n")
+            self._stream.flush()
+            self.counts[action] += 1
+
+    def close(self):
+        """Close the plan file."""
+        if self._stream is not sys.stdout:
+            self._stream.close()
+
+
+def read_plan(plan_file):
+    """Read a download plan.
+
+    Parameters
+    ----------
+    plan_file: pathlib.Path or str
+        The plan, see PlanWriter, '-' to read from stdin
+
+    Returns
+    -------
+    list
+        The entries of the plan, as dicts
+
+    Raises
+    ------
+    ValueError
+        If a line is not a valid plan entry
+    """
+    if str(plan_file) == "-":
+        lines = sys.stdin.readlines()
+    else:
+        with open(plan_file, "r") as f:
+            lines = f.readlines()
+
+    entries = []
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError as err:
+            raise ValueError(f"{plan_file}:{line_number}: {err}") from err
+        if entry.get("action") not in ACTIONS or "geojson" not in entry:
+            raise ValueError(f"{plan_file}:{line_number}: not a plan entry")
+        entries.append(entry)
+    return entries
+
+
+def plan_products(entries, action):
+    """Return the products of the plan entries with an action.
+
+    Parameters
+    ----------
+    entries: list
+        The entries of the plan, see read_plan
+    action: str
+        One of DOWNLOAD, SKIP or REPLACE
+
+    Returns
+    -------
+    list
+        The products, restored from their geojson
+    """
+    return [Product(entry["geojson"]) for entry in entries if entry["action"] == action]
+
+
+# Eof
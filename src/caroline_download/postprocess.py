@@ -0,0 +1,225 @@
+# postprocess.py
+"""Post-process.
+
+Work done on a product after its transfer, such as verifying the checksum,
+writing the geojson sidecar and running user-configured hooks, runs in a
+pool of threads of its own, so the transfer workers can move on to the
+next product as soon as a transfer is done.
+
+Hooks are Python functions, referenced as entry points, or commands.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import json
+import logging
+import re
+import subprocess
+
+# Setup logging 'library-style', see download.py
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Entry point group packages can register post-download hooks in
+HOOK_ENTRY_POINT_GROUP = "caroline_download.hooks"
+
+# Placeholders replaced in the arguments of a command, see run_command
+COMMAND_PLACEHOLDER = re.compile(r"\{(path|file_name|directory|geojson)\}")
+
+
+def load_hook(hook):
+    """Load a post-download hook.
+
+    Parameters
+    ----------
+    hook: caroline_download.config.PostDownloadHook
+        The hook configuration. Its `entry_point` is either a reference
+        to a function, 'module:function', or the name of an entry point
+        in the HOOK_ENTRY_POINT_GROUP group of an installed package. Its
+        `command` is a list of arguments, see run_command
+
+    Returns
+    -------
+    callable
+        The hook, called with the path of the product file and the
+        geojson of the product
+
+    Raises
+    ------
+    ValueError
+        If the hook cannot be loaded
+    """
+    from importlib.metadata import EntryPoint
+    from importlib.metadata import entry_points
+
+    if hook.command:
+        return partial(run_command, hook.command, timeout=hook.timeout)
+
+    if not hook.entry_point:
+        raise ValueError("A post-download hook needs an entry_point or a command")
+
+    if ":" in hook.entry_point:
+        entry_point = EntryPoint(
+            name=hook.entry_point, value=hook.entry_point, group=HOOK_ENTRY_POINT_GROUP
+        )
+    else:
+        installed = entry_points()
+        if hasattr(installed, "select"):
+            installed = installed.select(group=HOOK_ENTRY_POINT_GROUP)
+        else:
+            installed = installed.get(HOOK_ENTRY_POINT_GROUP, [])
+        entry_point = next(
+            (
+                entry_point
+                for entry_point in installed
+                if entry_point.name == hook.entry_point
+            ),
+            None,
+        )
+        if entry_point is None:
+            raise ValueError(
+                f"No post-download hook {hook.entry_point} installed in "
+                f"entry point group {HOOK_ENTRY_POINT_GROUP}"
+            )
+
+    try:
+        function = entry_point.load()
+    except (ImportError, AttributeError) as err:
+        raise ValueError(
+            f"Cannot load post-download hook {hook.entry_point}: {err}"
+        ) from err
+    if not callable(function):
+        raise ValueError(f"Post-download hook {hook.entry_point} is not callable")
+    return function
+
+
+def run_command(command, target_file, geojson, timeout=None):
+    """Run a command for a downloaded product.
+
+    Parameters
+    ----------
+    command: list
+        The command and its arguments. The placeholders {path},
+        {file_name}, {directory} and {geojson} (the path of the geojson
+        sidecar) in the arguments are replaced, other braces are passed
+        as they are, e.g. in jq or awk programs
+    target_file: pathlib.Path
+        The product file
+    geojson: dict
+        The geojson of the product
+    timeout: int
+        Number of seconds after which the command is killed, None to wait
+        for it to finish
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        If the command exits with an error
+    subprocess.TimeoutExpired
+        If the command does not finish in time
+    """
+    values = {
+        "path": str(target_file),
+        "file_name": target_file.name,
+        "directory": str(target_file.parent),
+        "geojson": str(target_file)[:-4] + ".json",
+    }
+    subprocess.run(
+        [
+            COMMAND_PLACEHOLDER.sub(lambda match: values[match.group(1)], argument)
+            for argument in command
+        ],
+        check=True,
+        timeout=timeout,
+    )
+
+
+def write_sidecar(target_file, geojson):
+    """Write the geojson sidecar of a product.
+
+    Parameters
+    ----------
+    target_file: pathlib.Path
+        The product file, the sidecar is written next to it
+    geojson: dict
+        The geojson of the product
+
+    Returns
+    -------
+    str
+        The path of the sidecar
+    """
+    product_geojson_file = str(target_file)[:-4] + ".json"
+    logger.info("Saving product geojson to %s", product_geojson_file)
+    with open(product_geojson_file, "w") as f:
+        f.write(json.dumps(geojson, indent=2))
+    return product_geojson_file
+
+
+class PostProcessor:
+    """Pool of threads post-processing downloaded products.
+
+    Parameters
+    ----------
+    workers: int
+        Number of threads
+    hooks: list
+        The hooks run for every downloaded product, see load_hook
+    """
+
+    def __init__(self, workers=1, hooks=()):
+        self.hooks = list(hooks)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, workers), thread_name_prefix="post"
+        )
+
+    def submit(self, function, *args):
+        """Submit post-processing of a product.
+
+        Parameters
+        ----------
+        function: callable
+            The function doing the post-processing
+        *args:
+            Arguments of the function
+
+        Returns
+        -------
+        concurrent.futures.Future
+            The future of the result of the function
+        """
+        return self._executor.submit(function, *args)
+
+    def run_hooks(self, target_file, geojson):
+        """Run the hooks for a downloaded product.
+
+        A hook that fails is logged, it does not stop the other hooks.
+
+        Parameters
+        ----------
+        target_file: pathlib.Path
+            The product file
+        geojson: dict
+            The geojson of the product
+
+        Returns
+        -------
+        int
+            The number of hooks that failed
+        """
+        errors = 0
+        for hook in self.hooks:
+            try:
+                hook(target_file, geojson)
+            except Exception:
+                logger.exception("Post-download hook failed for %s", target_file.name)
+                errors += 1
+        return errors
+
+    def shutdown(self):
+        """Wait for post-processing to finish and stop the threads."""
+        self._executor.shutdown(wait=True)
+
+
+# Eof
@@ -0,0 +1,42 @@
+# product.py
+"""Product.
+
+Products restored from their geojson, e.g. from a cache or a file
+written by an earlier run, without asking ASF for them again.
+
+"""
+
+
+class Product:
+    """A product restored from its geojson.
+
+    Provides the parts of `asf_search.ASFProduct` used for downloading a
+    product: its properties and its geojson.
+
+    Parameters
+    ----------
+    geojson: dict
+        The geojson feature of the product, as returned by
+        `asf_search.ASFProduct.geojson`
+    """
+
+    def __init__(self, geojson):
+        self.properties = geojson["properties"]
+        self.geometry = geojson.get("geometry")
+
+    def geojson(self):
+        """Return the geojson feature of the product.
+
+        Returns
+        -------
+        dict
+            The geojson feature of the product
+        """
+        return {
+            "type": "Feature",
+            "geometry": self.geometry,
+            "properties": self.properties,
+        }
+
+
+# Eof
@@ -0,0 +1,371 @@
+# report.py
+"""Report.
+
+Structured report of a download run: what happened to every product and
+how long the searches took, written as json or as a Prometheus textfile
+for the node exporter, so runs can be monitored without parsing logs.
+
+"""
+
+from dataclasses import asdict
+from dataclasses import dataclass
+import datetime
+import json
+import threading
+import time
+from typing import Optional
+
+from caroline_download.search_state import write_text
+
+# Prefix of all Prometheus metric names
+METRIC_PREFIX = "caroline_download"
+
+
+@dataclass
+class ProductReport:
+    """Data class with the measurements of a single product."""
+
+    file_name: str
+    outcome: Optional[str] = None
+    bytes: Optional[int] = None
+    transfer_seconds: Optional[float] = None
+    verify_seconds: Optional[float] = None
+    hook_errors: Optional[int] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class SearchReport:
+    """Data class with the measurements of a single search request.
+
+    For geo searches `start` and `end` are the interval searched and
+    `aoi` the name of the search, for product searches `names` is the
+    number of names searched for.
+    """
+
+    kind: str
+    aoi: Optional[str] = None
+    start: Optional[str] = None
+    end: Optional[str] = None
+    names: Optional[int] = None
+    seconds: Optional[float] = None
+    results: Optional[int] = None
+    cached: bool = False
+    error: Optional[str] = None
+
+
+class RunReport:
+    """Report of a download run.
+
+    Measurements are recorded from the search and download threads while
+    the run is in progress, the totals when it finishes.
+    """
+
+    def __init__(self):
+        self.started = datetime.datetime.now()
+        self.finished = None
+        self.duration = None
+        self.counts = {}
+        self.bytes_transferred = 0
+        self.failed_backlog = None
+        self.phases = {}
+        self.http_requests = None
+        self.http_redirects = None
+        self.bytes_needed = None
+        self.products = {}
+        self.searches = []
+        # File names of the products found per area of interest
+        self.aois = {}
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def product(self, file_name, **values):
+        """Record measurements of a product.
+
+        Parameters
+        ----------
+        file_name: str
+            The file name of the product
+        **values:
+            The measurements, see ProductReport
+        """
+        with self._lock:
+            report = self.products.setdefault(file_name, ProductReport(file_name))
+            for name, value in values.items():
+                setattr(report, name, value)
+
+    def search(self, kind, interval=None, **values):
+        """Record measurements of a search request.
+
+        Parameters
+        ----------
+        kind: str
+            The kind of search, e.g. 'geo' or 'product'
+        interval: tuple
+            start and end of the interval of a geo search
+        **values:
+            The measurements, see SearchReport
+        """
+        if interval:
+            values["start"], values["end"] = (moment.isoformat() for moment in interval)
+        with self._lock:
+            self.searches.append(SearchReport(kind, **values))
+
+    def aoi(self, name, file_names):
+        """Record products found by the geo search of an area of interest.
+
+        Parameters
+        ----------
+        name: str
+            The name of the geo search
+        file_names: list
+            The file names of the products found
+        """
+        with self._lock:
+            self.aois.setdefault(name, set()).update(file_names)
+
+    def aoi_counts(self):
+        """Return what the geo search of every area of interest contributed.
+
+        Returns
+        -------
+        list
+            Per area of interest a dict with its name, the number of
+            products found, the number not found by any other search
+            ('unique') and the number of products found per outcome
+        """
+        with self._lock:
+            aois = {name: set(file_names) for name, file_names in self.aois.items()}
+            outcomes = {
+                file_name: report.outcome for file_name, report in self.products.items()
+            }
+
+        counts = []
+        for name, file_names in aois.items():
+            others = set().union(
+                *(other for other_name, other in aois.items() if other_name != name)
+            )
+            aoi = {
+                "name": name,
+                "found": len(file_names),
+                "unique": len(file_names - others),
+            }
+            for outcome in ("downloaded", "skipped", "planned", "failed"):
+                aoi[outcome] = sum(
+                    1 for file_name in file_names if outcomes.get(file_name) == outcome
+                )
+            counts.append(aoi)
+        return counts
+
+    def finish(
+        self,
+        summary,
+        bytes_transferred,
+        failed_backlog=None,
+        phases=None,
+        http_requests=None,
+        http_redirects=None,
+        bytes_needed=None,
+    ):
+        """Record the totals of the run.
+
+        Parameters
+        ----------
+        summary: DownloadSummary
+            The outcome of the run
+        bytes_transferred: int
+            The number of bytes transferred over the network
+        failed_backlog: int
+            Number of products in the failure journal, None when unknown
+        phases: dict
+            The time spent per phase, see download.PhaseTimers.totals
+        http_requests: int
+            Number of HTTP requests made, including redirects
+        http_redirects: int
+            Number of HTTP redirects followed, e.g. for authentication
+        bytes_needed: int
+            Number of bytes the planned products of a dry run need
+        """
+        self.finished = datetime.datetime.now()
+        self.duration = time.monotonic() - self._started
+        self.counts = {
+            outcome: len(getattr(summary, outcome))
+            for outcome in ("downloaded", "skipped", "planned", "failed", "not_found")
+        }
+        self.bytes_transferred = bytes_transferred
+        self.failed_backlog = failed_backlog
+        self.phases = phases or {}
+        self.http_requests = http_requests
+        self.http_redirects = http_redirects
+        self.bytes_needed = bytes_needed
+
+    def to_dict(self):
+        """Return the report as a json serializable dict."""
+        with self._lock:
+            products = [asdict(report) for report in self.products.values()]
+            searches = [asdict(report) for report in self.searches]
+        return {
+            "started": self.started.isoformat(timespec="seconds"),
+            "finished": (
+                self.finished.isoformat(timespec="seconds") if self.finished else None
+            ),
+            "duration_seconds": self.duration,
+            "counts": self.counts,
+            "bytes_transferred": self.bytes_transferred,
+            "throughput_bytes_per_second": (
+                self.bytes_transferred / self.duration if self.duration else None
+            ),
+            "failed_backlog": self.failed_backlog,
+            "phases": self.phases,
+            "http_requests": self.http_requests,
+            "http_redirects": self.http_redirects,
+            "bytes_needed": self.bytes_needed,
+            "aois": self.aoi_counts(),
+            "products": products,
+            "searches": searches,
+        }
+
+    def write_json(self, file):
+        """Write the report as json.
+
+        Parameters
+        ----------
+        file: pathlib.Path
+            The file to write
+        """
+        write_text(file, json.dumps(self.to_dict(), indent=2))
+
+    def write_prometheus(self, file):
+        """Write the report as a Prometheus textfile.
+
+        The file is meant for the textfile collector of the node exporter,
+        it is replaced atomically so the collector never reads a partial
+        file.
+
+        Parameters
+        ----------
+        file: pathlib.Path
+            The file to write, its name should end in '.prom'
+        """
+        report = self.to_dict()
+        searches = [
+            search for search in report["searches"] if search["seconds"] is not None
+        ]
+        lines = []
+
+        def metric(name, help, value, labels=None):
+            # HELP and TYPE only once per metric name
+            if not any(line.startswith(f"# HELP {name} ") for line in lines):
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} gauge")
+            label_str = (
+                "{"
+                + ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels.items())
+                + "}"
+                if labels
+                else ""
+            )
+            lines.append(f"{name}{label_str} {value}")
+
+        metric(
+            f"{METRIC_PREFIX}_last_run_timestamp_seconds",
+            "Time the last run finished.",
+            (self.finished or datetime.datetime.now()).timestamp(),
+        )
+        metric(
+            f"{METRIC_PREFIX}_run_duration_seconds",
+            "Duration of the last run.",
+            report["duration_seconds"] or 0,
+        )
+        for outcome, count in report["counts"].items():
+            metric(
+                f"{METRIC_PREFIX}_products",
+                "Number of products by outcome in the last run.",
+                count,
+                {"outcome": outcome},
+            )
+        metric(
+            f"{METRIC_PREFIX}_transferred_bytes",
+            "Bytes transferred in the last run.",
+            report["bytes_transferred"],
+        )
+        metric(
+            f"{METRIC_PREFIX}_throughput_bytes_per_second",
+            "Average throughput of the last run.",
+            report["throughput_bytes_per_second"] or 0,
+        )
+        if report["failed_backlog"] is not None:
+            metric(
+                f"{METRIC_PREFIX}_failed_backlog_products",
+                "Number of products in the failure journal.",
+                report["failed_backlog"],
+            )
+        if report["http_requests"] is not None:
+            metric(
+                f"{METRIC_PREFIX}_http_requests",
+                "Number of HTTP requests in the last run, including redirects.",
+                report["http_requests"],
+            )
+            metric(
+                f"{METRIC_PREFIX}_http_redirects",
+                "Number of HTTP redirects in the last run.",
+                report["http_redirects"],
+            )
+        # The samples of a metric have to be together, one loop per metric
+        for aoi in report["aois"]:
+            metric(
+                f"{METRIC_PREFIX}_aoi_products",
+                "Number of products found by the geo search of an area of "
+                "interest in the last run.",
+                aoi["found"],
+                {"aoi": aoi["name"]},
+            )
+        for aoi in report["aois"]:
+            metric(
+                f"{METRIC_PREFIX}_aoi_unique_products",
+                "Number of products only found by the geo search of an area "
+                "of interest in the last run.",
+                aoi["unique"],
+                {"aoi": aoi["name"]},
+            )
+        if report["bytes_needed"] is not None:
+            metric(
+                f"{METRIC_PREFIX}_needed_bytes",
+                "Bytes the products planned by the last (dry) run need.",
+                report["bytes_needed"],
+            )
+        metric(
+            f"{METRIC_PREFIX}_searches",
+            "Number of search requests in the last run.",
+            len(report["searches"]),
+        )
+        metric(
+            f"{METRIC_PREFIX}_search_errors",
+            "Number of failed search requests in the last run.",
+            sum(1 for search in report["searches"] if search["error"]),
+        )
+        metric(
+            f"{METRIC_PREFIX}_search_results",
+            "Number of search results in the last run.",
+            sum(search["results"] or 0 for search in report["searches"]),
+        )
+        metric(
+            f"{METRIC_PREFIX}_search_seconds",
+            "Total duration of the search requests in the last run.",
+            sum(search["seconds"] for search in searches),
+        )
+        metric(
+            f"{METRIC_PREFIX}_search_max_seconds",
+            "Duration of the slowest search request in the last run.",
+            max((search["seconds"] for search in searches), default=0),
+        )
+
+        write_text(file, "\n".join(lines) + "\n")
+
+
+def _escape_label(value):
+    """Escape a label value for the Prometheus text format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Eof
@@ -0,0 +1,277 @@
+# retry.py
+"""Retry.
+
+Retry calls to ASF with jittered exponential backoff, pause all calls
+with a circuit breaker when ASF is clearly down, and keep a journal of
+products that failed so they can be retried later.
+
+"""
+
+import datetime
+import json
+import logging
+import random
+import threading
+import time
+
+from caroline_download.lock import locked
+from caroline_download.product import Product
+from caroline_download.search_state import write_json
+
+# Setup logging 'library-style', see download.py
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Name of the failure journal in the state directory
+JOURNAL_FILE_NAME = "failed.json"
+
+# HTTP status codes of errors worth retrying
+RETRYABLE_STATUS_CODES = (408, 425, 429, 500, 502, 503, 504)
+
+
+def is_retryable(error):
+    """Decide whether an error is worth retrying.
+
+    Connection problems, timeouts and server errors are transient, client
+    errors such as a failed authentication or a missing product are not.
+
+    Parameters
+    ----------
+    error: Exception
+        The error
+
+    Returns
+    -------
+    bool
+        True if the call that raised the error should be retried
+    """
+    # Imported here, so importing this module does not pay for them
+    from asf_search.exceptions import ASFSearch5xxError
+    from asf_search.exceptions import CMRIncompleteError
+    import requests
+
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(
+        error,
+        (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+            ConnectionError,
+            TimeoutError,
+            ASFSearch5xxError,
+            CMRIncompleteError,
+        ),
+    )
+
+
+class CircuitBreaker:
+    """Circuit breaker pausing all calls after repeated failures.
+
+    After `threshold` consecutive failures, over all calls sharing the
+    breaker, the circuit opens and every call waits for `pause` seconds
+    before trying again. A single failure after the pause opens the
+    circuit again.
+
+    Parameters
+    ----------
+    threshold: int
+        Number of consecutive failures that opens the circuit
+    pause: float
+        Number of seconds calls are paused when the circuit is open
+    """
+
+    def __init__(self, threshold, pause):
+        self.threshold = threshold
+        self.pause = pause
+        self._failures = 0
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Wait while the circuit is open."""
+        with self._lock:
+            wait = self._open_until - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+    def success(self):
+        """Record a successful call."""
+        with self._lock:
+            self._failures = 0
+
+    def failure(self):
+        """Record a failed call."""
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.threshold:
+                if self._open_until <= time.monotonic():
+                    logger.warning(
+                        f"{self._failures} consecutive failures, "
+                        f"pausing for {self.pause} seconds"
+                    )
+                self._open_until = time.monotonic() + self.pause
+                # Allow one failure less, so the next one opens the circuit
+                self._failures = self.threshold - 1
+
+
+def retry_call(
+    function,
+    *args,
+    retries=3,
+    backoff=2.0,
+    max_backoff=300.0,
+    breaker=None,
+    description=None,
+    **kwargs,
+):
+    """Call a function, retrying on transient errors.
+
+    Parameters
+    ----------
+    function: callable
+        The function to call
+    *args:
+        Positional arguments of the function
+    retries: int
+        Maximum number of retries after the first attempt
+    backoff: float
+        Maximum wait before the first retry in seconds. The maximum wait
+        doubles with every retry, the actual wait is random between zero
+        and the maximum (full jitter)
+    max_backoff: float
+        Upper limit of the maximum wait in seconds
+    breaker: CircuitBreaker
+        Circuit breaker shared with other calls
+    description: str
+        Description of the call for logging
+    **kwargs:
+        Keyword arguments of the function
+
+    Returns
+    -------
+    object
+        The return value of the function
+
+    Raises
+    ------
+    Exception
+        The error of the last attempt when all attempts failed, or the
+        first error that is not worth retrying
+    """
+    description = description or getattr(function, "__name__", "call")
+    attempt = 0
+    while True:
+        if breaker:
+            breaker.wait()
+        try:
+            result = function(*args, **kwargs)
+        except Exception as error:
+            if breaker:
+                breaker.failure()
+            if attempt >= retries or not is_retryable(error):
+                raise
+            wait = random.uniform(0, min(max_backoff, backoff * 2**attempt))
+            attempt += 1
+            logger.warning(
+                f"{description} failed ({error}), "
+                f"retry {attempt}/{retries} in {wait:.1f} seconds"
+            )
+            time.sleep(wait)
+        else:
+            if breaker:
+                breaker.success()
+            return result
+
+
+class FailureJournal:
+    """Journal of products that failed to download.
+
+    Several processes can update the same journal, e.g. shards of one
+    search: the journal is read again and updated under a lock file every
+    time it is written, see lock.locked.
+
+    Parameters
+    ----------
+    state_directory: pathlib.Path
+        The directory the journal is stored in
+    read_only: bool
+        Read the journal, but do not record or remove products, e.g. for
+        a dry run
+    """
+
+    def __init__(self, state_directory, read_only=False):
+        self.file = state_directory.joinpath(JOURNAL_FILE_NAME)
+        self.read_only = read_only
+        self._lock = threading.Lock()
+
+    def _load(self):
+        # The journal is replaced atomically, it is always complete
+        try:
+            with open(self.file, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def add(self, product, reason):
+        """Record a failed product.
+
+        Parameters
+        ----------
+        product:
+            The product that failed
+        reason: str
+            Why the product failed
+        """
+        if self.read_only:
+            return
+        file_name = product.properties["fileName"]
+        with self._lock, locked(self.file):
+            entries = self._load()
+            attempts = entries.get(file_name, {}).get("attempts", 0) + 1
+            entries[file_name] = {
+                "failed": datetime.datetime.now().isoformat(timespec="seconds"),
+                "reason": reason,
+                "attempts": attempts,
+                "geojson": product.geojson(),
+            }
+            write_json(self.file, entries)
+
+    def remove(self, file_name):
+        """Remove a product from the journal.
+
+        Parameters
+        ----------
+        file_name: str
+            The file name of the product
+        """
+        if self.read_only:
+            return
+        with self._lock:
+            if file_name not in self._load():
+                return
+            with locked(self.file):
+                entries = self._load()
+                if entries.pop(file_name, None) is not None:
+                    write_json(self.file, entries)
+
+    def count(self):
+        """Return the number of products in the journal."""
+        with self._lock:
+            return len(self._load())
+
+    def products(self):
+        """Return the products in the journal.
+
+        Returns
+        -------
+        list
+            The products, restored from their geojson
+        """
+        with self._lock:
+            entries = self._load()
+            return [Product(entry["geojson"]) for entry in entries.values()]
+
+
+# Eof
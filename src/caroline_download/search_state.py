@@ -0,0 +1,220 @@
+# search_state.py
+"""Search state.
+
+State kept between runs of the same geo search: a watermark recording up
+to when the search completed successfully, and a cache of the results of
+intervals that are closed and will not change anymore.
+
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from caroline_download.lock import locked
+from caroline_download.product import Product
+
+# Setup logging 'library-style', see download.py
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Names of the watermark file and cache directory in the state directory
+WATERMARK_FILE_NAME = "watermarks.json"
+SEARCH_CACHE_DIRECTORY_NAME = "search-cache"
+
+
+def search_key(geo_search, wkt_str):
+    """Compute the key identifying a geo search specification.
+
+    The key depends on the dataset, region of interest, relative orbits
+    and product type, not on the time range, so it stays the same for
+    searches like 'one month ago' to 'now'.
+
+    Parameters
+    ----------
+    geo_search:
+        search configuration
+    wkt_str: str
+        the region of interest as a wkt string
+
+    Returns
+    -------
+    str
+        The key (a hexdigest)
+    """
+    spec = {
+        "dataset": geo_search.dataset,
+        "wkt": hashlib.sha256(wkt_str.encode()).hexdigest(),
+        "relative_orbits": sorted(geo_search.relative_orbits),
+        "product_type": geo_search.product_type,
+    }
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+
+def write_text(file, text):
+    """Write text to a file atomically.
+
+    Parameters
+    ----------
+    file: pathlib.Path
+        The file to write
+    text: str
+        The text to write
+    """
+    os.makedirs(file.parent, exist_ok=True)
+    temporary_file = file.with_name(f".{file.name}.{os.getpid()}.tmp")
+    with open(temporary_file, "w") as f:
+        f.write(text)
+    os.replace(temporary_file, file)
+
+
+def write_json(file, data):
+    """Write json to a file atomically.
+
+    Parameters
+    ----------
+    file: pathlib.Path
+        The file to write
+    data:
+        The data to write
+    """
+    write_text(file, json.dumps(data))
+
+
+class Watermarks:
+    """Watermarks of geo searches.
+
+    The watermark of a search is the end of the last time range it was
+    searched up to without errors.
+
+    Parameters
+    ----------
+    state_directory: pathlib.Path
+        The directory the watermarks are stored in
+    """
+
+    def __init__(self, state_directory):
+        self.file = state_directory.joinpath(WATERMARK_FILE_NAME)
+        self._lock = threading.Lock()
+
+    def _read(self):
+        if not self.file.exists():
+            return {}
+        with open(self.file, "r") as f:
+            return json.load(f)
+
+    def get(self, key):
+        """Get the watermark of a search.
+
+        Parameters
+        ----------
+        key: str
+            The key of the search, see search_key
+
+        Returns
+        -------
+        datetime.datetime or None
+            The watermark, None if the search has no watermark yet
+        """
+        with self._lock:
+            watermark = self._read().get(key)
+        return datetime.datetime.fromisoformat(watermark) if watermark else None
+
+    def set(self, key, watermark):
+        """Set the watermark of a search.
+
+        Watermarks only move forward, an earlier watermark than the
+        current one is ignored. The watermarks are read again and updated
+        under a lock file, so watermarks set by other processes are kept.
+
+        Parameters
+        ----------
+        key: str
+            The key of the search, see search_key
+        watermark: datetime.datetime
+            The new watermark
+        """
+        with self._lock, locked(self.file):
+            watermarks = self._read()
+            current = watermarks.get(key)
+            if current and datetime.datetime.fromisoformat(current) >= watermark:
+                return
+            watermarks[key] = watermark.isoformat()
+            write_json(self.file, watermarks)
+        logger.debug("Watermark of %s set to %s.", key, watermark)
+
+
+class SearchCache:
+    """Cache of geo search results per interval.
+
+    Parameters
+    ----------
+    state_directory: pathlib.Path
+        The directory the cache is stored in
+    ttl: int
+        Time to live of cached results in hours
+    """
+
+    def __init__(self, state_directory, ttl):
+        self.directory = state_directory.joinpath(SEARCH_CACHE_DIRECTORY_NAME)
+        self.ttl = datetime.timedelta(hours=ttl)
+
+    def _file(self, key, interval):
+        start, end = (moment.strftime("%Y%m%dT%H%M%S") for moment in interval)
+        return self.directory.joinpath(key, f"{start}_{end}.json")
+
+    def get(self, key, interval):
+        """Get the cached result of an interval.
+
+        Parameters
+        ----------
+        key: str
+            The key of the search, see search_key
+        interval: tuple
+            start and end of the interval
+
+        Returns
+        -------
+        list or None
+            The products found in the interval, None if the result is not
+            cached or has expired
+        """
+        cache_file = self._file(key, interval)
+        try:
+            with open(cache_file, "r") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        created = datetime.datetime.fromisoformat(cached["created"])
+        if datetime.datetime.now() - created > self.ttl:
+            logger.debug("Cached result %s expired.", cache_file)
+            return None
+
+        return [Product(feature) for feature in cached["features"]]
+
+    def put(self, key, interval, result):
+        """Cache the result of an interval.
+
+        Parameters
+        ----------
+        key: str
+            The key of the search, see search_key
+        interval: tuple
+            start and end of the interval
+        result:
+            The products found in the interval
+        """
+        write_json(
+            self._file(key, interval),
+            {
+                "created": datetime.datetime.now().isoformat(),
+                "features": [product.geojson() for product in result],
+            },
+        )
+
+
+# Eof
@@ -0,0 +1,60 @@
+# shard.py
+"""Shard.
+
+Split the products found by a search deterministically over several
+workers, e.g. runs on different cluster nodes sharing a base directory.
+
+"""
+
+import hashlib
+import re
+
+
+def parse_shard(shard):
+    """Parse a shard specification.
+
+    Parameters
+    ----------
+    shard: str
+        A shard such as '2/4', the second of four shards
+
+    Returns
+    -------
+    tuple
+        The index (starting at 1) and the number of shards
+
+    Raises
+    ------
+    ValueError
+        If the shard cannot be parsed
+    """
+    match = re.fullmatch(r"\s*([0-9]+)\s*/\s*([0-9]+)\s*", str(shard))
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise ValueError(f"Invalid shard: {shard}, expected i/N with 1 <= i <= N")
+    return int(match.group(1)), int(match.group(2))
+
+
+def in_shard(file_name, shard):
+    """Decide whether a product belongs to a shard.
+
+    Products are assigned to shards by a hash of their file name, so every
+    worker assigns a product to the same shard, whatever search found it.
+
+    Parameters
+    ----------
+    file_name: str
+        The file name of the product
+    shard: tuple
+        The index and the number of shards, see parse_shard
+
+    Returns
+    -------
+    bool
+        True if the product belongs to the shard
+    """
+    index, count = shard
+    digest = hashlib.sha256(file_name.encode()).digest()
+    return int.from_bytes(digest[:8], "big") % count == index - 1
+
+
+# Eof
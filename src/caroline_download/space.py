@@ -0,0 +1,158 @@
+# space.py
+"""Space.
+
+Admission control on the free space of the filesystem products are
+downloaded to: space is reserved for a product before its transfer
+starts, and no transfers are started that would bring the free space
+below a floor, so a large backfill does not fill the filesystem halfway
+and leave truncated files behind.
+
+"""
+
+import logging
+import os
+import re
+import shutil
+import threading
+
+from caroline_download.throttle import UNITS
+
+# Setup logging 'library-style', see download.py
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class InsufficientDiskSpace(Exception):
+    """There is not enough free space to download a product."""
+
+
+def parse_size(size):
+    """Parse a size specification.
+
+    Parameters
+    ----------
+    size: str or int
+        A size such as '50GB', '1.5 TiB' or 1000000 (bytes)
+
+    Returns
+    -------
+    int
+        The size in bytes
+
+    Raises
+    ------
+    ValueError
+        If the size cannot be parsed
+    """
+    match = re.fullmatch(r"\s*([0-9]*\.?[0-9]+)\s*([a-zA-Z]*)\s*", str(size))
+    if not match or match.group(2).upper() not in UNITS:
+        raise ValueError(f"Invalid size: {size}")
+    return int(float(match.group(1)) * UNITS[match.group(2).upper()])
+
+
+def format_size(size):
+    """Format a size in bytes for humans.
+
+    Parameters
+    ----------
+    size: int
+        The size in bytes
+
+    Returns
+    -------
+    str
+        The size in GB, or in MB when smaller than a GB
+    """
+    if abs(size) < 1000**3:
+        return f"{size / 1000**2:.1f} MB"
+    return f"{size / 1000**3:.1f} GB"
+
+
+def _allocated(file):
+    """Return the number of bytes allocated on disk for a file."""
+    try:
+        return os.stat(file).st_blocks * 512
+    except (FileNotFoundError, AttributeError):
+        return 0
+
+
+class DiskSpace:
+    """Free space of a filesystem shared by the transfers of a run.
+
+    Space is reserved per file for the bytes that are not allocated to it
+    yet, so space taken by a file that is preallocated or partially
+    downloaded is not counted twice.
+
+    Parameters
+    ----------
+    directory: pathlib.Path
+        A directory on the filesystem, it does not have to exist yet
+    min_free: int
+        Number of bytes that have to stay free
+    """
+
+    def __init__(self, directory, min_free=0):
+        self.directory = directory
+        self.min_free = min_free
+        self._reservations = {}
+        self._lock = threading.Lock()
+
+    def free(self):
+        """Return the number of free bytes on the filesystem."""
+        directory = self.directory
+        while not os.path.exists(directory) and directory != directory.parent:
+            directory = directory.parent
+        return shutil.disk_usage(directory).free
+
+    def available(self):
+        """Return the number of bytes that can still be reserved."""
+        with self._lock:
+            return self._available()
+
+    def _available(self):
+        # Free bytes minus those reserved and not allocated yet
+        reserved = sum(
+            max(0, size - _allocated(file)) for file, size in self._reservations.items()
+        )
+        return self.free() - reserved - self.min_free
+
+    def reserve(self, file, size):
+        """Reserve space for a file.
+
+        Parameters
+        ----------
+        file: pathlib.Path
+            The file that is going to be written
+        size: int
+            The size of the file in bytes
+
+        Raises
+        ------
+        InsufficientDiskSpace
+            If the file does not fit without the free space going below
+            the floor
+        """
+        with self._lock:
+            needed = max(0, size - _allocated(file))
+            available = self._available()
+            if needed > available:
+                raise InsufficientDiskSpace(
+                    f"Not enough disk space for {file.name}: "
+                    f"{format_size(needed)} needed, {format_size(max(0, available))} "
+                    f"available above the floor of {format_size(self.min_free)}"
+                )
+            self._reservations[file] = size
+
+    def release(self, file):
+        """Release the space reserved for a file.
+
+        Parameters
+        ----------
+        file: pathlib.Path
+            The file space was reserved for
+        """
+        with self._lock:
+            self._reservations.pop(file, None)
+
+
+# Eof
@@ -0,0 +1,190 @@
+# throttle.py
+"""Throttle.
+
+Limit the bandwidth and the number of simultaneous connections used by
+all transfers of a run, and keep track of the throughput.
+
+"""
+
+from contextlib import contextmanager
+import re
+import threading
+import time
+
+# Multipliers of the units accepted in bandwidth specifications
+UNITS = {
+    "": 1,
+    "B": 1,
+    "KB": 1000,
+    "MB": 1000**2,
+    "GB": 1000**3,
+    "KIB": 1024,
+    "MIB": 1024**2,
+    "GIB": 1024**3,
+}
+
+
+def parse_bandwidth(bandwidth):
+    """Parse a bandwidth specification.
+
+    Parameters
+    ----------
+    bandwidth: str
+        A bandwidth such as '400MB/s', '1.5 GiB/s' or '1000000'
+
+    Returns
+    -------
+    float
+        The bandwidth in bytes per second
+
+    Raises
+    ------
+    ValueError
+        If the bandwidth cannot be parsed
+    """
+    match = re.fullmatch(
+        r"\s*([0-9]*\.?[0-9]+)\s*([a-zA-Z]*)\s*(/\s*s)?\s*", str(bandwidth)
+    )
+    if not match or match.group(2).upper() not in UNITS:
+        raise ValueError(f"Invalid bandwidth: {bandwidth}")
+    return float(match.group(1)) * UNITS[match.group(2).upper()]
+
+
+def format_rate(rate):
+    """Format a rate in bytes per second for humans.
+
+    Parameters
+    ----------
+    rate: float
+        The rate in bytes per second
+
+    Returns
+    -------
+    str
+        The rate in MB/s
+    """
+    return f"{rate / 1000**2:.1f} MB/s"
+
+
+class TokenBucket:
+    """Token bucket rate limiter.
+
+    Tokens (bytes) are added at a fixed rate up to the capacity of the
+    bucket. Consuming more tokens than available blocks until the bucket
+    has refilled.
+
+    Parameters
+    ----------
+    rate: float
+        Rate at which tokens are added, in tokens per second
+    capacity: float
+        Maximum number of tokens in the bucket, i.e. the largest burst.
+        Defaults to one second worth of tokens
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, tokens):
+        """Consume tokens, waiting until they are available.
+
+        Parameters
+        ----------
+        tokens: float
+            The number of tokens to consume
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            # Take the tokens right away, going into debt if needed, and
+            # wait for the debt to be paid off outside the lock
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+
+        if wait:
+            time.sleep(wait)
+
+
+class Throttle:
+    """Bandwidth and connection limits shared by all transfers of a run.
+
+    Parameters
+    ----------
+    max_bandwidth: str
+        Maximum total bandwidth, e.g. '400MB/s'. None for no limit
+    max_connections: int
+        Maximum number of simultaneous connections. None for no limit
+    """
+
+    def __init__(self, max_bandwidth=None, max_connections=None):
+        self.bucket = (
+            TokenBucket(parse_bandwidth(max_bandwidth)) if max_bandwidth else None
+        )
+        self.connections = (
+            threading.BoundedSemaphore(max_connections) if max_connections else None
+        )
+        self.bytes = 0
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self, blocking=True):
+        """Context manager holding one of the available connections.
+
+        Parameters
+        ----------
+        blocking: bool
+            Wait for a connection to become available. When False and no
+            connection is available, the context manager yields False and
+            does not hold a connection
+
+        Yields
+        ------
+        bool
+            True if a connection is held (or there is no limit)
+        """
+        if self.connections is None:
+            yield True
+            return
+
+        if not self.connections.acquire(blocking):
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            self.connections.release()
+
+    def consume(self, size):
+        """Account for transferred bytes, waiting if over the bandwidth.
+
+        Parameters
+        ----------
+        size: int
+            The number of bytes transferred
+        """
+        with self._lock:
+            self.bytes += size
+        if self.bucket:
+            self.bucket.consume(size)
+
+    def rate(self):
+        """Return the average rate since the throttle was created.
+
+        Returns
+        -------
+        float
+            The rate in bytes per second
+        """
+        elapsed = time.monotonic() - self._started
+        return self.bytes / elapsed if elapsed > 0 else 0.0
+
+
+# Eof
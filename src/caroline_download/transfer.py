@@ -0,0 +1,605 @@
+# transfer.py
+"""Transfer.
+
+Stream products from ASF to local files, computing the checksum of the
+data while it is being written so the file does not have to be read back
+from disk afterwards. Interrupted transfers are resumed where they left
+off.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from caroline_download.search_state import write_json
+from caroline_download.throttle import format_rate
+
+# Setup logging 'library-style', see download.py
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Size of the chunks read from the network and written to disk
+TRANSFER_CHUNK_SIZE = 1024 * 1024
+
+# Number of bytes after which the position of a preallocated transfer is
+# recorded, so a transfer that is killed resumes close to where it was
+PROGRESS_RECORD_SIZE = 16 * 1024**2
+
+# Size of the chunks read when computing the checksum of a file on disk
+CHECKSUM_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Seconds between requests for a product ASF is still preparing, and the
+# number of seconds to keep trying, like asf_search downloads
+PREPARING_INTERVAL = 1
+PREPARING_TIMEOUT = 90
+
+# Suffix of the temporary file a product is downloaded into
+PART_SUFFIX = ".part"
+
+# Suffix of the file next to a partial file, recording the byte ranges a
+# segmented transfer still has to download
+SEGMENTS_SUFFIX = ".segments"
+
+
+class TransferInterrupted(Exception):
+    """The transfer was stopped, the partial file is kept for resuming."""
+
+
+def part_file_for(target_file):
+    """Return the temporary file a target file is downloaded into.
+
+    Parameters
+    ----------
+    target_file: pathlib.Path
+        The final location of the downloaded file
+
+    Returns
+    -------
+    pathlib.Path
+        The location of the partial download
+    """
+    return target_file.with_name(target_file.name + PART_SUFFIX)
+
+
+def transfer(url, target_file, session=None, throttle=None, stop=None, size=None):
+    """Transfer a url to a file.
+
+    If target_file already contains the first part of the data, e.g.
+    from an interrupted earlier transfer, the transfer is resumed from
+    the end of the data with an HTTP Range request. When the server does
+    not honour the Range request, the file is downloaded from the start.
+
+    Parameters
+    ----------
+    url: str
+        The url to download
+    target_file: pathlib.Path
+        The file to write the downloaded data to
+    session: asf_search.ASFSession
+        The session to use. When not given a new session is created,
+        authenticating with .netrc
+    throttle: Throttle
+        Bandwidth and connection limits shared with other transfers
+    stop: threading.Event
+        When set, the transfer stops after the current chunk and raises
+        TransferInterrupted. The data received so far stays in the file,
+        a next transfer resumes from there
+    size: int
+        The expected size of the file in bytes. When given, the file is
+        preallocated and the end of the data received is recorded next to
+        it, like the ranges of a segmented transfer, to resume from. The
+        end is recorded every PROGRESS_RECORD_SIZE bytes and when the
+        transfer is interrupted
+
+    Returns
+    -------
+    tuple
+        The md5 checksum (hexdigest) of the complete file and its size in
+        bytes
+    """
+    logger.debug("url: %s.", url)
+    logger.debug("target_file: %s.", target_file)
+
+    if session is None:
+        import asf_search as asf
+
+        session = asf.ASFSession()
+
+    checksum = hashlib.md5()
+    segments_file = segments_file_for(target_file)
+    ranges = _read_ranges(segments_file, size) if size else None
+    if ranges is not None and len(ranges) > 1 and target_file.exists():
+        # Left behind by a segmented transfer, it cannot be resumed in
+        # a single stream
+        logger.info("Restarting segmented download of %s", target_file)
+        target_file.unlink()
+    preallocated = ranges is not None and len(ranges) <= 1 and target_file.exists()
+
+    if preallocated:
+        offset = ranges[0][0] if ranges else size
+    elif size:
+        # Without a record, resume from the data of a transfer that was
+        # not preallocated
+        offset = target_file.stat().st_size if target_file.exists() else 0
+        if offset > size:
+            offset = 0
+        # Record the position before preallocating changes the size of the
+        # file, then reserve the blocks of the whole file up front
+        _write_ranges(segments_file, size, [[offset, size]])
+        fd = os.open(
+            target_file,
+            os.O_WRONLY | os.O_CREAT | (0 if offset else os.O_TRUNC),
+            0o644,
+        )
+        try:
+            _preallocate(fd, size)
+        finally:
+            os.close(fd)
+        preallocated = True
+    else:
+        offset = target_file.stat().st_size if target_file.exists() else 0
+    headers = {}
+
+    if offset:
+        logger.info("Resuming download of %s at byte %d", target_file, offset)
+        headers["Range"] = f"bytes={offset}-"
+
+    with (
+        _connection(throttle),
+        _get(session, url, headers, stop) as response,
+    ):
+        if offset and response.status_code == 416:
+            # Range not satisfiable, the partial file is already complete
+            logger.debug("Partial file %s is already complete.", target_file)
+            update_checksum(checksum, target_file, size=offset)
+            segments_file.unlink(missing_ok=True)
+            return checksum.hexdigest(), offset
+
+        response.raise_for_status()
+
+        if offset and response.status_code == 206:
+            # Server honours the range, hash what we already have and append
+            update_checksum(checksum, target_file, size=offset)
+        elif offset:
+            logger.info("Server does not support resuming, restarting %s", target_file)
+            offset = 0
+
+        position = offset
+        recorded = offset
+        started = time.monotonic()
+        if preallocated:
+            # Overwrite the preallocated blocks, keeping the size
+            f = open(target_file, "r+b")
+            f.seek(offset)
+        else:
+            f = open(target_file, "ab" if offset else "wb")
+        try:
+            with f:
+                for chunk in response.iter_content(chunk_size=TRANSFER_CHUNK_SIZE):
+                    if stop is not None and stop.is_set():
+                        raise TransferInterrupted(
+                            f"Transfer of {target_file.name} stopped at byte {position}"
+                        )
+                    if throttle:
+                        throttle.consume(len(chunk))
+                    f.write(chunk)
+                    checksum.update(chunk)
+                    position += len(chunk)
+                    if preallocated and position - recorded >= PROGRESS_RECORD_SIZE:
+                        # The data has to be on disk before its position
+                        # is recorded
+                        f.flush()
+                        os.fsync(f.fileno())
+                        _write_ranges(
+                            segments_file, size, [[min(position, size), size]]
+                        )
+                        recorded = position
+        except BaseException:
+            if preallocated:
+                _write_ranges(segments_file, size, [[min(position, size), size]])
+            raise
+        elapsed = time.monotonic() - started
+
+    if preallocated:
+        segments_file.unlink(missing_ok=True)
+
+    logger.info(
+        "Transferred %d bytes of %s in %.1f s (%s)",
+        position - offset,
+        target_file.name,
+        elapsed,
+        format_rate((position - offset) / max(elapsed, 1e-9)),
+    )
+    logger.debug("computed checksum: %s.", checksum.hexdigest())
+
+    return checksum.hexdigest(), position
+
+
+def segments_file_for(target_file):
+    """Return the file recording the ranges a transfer still has to do.
+
+    Parameters
+    ----------
+    target_file: pathlib.Path
+        The file being downloaded, usually a partial file
+
+    Returns
+    -------
+    pathlib.Path
+        The file with the ranges still to be downloaded
+    """
+    return target_file.with_name(target_file.name + SEGMENTS_SUFFIX)
+
+
+def split_ranges(size, segments, min_segment_size):
+    """Split a file into byte ranges to download in parallel.
+
+    Parameters
+    ----------
+    size: int
+        The size of the file in bytes
+    segments: int
+        Maximum number of ranges
+    min_segment_size: int
+        Minimum size of a range in bytes
+
+    Returns
+    -------
+    list
+        The ranges as [start, end] lists, end exclusive
+    """
+    count = max(1, min(segments, size // max(1, min_segment_size)))
+    bounds = [size * index // count for index in range(count + 1)]
+    return [[start, end] for start, end in zip(bounds, bounds[1:])]
+
+
+def segmented_transfer(
+    url,
+    target_file,
+    size,
+    segments,
+    min_segment_size,
+    session=None,
+    throttle=None,
+    stop=None,
+    preallocate=True,
+):
+    """Transfer a url to a file in byte ranges downloaded in parallel.
+
+    Every range is written at its offset with positional writes. The
+    ranges still to be downloaded are kept in a file next to target_file,
+    so an interrupted transfer is resumed.
+    When the server does not support Range requests, or the file is too
+    small to split, the file is transferred in a single stream, see
+    transfer.
+
+    The first range is downloaded on a connection of the throttle, the
+    other ranges only use connections that are available right away.
+
+    Parameters
+    ----------
+    url: str
+        The url to download
+    target_file: pathlib.Path
+        The file to write the downloaded data to
+    size: int
+        The size of the file in bytes
+    segments: int
+        Maximum number of ranges downloaded in parallel
+    min_segment_size: int
+        Minimum size of a range in bytes
+    session: asf_search.ASFSession
+        The session to use. When not given a new session is created,
+        authenticating with .netrc
+    throttle: Throttle
+        Bandwidth and connection limits shared with other transfers
+    stop: threading.Event
+        When set, the transfer stops and raises TransferInterrupted. The
+        ranges still to be downloaded are kept for resuming
+    preallocate: bool
+        Allocate the whole file before writing the ranges, also when it is
+        transferred in a single stream
+
+    Returns
+    -------
+    tuple
+        The md5 checksum (hexdigest) of the file, None when the file was
+        downloaded in ranges and the checksum has to be computed from the
+        file, and the size of the file in bytes
+    """
+    segments_file = segments_file_for(target_file)
+    ranges = _read_ranges(segments_file, size) if target_file.exists() else None
+    if ranges is None:
+        ranges = split_ranges(size, segments, min_segment_size)
+        if len(ranges) < 2 or target_file.exists():
+            # Too small to split, or a partial file of a single stream
+            return transfer(
+                url,
+                target_file,
+                session,
+                throttle,
+                stop,
+                size if preallocate else None,
+            )
+    elif not ranges:
+        # Interrupted after the last range was written
+        segments_file.unlink(missing_ok=True)
+        return None, size
+    else:
+        logger.info(
+            "Resuming download of %s with %d bytes to go",
+            target_file,
+            sum(end - start for start, end in ranges),
+        )
+
+    if session is None:
+        import asf_search as asf
+
+        session = asf.ASFSession()
+
+    with _connection(throttle):
+        start, end = ranges[0]
+        response = _get(session, url, {"Range": f"bytes={start}-{end - 1}"}, stop)
+        response.raise_for_status()
+        if response.status_code != 206:
+            response.close()
+            logger.info("Server does not support ranges, downloading %s at once", url)
+            segments_file.unlink(missing_ok=True)
+            target_file.unlink(missing_ok=True)
+            return transfer(
+                url,
+                target_file,
+                session,
+                throttle,
+                stop,
+                size if preallocate else None,
+            )
+
+        fd = os.open(target_file, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            if not segments_file.exists():
+                if preallocate:
+                    _preallocate(fd, size)
+                _write_ranges(segments_file, size, ranges)
+            _transfer_ranges(
+                url,
+                fd,
+                size,
+                ranges,
+                response,
+                segments,
+                segments_file,
+                session,
+                throttle,
+                stop,
+                target_file,
+            )
+            return None, size
+        finally:
+            os.close(fd)
+
+
+def _transfer_ranges(
+    url,
+    fd,
+    size,
+    ranges,
+    response,
+    segments,
+    segments_file,
+    session,
+    throttle,
+    stop,
+    target_file,
+):
+    """Download byte ranges into a file, see segmented_transfer.
+
+    The response is the one opened for the first range, that range is
+    downloaded by the calling thread and never taken by a helper.
+    """
+    lock = threading.Lock()
+    # Stops the other ranges when one fails
+    failed = threading.Event()
+    queue = list(ranges[1:])
+    errors = []
+    started = time.monotonic()
+    transferred = 0
+
+    def fetch(byte_range, response=None):
+        # Download a range, keeping its start up to date so what is left
+        # of it can be recorded for resuming
+        nonlocal transferred
+        if response is None:
+            response = _get(
+                session,
+                url,
+                {"Range": f"bytes={byte_range[0]}-{byte_range[1] - 1}"},
+                stop,
+            )
+        with response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise ConnectionError(f"Range request for {url} not honoured")
+            for chunk in response.iter_content(chunk_size=TRANSFER_CHUNK_SIZE):
+                if stop is not None and stop.is_set():
+                    raise TransferInterrupted(f"Transfer of {target_file.name} stopped")
+                if failed.is_set():
+                    return
+                if len(chunk) > byte_range[1] - byte_range[0]:
+                    raise ConnectionError(f"Range of {url} longer than requested")
+                if throttle:
+                    throttle.consume(len(chunk))
+                view = memoryview(chunk)
+                while view:
+                    written = os.pwrite(fd, view, byte_range[0])
+                    view = view[written:]
+                    with lock:
+                        byte_range[0] += written
+                        transferred += written
+        if byte_range[0] < byte_range[1]:
+            raise ConnectionError(f"Range of {url} ended early")
+
+    def work(byte_range=None, response=None):
+        # Download the given range, then ranges from the queue until none
+        # are left
+        try:
+            if byte_range is not None:
+                fetch(byte_range, response)
+            while not failed.is_set():
+                with lock:
+                    if not queue:
+                        return
+                    byte_range = queue.pop(0)
+                fetch(byte_range)
+        except Exception as error:
+            with lock:
+                errors.append(error)
+            failed.set()
+
+    def helper():
+        # Only use a connection of the throttle that is available now, the
+        # transfer must not wait for connections held by other transfers
+        with _connection(throttle, blocking=False) as connected:
+            if connected:
+                work()
+
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(segments, len(ranges)) - 1),
+        thread_name_prefix="segment",
+    ) as executor:
+        helpers = [
+            executor.submit(helper) for _ in range(min(segments, len(ranges)) - 1)
+        ]
+        work(ranges[0], response)
+        for future in helpers:
+            future.result()
+
+    elapsed = time.monotonic() - started
+    remaining = [byte_range for byte_range in ranges if byte_range[0] < byte_range[1]]
+    if errors or remaining:
+        _write_ranges(segments_file, size, remaining)
+        if errors:
+            interrupted = [e for e in errors if isinstance(e, TransferInterrupted)]
+            raise interrupted[0] if interrupted else errors[0]
+        raise ConnectionError(f"Transfer of {url} incomplete")
+    segments_file.unlink(missing_ok=True)
+
+    logger.info(
+        "Transferred %d bytes of %s in %d ranges in %.1f s (%s)",
+        transferred,
+        target_file.name,
+        len(ranges),
+        elapsed,
+        format_rate(transferred / max(elapsed, 1e-9)),
+    )
+
+
+def _get(session, url, headers, stop=None):
+    """Open a streamed GET request the way asf_search downloads do.
+
+    The authorization header is dropped from a redirect to a presigned S3
+    url, which rejects it, see asf_search.download.download. A request
+    answered with 202 Accepted, e.g. for a burst product ASF is still
+    preparing, is repeated until the product is ready.
+
+    Returns
+    -------
+    requests.Response
+        The response, to be closed by the caller
+
+    Raises
+    ------
+    ConnectionError
+        If the product is not ready within PREPARING_TIMEOUT seconds
+    TransferInterrupted
+        If stop is set while waiting for the product
+    """
+    from asf_search.download.download import strip_auth_if_aws
+
+    # Hooks of a request replace those of the session, keep both
+    hooks = {"response": [*session.hooks["response"], strip_auth_if_aws]}
+    deadline = time.monotonic() + PREPARING_TIMEOUT
+    while True:
+        response = session.get(url, stream=True, headers=headers, hooks=hooks)
+        if response.status_code != 202:
+            return response
+        response.close()
+        if time.monotonic() >= deadline:
+            raise ConnectionError(f"{url} is still being prepared")
+        logger.debug("%s is being prepared, waiting.", url)
+        if stop is None:
+            time.sleep(PREPARING_INTERVAL)
+        elif stop.wait(PREPARING_INTERVAL):
+            raise TransferInterrupted(f"Stopped while {url} is being prepared")
+
+
+def _read_ranges(segments_file, size):
+    """Return the ranges still to download recorded in a file, or None."""
+    try:
+        with open(segments_file, "r") as f:
+            recorded = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if recorded.get("size") != size:
+        return None
+    return recorded["ranges"]
+
+
+def _write_ranges(segments_file, size, ranges):
+    """Record the ranges still to download, see _read_ranges."""
+    write_json(segments_file, {"size": size, "ranges": ranges})
+
+
+def _preallocate(fd, size):
+    """Allocate the blocks of a file before it is written."""
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        # Not supported by the platform or filesystem, only set the size
+        os.ftruncate(fd, size)
+
+
+def _connection(throttle, blocking=True):
+    """Return a context manager holding a connection of the throttle."""
+    return throttle.connection(blocking) if throttle else nullcontext(True)
+
+
+def update_checksum(checksum, file, size=None):
+    """Update a checksum with the contents of a file.
+
+    Parameters
+    ----------
+    checksum:
+        A hashlib hash object
+    file:
+        The file to add to the checksum
+    size: int
+        Only add the first `size` bytes of the file, None for all
+    """
+    # Read unbuffered, in large chunks into a single reusable buffer to
+    # keep the number of system calls and copies low
+    with open(file, "rb", buffering=0) as f:
+        buffer = bytearray(CHECKSUM_CHUNK_SIZE)
+        view = memoryview(buffer)
+        remaining = size
+        read = f.readinto(buffer if remaining is None else view[:remaining])
+        while read:
+            checksum.update(view[:read])
+            if remaining is not None:
+                remaining -= read
+                if not remaining:
+                    break
+            read = f.readinto(
+                buffer
+                if remaining is None
+                else view[: min(remaining, CHECKSUM_CHUNK_SIZE)]
+            )
+
+
+# Eof
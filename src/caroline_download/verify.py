@@ -0,0 +1,228 @@
+# verify.py
+"""Verify.
+
+Audit an existing archive: recompute the checksums of the downloaded
+products and compare them against the checksums recorded in the catalog
+or in the geojson sidecars, and report corrupt, missing and orphaned
+files.
+
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+from dataclasses import dataclass
+from dataclasses import field
+import hashlib
+import json
+import logging
+import os
+from typing import List
+
+from caroline_download.catalog import CATALOG_FILE_NAME
+from caroline_download.catalog import FAILED
+from caroline_download.catalog import VERIFIED
+from caroline_download.catalog import Catalog
+from caroline_download.catalog import iter_archive
+from caroline_download.download import download
+from caroline_download.plan import DOWNLOAD
+from caroline_download.plan import REPLACE
+from caroline_download.transfer import update_checksum
+
+# Setup logging 'library-style', see download.py
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+@dataclass
+class VerifyReport:
+    """Data class with the result of verifying an archive.
+
+    Each attribute holds the paths of the files with that result.
+    """
+
+    ok: List[str] = field(default_factory=list)
+    corrupt: List[str] = field(default_factory=list)
+    missing: List[str] = field(default_factory=list)
+    orphaned: List[str] = field(default_factory=list)
+
+    def __str__(self):
+        """Return a one line representation of the counts."""
+        return ", ".join(
+            f"{len(getattr(self, result))} {result}"
+            for result in ("ok", "corrupt", "missing", "orphaned")
+        )
+
+
+def file_checksum(file):
+    """Compute the md5 checksum of a file.
+
+    Parameters
+    ----------
+    file:
+        The file to compute the checksum of
+
+    Returns
+    -------
+    str
+        The checksum (hexdigest)
+    """
+    checksum = hashlib.md5()
+    update_checksum(checksum, file)
+    return checksum.hexdigest()
+
+
+def verify_archive(download_config, fast=False, redownload=False):
+    """Verify the products in an archive.
+
+    The expected checksum, size and modification time of a product are
+    taken from the catalog when it exists, and from the geojson sidecar
+    of the product otherwise. Checksums are computed in a pool of
+    `download_config.verify_workers` processes.
+
+    Parameters
+    ----------
+    download_config:
+        download configuration
+    fast: bool
+        Only compare size and modification time against the recorded
+        values in stead of recomputing checksums
+    redownload: bool
+        Download corrupt and missing products again
+
+    Returns
+    -------
+    VerifyReport
+        The result of the verification
+    """
+    report = VerifyReport()
+
+    catalog = None
+    records = {}
+    catalog_file = download_config.state_directory.joinpath(CATALOG_FILE_NAME)
+    if download_config.catalog and catalog_file.exists():
+        catalog = Catalog(catalog_file)
+        records = {record["file_name"]: record for record in catalog.query()}
+        logger.info("Verifying %d products from %s", len(records), catalog_file)
+    else:
+        logger.info("Verifying products in %s", download_config.base_directory)
+
+    # Expected values per zip file, as (md5, size, mtime) tuples
+    expected = {}
+    # Geojson sidecars of products that have to be downloaded again
+    sidecars = {}
+
+    for zip_file, geojson_file in iter_archive(
+        download_config.base_directory,
+        exclude=(download_config.state_directory,),
+    ):
+        record = records.pop(zip_file.name, None)
+        properties = {}
+        if geojson_file.exists() and (record is None or not record["md5"]):
+            with open(geojson_file, "r") as f:
+                properties = json.load(f)["properties"]
+        if geojson_file.exists():
+            sidecars[str(zip_file)] = geojson_file
+
+        if not zip_file.exists():
+            report.missing.append(str(zip_file))
+        elif record and (record["md5"] or properties):
+            expected[str(zip_file)] = (
+                record["md5"] or properties.get("md5sum"),
+                record["size"],
+                record["mtime"],
+            )
+        elif properties:
+            expected[str(zip_file)] = (
+                properties.get("md5sum"),
+                properties.get("bytes"),
+                None,
+            )
+        else:
+            report.orphaned.append(str(zip_file))
+
+    # Products in the catalog that are not in the archive at all
+    report.missing.extend(record["path"] for record in records.values())
+
+    if fast:
+        for file, (_, size, mtime) in expected.items():
+            stat = os.stat(file)
+            if (size is not None and stat.st_size != int(size)) or (
+                mtime is not None and stat.st_mtime != mtime
+            ):
+                report.corrupt.append(file)
+            else:
+                report.ok.append(file)
+    else:
+        with ProcessPoolExecutor(max_workers=download_config.verify_workers) as pool:
+            futures = {pool.submit(file_checksum, file): file for file in expected}
+            for done_count, future in enumerate(as_completed(futures), start=1):
+                file = futures[future]
+                try:
+                    checksum = future.result()
+                except Exception:
+                    logger.exception("Error while computing checksum of %s", file)
+                    checksum = None
+
+                if checksum == expected[file][0]:
+                    report.ok.append(file)
+                    result = "ok"
+                else:
+                    report.corrupt.append(file)
+                    result = "corrupt"
+                logger.info("[%d/%d] %s: %s", done_count, len(futures), file, result)
+
+    if catalog:
+        try:
+            for file in report.ok:
+                stat = os.stat(file)
+                catalog.update(
+                    os.path.basename(file),
+                    path=file,
+                    size=stat.st_size,
+                    mtime=stat.st_mtime,
+                    status=VERIFIED,
+                )
+            for file in report.corrupt + report.missing:
+                catalog.update(os.path.basename(file), path=file, status=FAILED)
+        finally:
+            catalog.close()
+
+    for result in ("corrupt", "missing", "orphaned"):
+        for file in sorted(getattr(report, result)):
+            print(f"{result}: {file}")
+    logger.info("Verification done: %s", report)
+
+    if redownload:
+        _redownload(download_config, report, sidecars)
+
+    return report
+
+
+def _redownload(download_config, report, sidecars):
+    """Download corrupt and missing products again, see verify_archive.
+
+    The products are downloaded as a plan, see download.download, so the
+    bandwidth limit, connection cap and failure journal of a download run
+    apply.
+    """
+    plan = []
+    for file in report.corrupt + report.missing:
+        if file not in sidecars:
+            logger.warning("Cannot download %s again, it has no geojson", file)
+            continue
+        with open(sidecars[file], "r") as f:
+            geojson = json.load(f)
+        plan.append(
+            {
+                "action": REPLACE if os.path.isfile(file) else DOWNLOAD,
+                "file_name": os.path.basename(file),
+                "path": file,
+                "geojson": geojson,
+            }
+        )
+
+    logger.info("Downloading %d products again", len(plan))
+    download(download_config, plan=plan)
+
+
+# Eof
@@ -0,0 +1,130 @@
+# watch.py
+"""Watch.
+
+Keep running and poll a geo search on a schedule, downloading new
+acquisitions as soon as they are published, in stead of starting a new
+process from cron for every search.
+
+"""
+
+from dataclasses import replace
+import datetime
+import logging
+import re
+import signal
+import threading
+import time
+
+from caroline_download.download import create_session
+from caroline_download.download import download
+
+# Setup logging 'library-style', see download.py
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Seconds per unit accepted in interval specifications
+INTERVAL_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_interval(interval):
+    """Parse an interval specification.
+
+    Parameters
+    ----------
+    interval: str
+        An interval such as '30m', '6h', '1d' or '900' (seconds)
+
+    Returns
+    -------
+    float
+        The interval in seconds
+
+    Raises
+    ------
+    ValueError
+        If the interval cannot be parsed
+    """
+    match = re.fullmatch(r"\s*([0-9]*\.?[0-9]+)\s*([a-zA-Z]?)\s*", str(interval))
+    if not match or match.group(2).lower() not in INTERVAL_UNITS:
+        raise ValueError(f"Invalid interval: {interval}")
+    seconds = float(match.group(1)) * INTERVAL_UNITS[match.group(2).lower()]
+    if seconds <= 0:
+        raise ValueError(f"Invalid interval: {interval}, must be positive")
+    return seconds
+
+
+def watch(download_config, geo_search, interval, stop=None):
+    """Poll geo searches and download new products until stopped.
+
+    The configuration is loaded once and a single authenticated session
+    is kept open for all polls. Searches are incremental, every poll
+    only searches since the last successful poll, and the end of the
+    search is moved to the time of the poll.
+
+    SIGTERM and SIGINT stop the watch: transfers in progress are
+    interrupted, keeping their partial file to resume from, and no new
+    poll is started.
+
+    Parameters
+    ----------
+    download_config:
+        download configuration
+    geo_search:
+        search configuration, or a list of search configurations that
+        are searched together
+    interval: float
+        seconds between the start of consecutive polls
+    stop: threading.Event
+        set to stop the watch, a new event when not given
+    """
+    if stop is None:
+        stop = threading.Event()
+    download_config = replace(download_config, incremental=True)
+    geo_searches = geo_search if isinstance(geo_search, (list, tuple)) else [geo_search]
+
+    def handle_signal(signum, frame):
+        logger.info(f"Received {signal.Signals(signum).name}, stopping")
+        stop.set()
+
+    previous_handlers = {
+        signum: signal.signal(signum, handle_signal)
+        for signum in (signal.SIGTERM, signal.SIGINT)
+    }
+
+    session = create_session(download_config)
+    logger.info(
+        f"Watching {len(geo_searches)} geo search(es), "
+        f"polling every {interval:.0f} seconds"
+    )
+    try:
+        while not stop.is_set():
+            started = time.monotonic()
+            now = datetime.datetime.now().replace(microsecond=0)
+            poll_searches = [
+                replace(geo_search, end=max(geo_search.end, now))
+                for geo_search in geo_searches
+            ]
+            try:
+                download(
+                    download_config,
+                    geo_search=poll_searches,
+                    session=session,
+                    stop=stop,
+                )
+            except Exception:
+                # Keep watching, the next poll may well succeed
+                logger.exception("Error while polling geo search")
+
+            wait = max(0.0, interval - (time.monotonic() - started))
+            if not stop.is_set():
+                logger.info(f"Next poll in {wait:.0f} seconds")
+            stop.wait(wait)
+    finally:
+        session.close()
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
+    logger.info("Watch stopped")
+
+
+# Eof
@@ -0,0 +1,191 @@
+# test_catalog.py
+"""Tests of the product catalog."""
+
+import datetime
+import json
+import pathlib
+import tempfile
+import threading
+import unittest
+
+from caroline_download.catalog import FAILED
+from caroline_download.catalog import PENDING
+from caroline_download.catalog import VERIFIED
+from caroline_download.catalog import Catalog
+from caroline_download.catalog import acquisition_date
+from caroline_download.catalog import rebuild_catalog
+from caroline_download.config import Download
+from caroline_download.lock import lock_file_for
+
+
+def file_name(day, month=1):
+    """Return the file name of a product acquired on a day of 2023."""
+    stamp = f"2023{month:02d}{day:02d}T053000"
+    return f"S1A_IW_SLC__1SDV_{stamp}_{stamp}_047000_05A000_ABCD.zip"
+
+
+class CatalogTestCase(unittest.TestCase):
+    """Base class of the tests, with a catalog in a temporary directory."""
+
+    def setUp(self):
+        """Create the catalog."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.catalog_file = pathlib.Path(self.directory.name, "catalog.sqlite")
+        self.catalog = Catalog(self.catalog_file)
+
+    def tearDown(self):
+        """Close and remove the catalog."""
+        self.catalog.close()
+        self.directory.cleanup()
+
+
+class CatalogTest(CatalogTestCase):
+    """Tests of Catalog."""
+
+    def test_update_and_get(self):
+        """A record is inserted, updated column by column and read back."""
+        self.assertIsNone(self.catalog.get(file_name(1)))
+        self.catalog.update(file_name(1), path="a", size=10, status=PENDING)
+        self.catalog.update(file_name(1), path="a", md5="abc", status=VERIFIED)
+
+        record = self.catalog.get(file_name(1))
+        self.assertEqual(record["path"], "a")
+        self.assertEqual(record["size"], 10)
+        self.assertEqual(record["md5"], "abc")
+        self.assertEqual(record["status"], VERIFIED)
+
+    def test_unknown_column(self):
+        """Updating a column that does not exist is refused."""
+        with self.assertRaises(ValueError):
+            self.catalog.update(file_name(1), path="a", status=PENDING, colour="red")
+
+    def test_query(self):
+        """Records are filtered on status, track and date, ordered."""
+        for day, track, status in (
+            (3, 88, VERIFIED),
+            (1, 88, VERIFIED),
+            (2, 37, FAILED),
+            (4, 88, PENDING),
+        ):
+            self.catalog.update(
+                file_name(day),
+                path=str(day),
+                track=track,
+                acquisition_date=acquisition_date(file_name(day)),
+                status=status,
+            )
+
+        def days(records):
+            return [int(record["path"]) for record in records]
+
+        self.assertEqual(days(self.catalog.query()), [2, 1, 3, 4])
+        self.assertEqual(days(self.catalog.query(status=VERIFIED)), [1, 3])
+        self.assertEqual(days(self.catalog.query(track=37)), [2])
+        self.assertEqual(
+            days(
+                self.catalog.query(
+                    track=88,
+                    start=datetime.date(2023, 1, 2),
+                    end=datetime.date(2023, 1, 3),
+                )
+            ),
+            [3],
+        )
+
+    def test_shared_between_instances(self):
+        """Catalogs of several processes see each other's updates."""
+        other = Catalog(self.catalog_file)
+        try:
+            threads = [
+                threading.Thread(
+                    target=lambda catalog, offset: [
+                        catalog.update(file_name(day), path="x", status=PENDING)
+                        for day in range(offset, offset + 14)
+                    ],
+                    args=(catalog, offset),
+                )
+                for catalog, offset in ((self.catalog, 1), (other, 15))
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(other.query()), 28)
+        finally:
+            other.close()
+        self.assertFalse(lock_file_for(self.catalog_file).exists())
+
+    def test_acquisition_date(self):
+        """The acquisition date is taken from the file name."""
+        self.assertEqual(acquisition_date(file_name(9, month=11)), "2023-11-09")
+
+
+class RebuildCatalogTest(unittest.TestCase):
+    """Tests of rebuild_catalog."""
+
+    def setUp(self):
+        """Create an archive."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.download_config = Download(
+            base_directory=pathlib.Path(self.directory.name)
+        )
+        self.product_directory = self.download_config.base_directory.joinpath(
+            "s1_asc_t088", "IW_SLC__1SDV_VVVH", "20230101"
+        )
+        self.product_directory.mkdir(parents=True)
+
+    def tearDown(self):
+        """Remove the archive."""
+        self.directory.cleanup()
+
+    def add_product(self, day, size, sidecar_size=None):
+        """Add a product to the archive, with a sidecar if a size is given."""
+        zip_file = self.product_directory.joinpath(file_name(day))
+        zip_file.write_bytes(b"x" * size)
+        if sidecar_size is not None:
+            zip_file.with_suffix(".json").write_text(
+                json.dumps(
+                    {
+                        "properties": {
+                            "fileName": zip_file.name,
+                            "bytes": sidecar_size,
+                            "md5sum": "abc",
+                            "pathNumber": 88,
+                            "polarization": "VV+VH",
+                        }
+                    }
+                )
+            )
+
+    def test_nothing_is_verified(self):
+        """Without checksums products are pending, or failed on a size mismatch."""
+        self.add_product(1, 100, sidecar_size=100)
+        self.add_product(2, 50, sidecar_size=100)
+        self.add_product(3, 100)
+
+        counts = rebuild_catalog(self.download_config)
+
+        self.assertEqual(counts, {PENDING: 2, FAILED: 1})
+        catalog = Catalog(
+            self.download_config.state_directory.joinpath("catalog.sqlite")
+        )
+        try:
+            statuses = {
+                record["file_name"]: record["status"] for record in catalog.query()
+            }
+            record = catalog.get(file_name(1))
+        finally:
+            catalog.close()
+        self.assertEqual(
+            statuses,
+            {file_name(1): PENDING, file_name(2): FAILED, file_name(3): PENDING},
+        )
+        self.assertEqual(record["md5"], "abc")
+        self.assertEqual(record["track"], 88)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+# Eof
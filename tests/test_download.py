@@ -0,0 +1,122 @@
+# test_download.py
+"""Tests of the planning of search intervals."""
+
+from datetime import datetime
+from datetime import timedelta
+import unittest
+
+from caroline_download.download import plan_search_intervals
+
+START = datetime(2023, 1, 1)
+END = datetime(2023, 12, 31, 23, 59, 59)
+
+
+class Counter:
+    """Count stub returning the number of acquisitions in an interval."""
+
+    def __init__(self, acquisitions):
+        self.acquisitions = sorted(acquisitions)
+        self.calls = 0
+
+    def __call__(self, interval):
+        """Count the acquisitions in an interval, ends included."""
+        self.calls += 1
+        return sum(
+            1
+            for acquisition in self.acquisitions
+            if interval[0] <= acquisition <= interval[1]
+        )
+
+
+def every(start, step, count):
+    """Return `count` moments, `step` apart from `start`."""
+    return [start + index * step for index in range(count)]
+
+
+class PlanSearchIntervalsTest(unittest.TestCase):
+    """Tests of plan_search_intervals."""
+
+    def assertContiguous(self, intervals, start=START, end=END):
+        """Assert the intervals cover start - end without gaps or overlaps."""
+        self.assertEqual(intervals[0][0], start)
+        self.assertEqual(intervals[-1][1], end)
+        for interval in intervals:
+            self.assertLessEqual(interval[0], interval[1])
+        for previous, interval in zip(intervals, intervals[1:]):
+            self.assertEqual(interval[0], previous[1] + timedelta(seconds=1))
+
+    def test_sparse_intervals_are_merged(self):
+        """Few results in the whole interval make a single search."""
+        count = Counter(every(START, timedelta(days=12), 30))
+        intervals = plan_search_intervals(START, END, count=count, max_results=100)
+        self.assertEqual(intervals, [(START, END)])
+
+    def test_split_at_max_results(self):
+        """Every interval has at most max_results results."""
+        # Dense in March, sparse otherwise
+        count = Counter(
+            every(START, timedelta(days=6), 60)
+            + every(datetime(2023, 3, 1), timedelta(minutes=17), 2000)
+        )
+        intervals = plan_search_intervals(START, END, count=count, max_results=250)
+
+        self.assertContiguous(intervals)
+        counts = [count(interval) for interval in intervals]
+        self.assertTrue(all(result_count <= 250 for result_count in counts))
+        self.assertEqual(sum(counts), len(count.acquisitions))
+        # March is split within the month, sparse months are merged
+        self.assertGreaterEqual(len(intervals), 2060 // 250)
+        self.assertLess(len(intervals), 2 * (2060 // 250) + 2)
+
+    def test_exactly_max_results_is_not_split(self):
+        """An interval with exactly max_results results is searched at once."""
+        count = Counter(every(START, timedelta(days=1), 100))
+        intervals = plan_search_intervals(START, END, count=count, max_results=100)
+        self.assertEqual(intervals, [(START, END)])
+
+    def test_min_duration_floor(self):
+        """Intervals shorter than min_duration are not split any further."""
+        burst = datetime(2023, 6, 15, 12, 0, 0)
+        count = Counter([burst] * 50 + every(START, timedelta(days=30), 12))
+        min_duration = timedelta(hours=1)
+        intervals = plan_search_intervals(
+            START, END, count=count, max_results=10, min_duration=min_duration
+        )
+
+        self.assertContiguous(intervals)
+        (dense,) = [
+            interval for interval in intervals if interval[0] <= burst <= interval[1]
+        ]
+        self.assertEqual(count(dense), 50)
+        duration = dense[1] - dense[0]
+        self.assertLessEqual(duration, min_duration)
+        self.assertGreater(duration, min_duration / 2 - timedelta(seconds=2))
+        # Bisection stops at the floor instead of going down to seconds
+        self.assertLess(count.calls, 100)
+
+    def test_interval_within_one_month(self):
+        """A dense interval within a month is bisected on whole seconds."""
+        start = datetime(2023, 2, 3, 4, 5, 6)
+        end = datetime(2023, 2, 20, 7, 8, 9)
+        count = Counter(every(start, timedelta(minutes=7), 3000))
+        intervals = plan_search_intervals(start, end, count=count, max_results=500)
+
+        self.assertContiguous(intervals, start, end)
+        for interval in intervals:
+            self.assertEqual(interval[0].microsecond, 0)
+            self.assertLessEqual(count(interval), 500)
+
+    def test_empty_interval(self):
+        """An interval ending before it starts has nothing to search."""
+        count = Counter([])
+        self.assertEqual(
+            plan_search_intervals(END, START, count=count, max_results=10), []
+        )
+        self.assertEqual(count.calls, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+# Eof
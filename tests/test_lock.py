@@ -0,0 +1,190 @@
+# test_lock.py
+"""Tests of product lock files."""
+
+import os
+import pathlib
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from caroline_download.lock import ProductLock
+from caroline_download.lock import lock_file_for
+from caroline_download.lock import locked
+
+
+class LockTestCase(unittest.TestCase):
+    """Base class of the tests, with a target file to lock."""
+
+    def setUp(self):
+        """Create a directory with the target file."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.target_file = pathlib.Path(self.directory.name, "product.zip")
+        self.lock_file = lock_file_for(self.target_file)
+
+    def tearDown(self):
+        """Remove the directory."""
+        self.directory.cleanup()
+
+    def write_lock(self, owner, age=0):
+        """Write a lock file of another owner, last refreshed `age` ago."""
+        self.lock_file.write_text(f"{owner}\n")
+        modified = time.time() - age
+        os.utime(self.lock_file, (modified, modified))
+
+    def leftovers(self):
+        """Return the names of the files in the directory but the lock."""
+        return sorted(
+            path.name
+            for path in pathlib.Path(self.directory.name).iterdir()
+            if path != self.lock_file
+        )
+
+
+class ProductLockTest(LockTestCase):
+    """Tests of ProductLock."""
+
+    def test_second_contender_is_refused(self):
+        """A lock is held by one owner at a time."""
+        first = ProductLock(self.target_file)
+        second = ProductLock(self.target_file)
+        self.assertTrue(first.acquire())
+        try:
+            self.assertFalse(second.acquire())
+            self.assertEqual(
+                self.lock_file.read_text(),
+                f"{socket.gethostname()}:{os.getpid()}\n",
+            )
+        finally:
+            first.release()
+        self.assertFalse(self.lock_file.exists())
+        self.assertTrue(second.acquire())
+        second.release()
+
+    def test_contenders_racing(self):
+        """Of contenders starting at the same moment exactly one wins."""
+        locks = [ProductLock(self.target_file) for _ in range(8)]
+        barrier = threading.Barrier(len(locks))
+        results = [None] * len(locks)
+
+        def contend(index):
+            barrier.wait()
+            results[index] = locks[index].acquire()
+
+        threads = [
+            threading.Thread(target=contend, args=(index,))
+            for index in range(len(locks))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count(True), 1)
+        locks[results.index(True)].release()
+
+    def test_stale_lock_is_broken(self):
+        """A lock that was not refreshed for stale_after seconds is broken."""
+        self.write_lock("otherhost:1234", age=120)
+        lock = ProductLock(self.target_file, stale_after=60)
+        with self.assertLogs("caroline_download.lock", "WARNING"):
+            self.assertTrue(lock.acquire())
+        try:
+            self.assertIn(f":{os.getpid()}", self.lock_file.read_text())
+            self.assertEqual(self.leftovers(), [])
+        finally:
+            lock.release()
+
+    def test_fresh_lock_of_other_host_is_kept(self):
+        """A refreshed lock of another host is not broken."""
+        self.write_lock("otherhost:1234", age=10)
+        self.assertFalse(ProductLock(self.target_file, stale_after=60).acquire())
+        self.assertEqual(self.lock_file.read_text(), "otherhost:1234\n")
+
+    def test_lock_of_dead_owner_is_broken(self):
+        """A fresh lock of a process on this host that exited is broken."""
+        process = subprocess.Popen([sys.executable, "-c", "pass"])
+        process.wait()
+        self.write_lock(f"{socket.gethostname()}:{process.pid}")
+        lock = ProductLock(self.target_file, stale_after=60)
+        self.assertTrue(lock.acquire())
+        try:
+            self.assertIn(f":{os.getpid()}", self.lock_file.read_text())
+            self.assertEqual(self.leftovers(), [])
+        finally:
+            lock.release()
+
+    def test_lock_of_live_owner_is_kept(self):
+        """A fresh lock of a running process on this host is not broken."""
+        owner = f"{socket.gethostname()}:{os.getppid()}"
+        self.write_lock(owner)
+        self.assertFalse(ProductLock(self.target_file, stale_after=60).acquire())
+        self.assertEqual(self.lock_file.read_text(), f"{owner}\n")
+
+    def test_lock_taken_while_breaking_is_given_back(self):
+        """A new lock created while a stale one is broken is given back."""
+        self.write_lock("otherhost:1234", age=120)
+        lock = ProductLock(self.target_file, stale_after=60)
+
+        def break_and_take(_lock):
+            # Another process breaks the stale lock and takes a new one
+            # between the stat and the rename of this process
+            self.lock_file.unlink()
+            self.write_lock("otherhost:5678")
+
+        with mock.patch.object(
+            ProductLock, "_dead_owner", side_effect=break_and_take, autospec=True
+        ):
+            self.assertFalse(lock.acquire())
+        self.assertEqual(self.lock_file.read_text(), "otherhost:5678\n")
+        self.assertEqual(self.leftovers(), [])
+
+    def test_heartbeat_refreshes_lock(self):
+        """A held lock is refreshed, so it does not become stale."""
+        lock = ProductLock(self.target_file, stale_after=0.4)
+        self.assertTrue(lock.acquire())
+        try:
+            modified = time.time() - 100
+            os.utime(self.lock_file, (modified, modified))
+            time.sleep(0.3)
+            self.assertLess(time.time() - self.lock_file.stat().st_mtime, 1)
+            self.assertFalse(ProductLock(self.target_file, stale_after=60).acquire())
+        finally:
+            lock.release()
+        self.assertFalse(self.lock_file.exists())
+
+
+class LockedTest(LockTestCase):
+    """Tests of locked."""
+
+    def test_waits_for_holder(self):
+        """Updates under the lock from several threads are not lost."""
+        counter = self.target_file.with_name("counter")
+        counter.write_text("0")
+
+        def increment():
+            for _ in range(10):
+                with locked(counter):
+                    value = int(counter.read_text())
+                    time.sleep(0.001)
+                    counter.write_text(str(value + 1))
+
+        threads = [threading.Thread(target=increment) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(counter.read_text(), "40")
+        self.assertFalse(lock_file_for(counter).exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+# Eof
@@ -0,0 +1,98 @@
+# test_plan.py
+"""Tests of download plans."""
+
+import pathlib
+import tempfile
+import unittest
+
+from caroline_download.plan import DOWNLOAD
+from caroline_download.plan import REPLACE
+from caroline_download.plan import SKIP
+from caroline_download.plan import PlanWriter
+from caroline_download.plan import plan_products
+from caroline_download.plan import read_plan
+from caroline_download.product import Product
+
+
+def product(name, size=10):
+    """Return a product with a file name and size."""
+    return Product(
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [5, 52]},
+            "properties": {"fileName": f"{name}.zip", "bytes": size, "md5sum": name},
+        }
+    )
+
+
+class PlanTest(unittest.TestCase):
+    """Tests of writing and reading plans."""
+
+    def setUp(self):
+        """Create a directory for the plan."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.plan_file = pathlib.Path(self.directory.name, "plan.ndjson")
+
+    def tearDown(self):
+        """Remove the directory."""
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        """The products of a plan are restored per action."""
+        writer = PlanWriter(self.plan_file)
+        writer.add(DOWNLOAD, product("a"), pathlib.Path("/archive/a.zip"))
+        writer.add(SKIP, product("b"), pathlib.Path("/archive/b.zip"))
+        writer.add(REPLACE, product("c", size=None), pathlib.Path("/archive/c.zip"))
+        writer.add(DOWNLOAD, product("d"), pathlib.Path("/archive/d.zip"))
+        writer.close()
+        self.assertEqual(writer.counts, {DOWNLOAD: 2, SKIP: 1, REPLACE: 1})
+
+        entries = read_plan(self.plan_file)
+        self.assertEqual(
+            [(entry["action"], entry["file_name"]) for entry in entries],
+            [
+                (DOWNLOAD, "a.zip"),
+                (SKIP, "b.zip"),
+                (REPLACE, "c.zip"),
+                (DOWNLOAD, "d.zip"),
+            ],
+        )
+        self.assertEqual(entries[0]["path"], "/archive/a.zip")
+        self.assertEqual(entries[0]["bytes"], 10)
+        self.assertIsNone(entries[2]["bytes"])
+
+        downloads = plan_products(entries, DOWNLOAD)
+        self.assertEqual(
+            [p.geojson() for p in downloads],
+            [product("a").geojson(), product("d").geojson()],
+        )
+        self.assertEqual(len(plan_products(entries, REPLACE)), 1)
+
+    def test_blank_lines_are_skipped(self):
+        """Empty lines, e.g. at the end, are not entries."""
+        writer = PlanWriter(self.plan_file)
+        writer.add(DOWNLOAD, product("a"), pathlib.Path("a.zip"))
+        writer.close()
+        with open(self.plan_file, "a") as f:
+            f.write("\n\n")
+        self.assertEqual(len(read_plan(self.plan_file)), 1)
+
+    def test_invalid_lines(self):
+        """Lines that are not plan entries are refused with their number."""
+        for line in (
+            "not json",
+            '{"action": "delete", "geojson": {}}',
+            '{"action": "skip"}',
+        ):
+            self.plan_file.write_text(
+                '{"action": "skip", "geojson": {}}\n' + line + "\n"
+            )
+            with self.subTest(line=line), self.assertRaisesRegex(ValueError, ":2:"):
+                read_plan(self.plan_file)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+# Eof
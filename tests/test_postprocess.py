@@ -0,0 +1,71 @@
+# test_postprocess.py
+"""Tests of post-download hooks."""
+
+import json
+import pathlib
+import sys
+import tempfile
+import unittest
+
+from caroline_download.postprocess import run_command
+
+
+class RunCommandTest(unittest.TestCase):
+    """Tests of run_command."""
+
+    def setUp(self):
+        """Create a directory with a product file."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.target_file = pathlib.Path(self.directory.name, "product.zip")
+        self.target_file.touch()
+        self.output = pathlib.Path(self.directory.name, "argv.json")
+
+    def tearDown(self):
+        """Remove the directory."""
+        self.directory.cleanup()
+
+    def run_arguments(self, *arguments):
+        """Run a command with arguments, return the arguments it got."""
+        command = [
+            sys.executable,
+            "-c",
+            "import json, sys; "
+            "open(sys.argv[1], 'w').write(json.dumps(sys.argv[2:]))",
+            str(self.output),
+            *arguments,
+        ]
+        run_command(command, self.target_file, {})
+        return json.loads(self.output.read_text())
+
+    def test_placeholders_are_replaced(self):
+        """The placeholders are replaced by the paths of the product."""
+        self.assertEqual(
+            self.run_arguments("{path}", "{file_name}", "{directory}", "{geojson}"),
+            [
+                str(self.target_file),
+                "product.zip",
+                self.directory.name,
+                str(self.target_file.with_suffix(".json")),
+            ],
+        )
+
+    def test_other_braces_are_kept(self):
+        """Braces that are not a placeholder are passed as they are."""
+        self.assertEqual(
+            self.run_arguments(
+                "{print $1}", ".properties | {md5sum}", "{{path}}", "x{path}y"
+            ),
+            [
+                "{print $1}",
+                ".properties | {md5sum}",
+                "{" + str(self.target_file) + "}",
+                f"x{self.target_file}y",
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+# Eof
@@ -0,0 +1,79 @@
+# test_report.py
+"""Tests of the run report."""
+
+import pathlib
+import re
+import tempfile
+import unittest
+
+from caroline_download.download import DownloadSummary
+from caroline_download.report import RunReport
+
+AOI_NAMES = ['say "hi"', "back\\slash", "new\nline", "plain"]
+
+
+class WritePrometheusTest(unittest.TestCase):
+    """Tests of RunReport.write_prometheus."""
+
+    def setUp(self):
+        """Write the textfile of a report with awkward area names."""
+        report = RunReport()
+        for index, name in enumerate(AOI_NAMES):
+            report.aoi(name, [f"product{index}.zip", "shared.zip"])
+            report.search("geo", aoi=name, seconds=0.5 + index, results=2)
+        summary = DownloadSummary()
+        summary.add("downloaded", "shared.zip")
+        report.finish(summary, bytes_transferred=1024, failed_backlog=0)
+
+        with tempfile.TemporaryDirectory() as directory:
+            file = pathlib.Path(directory, "caroline_download.prom")
+            report.write_prometheus(file)
+            self.text = file.read_text()
+        self.samples = [
+            line for line in self.text.splitlines() if not line.startswith("#")
+        ]
+
+    def test_labels_are_escaped(self):
+        """Quotes, backslashes and newlines in label values are escaped."""
+        self.assertIn('caroline_download_aoi_products{aoi="say \\"hi\\""} 2', self.text)
+        self.assertIn(
+            'caroline_download_aoi_products{aoi="back\\\\slash"} 2', self.text
+        )
+        self.assertIn('caroline_download_aoi_products{aoi="new\\nline"} 2', self.text)
+        self.assertIn('caroline_download_aoi_unique_products{aoi="plain"} 1', self.text)
+        # Every sample is a single line
+        sample = re.compile(
+            r'^[a-z_]+(\{[a-z_]+="([^"\\]|\\.)*"(,[a-z_]+="([^"\\]|\\.)*")*\})? \S+$'
+        )
+        for line in self.samples:
+            self.assertRegex(line, sample)
+
+    def test_metric_families_are_contiguous(self):
+        """The samples of a metric follow its HELP and TYPE lines."""
+        families = []
+        current = None
+        for line in self.text.splitlines():
+            if line.startswith("# HELP "):
+                current = line.split()[2]
+                families.append(current)
+            elif line.startswith("# TYPE "):
+                self.assertEqual(line, f"# TYPE {current} gauge")
+            else:
+                self.assertEqual(re.match(r"[a-z_]+", line).group(), current)
+        self.assertEqual(len(families), len(set(families)))
+
+    def test_gauges_have_no_reserved_suffix(self):
+        """Gauge names do not end in suffixes of summaries and histograms."""
+        for line in self.text.splitlines():
+            if line.startswith("# TYPE "):
+                name = line.split()[2]
+                self.assertFalse(name.endswith(("_sum", "_count", "_bucket")), name)
+        self.assertIn("caroline_download_search_seconds 8.0", self.text)
+        self.assertIn("caroline_download_search_max_seconds 3.5", self.text)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+# Eof
@@ -0,0 +1,168 @@
+# test_retry.py
+"""Tests of retrying, the circuit breaker and the failure journal."""
+
+import pathlib
+import tempfile
+import threading
+import time
+import unittest
+
+import requests
+
+from caroline_download.product import Product
+from caroline_download.retry import CircuitBreaker
+from caroline_download.retry import FailureJournal
+from caroline_download.retry import retry_call
+
+
+def product(name):
+    """Return a product with a file name."""
+    return Product(
+        {
+            "type": "Feature",
+            "geometry": None,
+            "properties": {"fileName": f"{name}.zip", "bytes": 10},
+        }
+    )
+
+
+def http_error(status_code):
+    """Return an HTTPError with a status code."""
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(f"{status_code}", response=response)
+
+
+class Failing:
+    """Callable failing with the given errors, then returning 'done'."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        """Raise the next error, or return 'done'."""
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "done"
+
+
+class RetryCallTest(unittest.TestCase):
+    """Tests of retry_call."""
+
+    def test_transient_errors_are_retried(self):
+        """Connection problems and server errors are retried."""
+        function = Failing(ConnectionError(), http_error(503))
+        with self.assertLogs("caroline_download.retry", "WARNING"):
+            self.assertEqual(retry_call(function, retries=3, backoff=0), "done")
+        self.assertEqual(function.calls, 3)
+
+    def test_retries_are_limited(self):
+        """The error of the last attempt is raised when all attempts fail."""
+        function = Failing(*(ConnectionError(str(attempt)) for attempt in range(5)))
+        with self.assertLogs("caroline_download.retry", "WARNING"):
+            with self.assertRaisesRegex(ConnectionError, "2"):
+                retry_call(function, retries=2, backoff=0)
+        self.assertEqual(function.calls, 3)
+
+    def test_client_errors_are_not_retried(self):
+        """Errors that will not go away are raised right away."""
+        for error in (http_error(404), ValueError()):
+            function = Failing(error)
+            with self.subTest(error=error), self.assertRaises(type(error)):
+                retry_call(function, retries=3, backoff=0)
+            self.assertEqual(function.calls, 1)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    """Tests of CircuitBreaker."""
+
+    def test_opens_after_threshold(self):
+        """Consecutive failures up to the threshold pause all calls."""
+        breaker = CircuitBreaker(threshold=3, pause=0.2)
+        breaker.failure()
+        breaker.failure()
+        started = time.monotonic()
+        breaker.wait()
+        self.assertLess(time.monotonic() - started, 0.05)
+
+        with self.assertLogs("caroline_download.retry", "WARNING"):
+            breaker.failure()
+        breaker.wait()
+        self.assertGreater(time.monotonic() - started, 0.15)
+
+    def test_success_resets(self):
+        """A success in between keeps the circuit closed."""
+        breaker = CircuitBreaker(threshold=2, pause=10)
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        started = time.monotonic()
+        breaker.wait()
+        self.assertLess(time.monotonic() - started, 0.05)
+
+
+class FailureJournalTest(unittest.TestCase):
+    """Tests of FailureJournal."""
+
+    def setUp(self):
+        """Create a state directory."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.state_directory = pathlib.Path(self.directory.name)
+
+    def tearDown(self):
+        """Remove the state directory."""
+        self.directory.cleanup()
+
+    def test_add_and_remove(self):
+        """Failed products are recorded with their attempts and removed."""
+        journal = FailureJournal(self.state_directory)
+        journal.add(product("a"), "timeout")
+        journal.add(product("a"), "404")
+        journal.add(product("b"), "timeout")
+        self.assertEqual(journal.count(), 2)
+
+        entries = journal._load()
+        self.assertEqual(entries["a.zip"]["attempts"], 2)
+        self.assertEqual(entries["a.zip"]["reason"], "404")
+
+        journal.remove("a.zip")
+        journal.remove("unknown.zip")
+        products = journal.products()
+        self.assertEqual([p.properties["fileName"] for p in products], ["b.zip"])
+        self.assertEqual(products[0].properties["bytes"], 10)
+
+    def test_read_only(self):
+        """A read only journal is read but not changed."""
+        FailureJournal(self.state_directory).add(product("a"), "timeout")
+        journal = FailureJournal(self.state_directory, read_only=True)
+        journal.add(product("b"), "timeout")
+        journal.remove("a.zip")
+        self.assertEqual(journal.count(), 1)
+
+    def test_concurrent_journals(self):
+        """Journals of several processes keep each other's entries."""
+        journals = [FailureJournal(self.state_directory) for _ in range(4)]
+        threads = [
+            threading.Thread(
+                target=lambda journal, index: [
+                    journal.add(product(f"{index}-{number}"), "timeout")
+                    for number in range(10)
+                ],
+                args=(journal, index),
+            )
+            for index, journal in enumerate(journals)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(FailureJournal(self.state_directory).count(), 40)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+# Eof
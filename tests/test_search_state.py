@@ -0,0 +1,138 @@
+# test_search_state.py
+"""Tests of the state kept between runs of a geo search."""
+
+from datetime import datetime
+import pathlib
+import tempfile
+import types
+import unittest
+
+from caroline_download.product import Product
+from caroline_download.search_state import SearchCache
+from caroline_download.search_state import Watermarks
+from caroline_download.search_state import search_key
+from caroline_download.search_state import write_json
+
+INTERVAL = (datetime(2023, 1, 1), datetime(2023, 1, 31, 23, 59, 59))
+
+
+def geo_search(**values):
+    """Return a search configuration."""
+    spec = {
+        "dataset": "SENTINEL-1",
+        "relative_orbits": [88, 37],
+        "product_type": "SLC",
+        "start": datetime(2023, 1, 1),
+        "end": datetime(2023, 6, 1),
+    }
+    spec.update(values)
+    return types.SimpleNamespace(**spec)
+
+
+class StateTestCase(unittest.TestCase):
+    """Base class of the tests, with a state directory."""
+
+    def setUp(self):
+        """Create the state directory."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.state_directory = pathlib.Path(self.directory.name)
+
+    def tearDown(self):
+        """Remove the state directory."""
+        self.directory.cleanup()
+
+
+class SearchKeyTest(unittest.TestCase):
+    """Tests of search_key."""
+
+    def test_independent_of_time_range(self):
+        """The time range and order of the orbits do not change the key."""
+        self.assertEqual(
+            search_key(geo_search(), "POINT (1 2)"),
+            search_key(
+                geo_search(relative_orbits=[37, 88], end=datetime(2024, 1, 1)),
+                "POINT (1 2)",
+            ),
+        )
+
+    def test_depends_on_search(self):
+        """Another region, orbit or product type gives another key."""
+        key = search_key(geo_search(), "POINT (1 2)")
+        self.assertNotEqual(key, search_key(geo_search(), "POINT (1 3)"))
+        self.assertNotEqual(
+            key, search_key(geo_search(relative_orbits=[88]), "POINT (1 2)")
+        )
+        self.assertNotEqual(
+            key, search_key(geo_search(product_type="GRD"), "POINT (1 2)")
+        )
+
+
+class WatermarksTest(StateTestCase):
+    """Tests of Watermarks."""
+
+    def test_only_forward(self):
+        """A watermark only moves forward."""
+        watermarks = Watermarks(self.state_directory)
+        self.assertIsNone(watermarks.get("a"))
+        watermarks.set("a", datetime(2023, 5, 1))
+        watermarks.set("a", datetime(2023, 4, 1))
+        self.assertEqual(watermarks.get("a"), datetime(2023, 5, 1))
+        watermarks.set("a", datetime(2023, 6, 1))
+        self.assertEqual(watermarks.get("a"), datetime(2023, 6, 1))
+
+    def test_other_keys_are_kept(self):
+        """Watermarks set by another process are kept."""
+        Watermarks(self.state_directory).set("a", datetime(2023, 5, 1))
+        Watermarks(self.state_directory).set("b", datetime(2023, 6, 1))
+        watermarks = Watermarks(self.state_directory)
+        self.assertEqual(watermarks.get("a"), datetime(2023, 5, 1))
+        self.assertEqual(watermarks.get("b"), datetime(2023, 6, 1))
+
+
+class SearchCacheTest(StateTestCase):
+    """Tests of SearchCache."""
+
+    def test_round_trip(self):
+        """Cached products are restored with their properties."""
+        cache = SearchCache(self.state_directory, ttl=24)
+        self.assertIsNone(cache.get("key", INTERVAL))
+        product = Product(
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [5, 52]},
+                "properties": {"fileName": "a.zip", "bytes": 10},
+            }
+        )
+        cache.put("key", INTERVAL, [product])
+
+        (cached,) = cache.get("key", INTERVAL)
+        self.assertEqual(cached.geojson(), product.geojson())
+        self.assertIsNone(cache.get("other", INTERVAL))
+        self.assertIsNone(cache.get("key", (INTERVAL[0], datetime(2023, 2, 1))))
+
+    def test_expired(self):
+        """A result older than the time to live is not used."""
+        SearchCache(self.state_directory, ttl=24).put("key", INTERVAL, [])
+        self.assertEqual(
+            SearchCache(self.state_directory, ttl=24).get("key", INTERVAL), []
+        )
+        self.assertIsNone(SearchCache(self.state_directory, ttl=0).get("key", INTERVAL))
+
+
+class WriteJsonTest(StateTestCase):
+    """Tests of write_json."""
+
+    def test_replaces_atomically(self):
+        """The file is replaced, no temporary files are left behind."""
+        file = self.state_directory.joinpath("sub", "state.json")
+        write_json(file, {"a": 1})
+        write_json(file, {"b": 2})
+        self.assertEqual(file.read_text(), '{"b": 2}')
+        self.assertEqual([path.name for path in file.parent.iterdir()], ["state.json"])
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+# Eof
@@ -0,0 +1,71 @@
+# test_shard.py
+"""Tests of splitting products over shards."""
+
+import unittest
+
+from caroline_download.shard import in_shard
+from caroline_download.shard import parse_shard
+
+FILE_NAMES = [
+    f"S1A_IW_SLC__1SDV_2023{month:02d}{day:02d}T053000_"
+    f"2023{month:02d}{day:02d}T053027_047000_05A000_ABCD.zip"
+    for month in range(1, 13)
+    for day in range(1, 29)
+]
+
+
+class ParseShardTest(unittest.TestCase):
+    """Tests of parse_shard."""
+
+    def test_valid(self):
+        """A shard is parsed into its index and count."""
+        self.assertEqual(parse_shard("2/4"), (2, 4))
+        self.assertEqual(parse_shard(" 1 / 1 "), (1, 1))
+
+    def test_invalid(self):
+        """Shards out of range or malformed are refused."""
+        for shard in ("0/4", "5/4", "1/0", "2", "a/b", "-1/4", "1/2/3"):
+            with self.subTest(shard=shard), self.assertRaises(ValueError):
+                parse_shard(shard)
+
+
+class InShardTest(unittest.TestCase):
+    """Tests of in_shard."""
+
+    def test_every_product_in_one_shard(self):
+        """Every product belongs to exactly one of the shards."""
+        for count in range(1, 8):
+            for file_name in FILE_NAMES:
+                shards = [
+                    index
+                    for index in range(1, count + 1)
+                    if in_shard(file_name, (index, count))
+                ]
+                self.assertEqual(len(shards), 1, (file_name, count))
+
+    def test_shards_are_balanced(self):
+        """Products are spread over the shards roughly evenly."""
+        for index in range(1, 5):
+            size = sum(1 for name in FILE_NAMES if in_shard(name, (index, 4)))
+            self.assertGreater(size, len(FILE_NAMES) / 4 * 0.7)
+            self.assertLess(size, len(FILE_NAMES) / 4 * 1.3)
+
+    def test_assignment_is_stable(self):
+        """A product is assigned to the same shard by every process."""
+        # Fixed values, the assignment must not depend on e.g. the hash
+        # seed of the process or the order of the products
+        file_name = FILE_NAMES[0]
+        self.assertTrue(in_shard(file_name, (4, 4)))
+        self.assertTrue(in_shard(file_name, (5, 7)))
+        shards = [in_shard(name, (2, 3)) for name in FILE_NAMES]
+        self.assertEqual(
+            [in_shard(name, (2, 3)) for name in reversed(FILE_NAMES)],
+            shards[::-1],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+# Eof
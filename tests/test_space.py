@@ -0,0 +1,97 @@
+# test_space.py
+"""Tests of disk space admission control."""
+
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+from caroline_download.space import DiskSpace
+from caroline_download.space import InsufficientDiskSpace
+from caroline_download.space import format_size
+from caroline_download.space import parse_size
+
+
+class ParseSizeTest(unittest.TestCase):
+    """Tests of parse_size and format_size."""
+
+    def test_units(self):
+        """Decimal and binary units are accepted."""
+        self.assertEqual(parse_size("50GB"), 50 * 1000**3)
+        self.assertEqual(parse_size("1.5 GiB"), int(1.5 * 1024**3))
+        self.assertEqual(parse_size(1000), 1000)
+
+    def test_invalid(self):
+        """Sizes that cannot be parsed are refused."""
+        for size in ("big", "10 GB/s", "-1GB", ""):
+            with self.subTest(size=size), self.assertRaises(ValueError):
+                parse_size(size)
+
+    def test_format(self):
+        """Sizes are formatted in MB or GB."""
+        self.assertEqual(format_size(1500 * 1000**2), "1.5 GB")
+        self.assertEqual(format_size(2 * 1000**2), "2.0 MB")
+
+
+class DiskSpaceTest(unittest.TestCase):
+    """Tests of DiskSpace, on a filesystem with 1000 bytes free."""
+
+    def setUp(self):
+        """Create a directory and fake the free space."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = pathlib.Path(self.directory.name)
+        patcher = mock.patch.object(DiskSpace, "free", return_value=1000)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        """Remove the directory."""
+        self.directory.cleanup()
+
+    def test_reservations_add_up(self):
+        """Reserved space is not available to other files until released."""
+        space = DiskSpace(self.path)
+        space.reserve(self.path.joinpath("a"), 600)
+        self.assertEqual(space.available(), 400)
+        with self.assertRaises(InsufficientDiskSpace):
+            space.reserve(self.path.joinpath("b"), 600)
+        space.release(self.path.joinpath("a"))
+        space.reserve(self.path.joinpath("b"), 600)
+
+    def test_floor(self):
+        """The free space does not go below the floor."""
+        space = DiskSpace(self.path, min_free=500)
+        with self.assertRaises(InsufficientDiskSpace):
+            space.reserve(self.path.joinpath("a"), 600)
+        space.reserve(self.path.joinpath("a"), 500)
+
+    def test_allocated_space_is_not_counted_twice(self):
+        """A partial or preallocated file only needs what it lacks."""
+        file = self.path.joinpath("a")
+        file.write_bytes(b"x" * 8192)
+        if file.stat().st_blocks * 512 < 8192:
+            self.skipTest("The filesystem does not allocate blocks")
+        space = DiskSpace(self.path)
+        space.reserve(file, 8192)
+        self.assertEqual(space.available(), 1000)
+
+
+class DiskSpaceFreeTest(unittest.TestCase):
+    """Tests of DiskSpace.free."""
+
+    def test_directory_does_not_exist_yet(self):
+        """The free space is taken from the nearest existing parent."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = pathlib.Path(directory)
+            space = DiskSpace(path.joinpath("does", "not", "exist"))
+            with mock.patch("shutil.disk_usage") as disk_usage:
+                disk_usage.return_value.free = 123
+                self.assertEqual(space.free(), 123)
+            disk_usage.assert_called_once_with(path)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+# Eof
@@ -0,0 +1,103 @@
+# test_throttle.py
+"""Tests of the bandwidth and connection limits."""
+
+import threading
+import time
+import unittest
+
+from caroline_download.throttle import Throttle
+from caroline_download.throttle import TokenBucket
+from caroline_download.throttle import parse_bandwidth
+
+
+class ParseBandwidthTest(unittest.TestCase):
+    """Tests of parse_bandwidth."""
+
+    def test_units(self):
+        """Decimal and binary units are accepted, with or without /s."""
+        self.assertEqual(parse_bandwidth("400MB/s"), 400e6)
+        self.assertEqual(parse_bandwidth("1.5 GiB/s"), 1.5 * 1024**3)
+        self.assertEqual(parse_bandwidth("10kb"), 10e3)
+        self.assertEqual(parse_bandwidth(1000000), 1e6)
+
+    def test_invalid(self):
+        """Bandwidths that cannot be parsed are refused."""
+        for bandwidth in ("fast", "10 MBit/s", "-1MB/s", ""):
+            with self.subTest(bandwidth=bandwidth), self.assertRaises(ValueError):
+                parse_bandwidth(bandwidth)
+
+
+class TokenBucketTest(unittest.TestCase):
+    """Tests of TokenBucket."""
+
+    def test_burst_then_rate(self):
+        """A full bucket is consumed at once, then at the rate."""
+        bucket = TokenBucket(rate=1000, capacity=100)
+        started = time.monotonic()
+        bucket.consume(100)
+        self.assertLess(time.monotonic() - started, 0.05)
+        bucket.consume(200)
+        self.assertGreater(time.monotonic() - started, 0.18)
+
+    def test_shared_rate(self):
+        """Threads sharing a bucket share its rate."""
+        bucket = TokenBucket(rate=10000, capacity=100)
+        bucket.consume(100)
+        started = time.monotonic()
+        threads = [
+            threading.Thread(target=bucket.consume, args=(1000,)) for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertGreater(time.monotonic() - started, 0.28)
+
+
+class ThrottleTest(unittest.TestCase):
+    """Tests of Throttle."""
+
+    def test_connection_limit(self):
+        """No more connections than the limit are held at once."""
+        throttle = Throttle(max_connections=2)
+        with throttle.connection() as first, throttle.connection() as second:
+            self.assertTrue(first and second)
+            with throttle.connection(blocking=False) as third:
+                self.assertFalse(third)
+        with throttle.connection(blocking=False) as again:
+            self.assertTrue(again)
+
+    def test_waits_for_connection(self):
+        """A blocking request waits until a connection is released."""
+        throttle = Throttle(max_connections=1)
+        released = threading.Event()
+
+        def hold():
+            with throttle.connection():
+                time.sleep(0.1)
+                released.set()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        time.sleep(0.02)
+        with throttle.connection() as connected:
+            self.assertTrue(connected)
+            self.assertTrue(released.is_set())
+        thread.join()
+
+    def test_no_limits(self):
+        """Without limits every connection is granted and bytes are counted."""
+        throttle = Throttle()
+        with throttle.connection(blocking=False) as connected:
+            self.assertTrue(connected)
+        throttle.consume(10)
+        throttle.consume(5)
+        self.assertEqual(throttle.bytes, 15)
+        self.assertGreater(throttle.rate(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+# Eof
@@ -0,0 +1,151 @@
+# test_transfer.py
+"""Tests of transfers against the stand-in ASF server of the benchmarks."""
+
+import hashlib
+import json
+import pathlib
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import requests
+
+from caroline_download.transfer import segmented_transfer
+from caroline_download.transfer import segments_file_for
+from caroline_download.transfer import transfer
+
+sys.path.insert(0, str(pathlib.Path(__file__).parents[1].joinpath("benchmarks")))
+
+from asf_server import StandInASF  # noqa: E402
+
+# Not a multiple of the block size of the server, nor of the ranges
+PRODUCT_SIZE = 8 * 1024**2 + 12344
+
+
+def md5(file):
+    """Return the md5 checksum of a file."""
+    return hashlib.md5(pathlib.Path(file).read_bytes()).hexdigest()
+
+
+class ServerTestCase(unittest.TestCase):
+    """Base class of tests downloading from the stand-in server."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Start the stand-in server."""
+        cls.server = StandInASF(product_count=1, product_size=PRODUCT_SIZE)
+        cls.server.start()
+        file_name = cls.server.products[0]["properties"]["fileName"]
+        cls.url = f"{cls.server.url}/download/{file_name}"
+
+    @classmethod
+    def tearDownClass(cls):
+        """Stop the stand-in server."""
+        cls.server.stop()
+
+    def setUp(self):
+        """Create a directory to download to."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.target_file = pathlib.Path(self.directory.name, "product.zip.part")
+        self.session = requests.Session()
+
+    def tearDown(self):
+        """Remove the directory downloaded to."""
+        self.session.close()
+        self.directory.cleanup()
+
+
+class SegmentedTransferTest(ServerTestCase):
+    """Tests of segmented_transfer."""
+
+    def test_ranges_are_written_at_their_offset(self):
+        """Every range ends up at its offset, whichever thread takes it."""
+        for _ in range(6):
+            self.target_file.unlink(missing_ok=True)
+            checksum, size = segmented_transfer(
+                self.url,
+                self.target_file,
+                PRODUCT_SIZE,
+                segments=4,
+                min_segment_size=1024**2,
+                session=self.session,
+            )
+            self.assertIsNone(checksum)
+            self.assertEqual(size, PRODUCT_SIZE)
+            self.assertEqual(md5(self.target_file), self.server.md5sum)
+            self.assertFalse(segments_file_for(self.target_file).exists())
+
+    def test_resume_without_ranges_left(self):
+        """A record without ranges left completes the transfer."""
+        segmented_transfer(
+            self.url,
+            self.target_file,
+            PRODUCT_SIZE,
+            segments=4,
+            min_segment_size=1024**2,
+            session=self.session,
+        )
+        # Interrupted after the last range, before the record was removed
+        segments_file = segments_file_for(self.target_file)
+        segments_file.write_text(json.dumps({"size": PRODUCT_SIZE, "ranges": []}))
+
+        checksum, size = segmented_transfer(
+            self.url,
+            self.target_file,
+            PRODUCT_SIZE,
+            segments=4,
+            min_segment_size=1024**2,
+            session=self.session,
+        )
+        self.assertEqual(size, PRODUCT_SIZE)
+        self.assertEqual(md5(self.target_file), self.server.md5sum)
+        self.assertFalse(segments_file.exists())
+
+    def test_single_stream_honours_preallocate(self):
+        """A product too small to split is only preallocated when asked."""
+        for preallocate in (True, False):
+            self.target_file.unlink(missing_ok=True)
+            with mock.patch(
+                "caroline_download.transfer.transfer", wraps=transfer
+            ) as single_stream:
+                checksum, size = segmented_transfer(
+                    self.url,
+                    self.target_file,
+                    PRODUCT_SIZE,
+                    segments=4,
+                    min_segment_size=PRODUCT_SIZE,
+                    session=self.session,
+                    preallocate=preallocate,
+                )
+            with self.subTest(preallocate=preallocate):
+                self.assertEqual(checksum, self.server.md5sum)
+                self.assertEqual(size, PRODUCT_SIZE)
+                self.assertEqual(
+                    single_stream.call_args.args[5],
+                    PRODUCT_SIZE if preallocate else None,
+                )
+
+
+class TransferTest(ServerTestCase):
+    """Tests of transfer."""
+
+    def test_resume_partial_file_without_record(self):
+        """A partial file that was not preallocated is resumed, not truncated."""
+        with self.session.get(self.url, headers={"Range": "bytes=0-4999999"}) as r:
+            self.target_file.write_bytes(r.content)
+
+        checksum, size = transfer(
+            self.url, self.target_file, self.session, size=PRODUCT_SIZE
+        )
+        self.assertEqual(size, PRODUCT_SIZE)
+        self.assertEqual(checksum, self.server.md5sum)
+        self.assertEqual(md5(self.target_file), self.server.md5sum)
+        self.assertFalse(segments_file_for(self.target_file).exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+# Eof